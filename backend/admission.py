@@ -0,0 +1,260 @@
+"""
+Admission control: per-class and per-route concurrency limits with bounded queues.
+
+The sync route handlers share one worker threadpool (anyio's default of 40
+threads). Left alone, a burst of heavy admin calls (full user enrichment,
+recalculations, exports) can hold every thread while cheap member reads
+wait behind them. Each request is therefore assigned a priority class
+before it reaches a handler:
+
+  member_read    GET / HEAD not listed below
+  member_write   every other method not listed below
+  admin_heavy    the routes in HEAVY_ROUTES
+
+Each class runs at most ``concurrency`` requests at once. Up to ``queue``
+more wait their turn (first come, first served). A request that finds the
+queue full, or waits longer than ADMISSION_QUEUE_TIMEOUT_MS or the time
+left before its deadline (see deadlines.py), is answered at once with 503
+and a ``Retry-After`` estimated from the queue length and recent service
+times. Heavy routes also have their own limit, so one slow
+export cannot fill the whole heavy class. The class limits add up to less
+than the threadpool, so member reads keep their threads whatever the admin
+load is. Health and readiness checks and the API docs bypass admission.
+``POST /batch`` is not admitted itself: each of its sub-requests is
+admitted in its own class, as the separate call it replaces would be
+(see routers/batch.py).
+
+Queue depth, in-flight counts and shed counts are reported by
+``GET /admin/admission``.
+
+Configuration (environment), 0 concurrency = unlimited:
+  ADMISSION_READ_CONCURRENCY / ADMISSION_READ_QUEUE     member reads (default 24 / 64)
+  ADMISSION_WRITE_CONCURRENCY / ADMISSION_WRITE_QUEUE   member writes (default 8 / 32)
+  ADMISSION_HEAVY_CONCURRENCY / ADMISSION_HEAVY_QUEUE   heavy admin calls (default 2 / 4)
+  ADMISSION_QUEUE_TIMEOUT_MS   longest a request waits for a slot (default 5000)
+"""
+
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+import deadlines
+
+MEMBER_READ = 'member_read'
+MEMBER_WRITE = 'member_write'
+ADMIN_HEAVY = 'admin_heavy'
+
+# (method, path regex, concurrency of the route itself)
+HEAVY_ROUTES = [
+    ('GET', r'/users', 1),
+    ('GET', r'/contributions', 1),
+    ('GET', r'/contributions/calendar/matrix', 1),
+    ('GET', r'/loans', 1),
+    ('POST', r'/loans/simulate', 1),
+    ('GET', r'/forecast', 2),
+    ('POST', r'/forecast/scenario', 2),
+    ('GET', r'/statements/archive', 1),
+    ('POST', r'/admin/(recalculate-contributions|update-borrowing-limits|recalculate-all-totals-v2)', 1),
+    ('POST', r'/admin/recalculate-user-totals/[^/]+', 1),
+    ('POST', r'/admin/(sweep-contributions|accrue-interest|ledger/snapshots|statements)', 1),
+    ('POST', r'/admin/(archive-closed-loans|ensure-partitions)', 1),
+]
+
+EXEMPT_PATHS = {'/', '/health', '/ready', '/docs', '/redoc', '/openapi.json'}
+# Requests whose sub-requests are admitted one by one instead (see routers/batch.py)
+DISPATCH_PATHS = {'/batch'}
+MAX_RETRY_AFTER = 60
+
+class Limiter:
+    """
+    Concurrency limit with a bounded FIFO queue. Only used from the event
+    loop, so the counters need no lock.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.active = 0
+        self._waiters = deque()
+        self._service_ms = 0.0  # moving average of time holding a slot
+        self.stats = {'admitted': 0, 'queued': 0, 'shed_full': 0, 'shed_timeout': 0, 'max_queue_depth': 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> str | None:
+        """Take a slot; returns None when admitted, else the shed reason ('full' or 'timeout')."""
+        if self.concurrency <= 0:
+            self.stats['admitted'] += 1
+            return None
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.stats['admitted'] += 1
+            return None
+        if len(self._waiters) >= self.queue:
+            self.stats['shed_full'] += 1
+            return 'full'
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats['queued'] += 1
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._discard(waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                self.stats['shed_timeout'] += 1
+                return 'timeout'
+            raise
+        self.stats['admitted'] += 1
+        return None
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, held_ms: float | None = None):
+        if self.concurrency <= 0:
+            return
+        if held_ms is not None:
+            self._service_ms = held_ms if not self._service_ms else 0.8 * self._service_ms + 0.2 * held_ms
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the next waiter; ``active`` is unchanged
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work spread over the slots."""
+        if self.concurrency <= 0:
+            return 1
+        service_s = (self._service_ms or 1000.0) / 1000.0
+        estimate = (len(self._waiters) + 1) * service_s / self.concurrency
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def info(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'queue_size': self.queue,
+            'in_flight': self.active,
+            'queue_depth': len(self._waiters),
+            'avg_service_ms': round(self._service_ms, 1),
+            **self.stats,
+        }
+
+class AdmissionController:
+    def __init__(self, limits: dict, queue_timeout_ms: float = 5000.0, heavy_routes=HEAVY_ROUTES):
+        """``limits`` maps each class to ``(concurrency, queue)``."""
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.classes = {name: Limiter(name, concurrency, queue) for name, (concurrency, queue) in limits.items()}
+        heavy_queue = self.classes[ADMIN_HEAVY].queue
+        self.routes = [(method, re.compile(pattern + '/?'), Limiter(f"{method} {pattern}", concurrency, heavy_queue))
+                       for method, pattern, concurrency in heavy_routes]
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionController':
+        def limit(prefix: str, concurrency: int, queue: int) -> tuple:
+            return (int(os.getenv(f'ADMISSION_{prefix}_CONCURRENCY', str(concurrency))),
+                    int(os.getenv(f'ADMISSION_{prefix}_QUEUE', str(queue))))
+        return cls(
+            {MEMBER_READ: limit('READ', 24, 64), MEMBER_WRITE: limit('WRITE', 8, 32), ADMIN_HEAVY: limit('HEAVY', 2, 4)},
+            queue_timeout_ms=float(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', '5000')),
+        )
+
+    def classify(self, method: str, path: str) -> tuple:
+        """(class limiter, route limiter or None) for a request."""
+        for route_method, pattern, limiter in self.routes:
+            if route_method == method and pattern.fullmatch(path):
+                return self.classes[ADMIN_HEAVY], limiter
+        if method in ('GET', 'HEAD'):
+            return self.classes[MEMBER_READ], None
+        return self.classes[MEMBER_WRITE], None
+
+    async def admit(self, method: str, path: str) -> tuple:
+        """
+        Take the request's slots: ``(held, None)`` when admitted, or
+        ``(held, (limiter, reason))`` when a limiter sheds it. The caller
+        releases ``held`` either way.
+        """
+        class_limiter, route_limiter = self.classify(method, path)
+        deadline = deadlines.current()
+        held = []
+        try:
+            # Route first, so requests queued for one busy route do not hold class slots
+            for limiter in (route_limiter, class_limiter):
+                if limiter is None:
+                    continue
+                timeout = self.queue_timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline.remaining())
+                reason = await limiter.acquire(timeout)
+                if reason is not None:
+                    return held, (limiter, reason)
+                held.append(limiter)
+        except BaseException:
+            for limiter in held:
+                limiter.release()
+            raise
+        return held, None
+
+    def info(self) -> dict:
+        return {
+            'queue_timeout_ms': self.queue_timeout * 1000,
+            'classes': {name: limiter.info() for name, limiter in self.classes.items()},
+            'routes': {limiter.name: limiter.info() for _, _, limiter in self.routes if limiter.stats['admitted'] or limiter.active},
+        }
+
+controller = AdmissionController.from_env()
+
+class AdmissionMiddleware:
+    """ASGI middleware: admit, queue or shed each HTTP request (see module docstring)."""
+
+    def __init__(self, app, controller: AdmissionController = controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http' or scope['path'] in EXEMPT_PATHS or scope['path'] in DISPATCH_PATHS
+                or scope['method'] == 'OPTIONS'):
+            await self.app(scope, receive, send)
+            return
+        held, shed = await self.controller.admit(scope['method'], scope['path'])
+        try:
+            if shed is not None:
+                await self._shed(*shed, scope, receive, send)
+                return
+            started = time.monotonic()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                held_ms = (time.monotonic() - started) * 1000
+                for limiter in held:
+                    limiter.release(held_ms)
+                held = []
+        finally:
+            for limiter in held:
+                limiter.release()
+
+    async def _shed(self, limiter: Limiter, reason: str, scope, receive, send):
+        await shed_response(limiter, reason)(scope, receive, send)
+
+def shed_response(limiter: Limiter, reason: str) -> JSONResponse:
+    """503 for a request ``limiter`` shed, with a Retry-After estimate."""
+    detail = 'Server busy, retry later' if reason == 'full' else 'Timed out waiting for capacity, retry later'
+    return JSONResponse({'detail': detail}, status_code=503, headers={'Retry-After': str(limiter.retry_after())})
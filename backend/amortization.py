@@ -0,0 +1,335 @@
+"""
+Weekly amortization schedules and what-if projections for loans.
+
+Loans are repaid in ``duration_weeks`` weekly instalments of
+``weekly_payment`` (the last one absorbs the rounding remainder). Interest,
+on loans that carry a rate, is added to ``remaining_balance`` by the accrual
+batch (interest.py); projections start from that balance and do not add
+future interest. Instalment k falls due k weeks after the loan was approved.
+Actual ``loan_payments`` are bucketed into the week they were made in, which
+yields per-week paid amounts, arrears and balances. From the current balance onwards the member is assumed
+to pay the regular instalment each week.
+
+Projections are computed for many rows at once: each row is a loan, or a
+scenario for the same loan. A row is a starting balance plus a planned
+payment per week. Rows are laid out as a rows × weeks matrix and solved with
+cumulative sums, using NumPy when it is installed and an integer loop
+otherwise. All money is integer cents (see aggregation.py).
+
+Usage:
+    schedule = build_schedule(loan, payments, today)
+    projection = project(balances, weekly, extra=..., lump=..., skips=...)
+    projection.payoff_weeks[i]   # weeks from now until row i is repaid, None if never
+"""
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from aggregation import to_cents
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python fallback below
+    np = None
+
+# Projections stop after ten years; a row still owing then never pays off
+MAX_PROJECTION_WEEKS = 520
+
+OPEN_LOAN_STATUSES = ('approved',)
+
+def parse_date(value) -> date | None:
+    """ISO date/timestamp string (or date/datetime) to a date, None if missing or invalid."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).date()
+    except ValueError:
+        return None
+
+def loan_start(loan: dict, today: date) -> date:
+    """Instalments are counted from approval; pending loans are scheduled as if approved today."""
+    return parse_date(loan.get('approved_at')) or today
+
+def weekly_payment_cents(loan: dict) -> int:
+    weekly = to_cents(loan.get('weekly_payment'))
+    if weekly:
+        return weekly
+    amount = Decimal(str(loan.get('amount') or 0))
+    duration = max(int(loan.get('duration_weeks') or 1), 1)
+    return to_cents((amount / duration).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)) or 0
+
+def installments(amount: int, weekly: int, duration: int) -> list:
+    """Scheduled payment per week: ``weekly`` until the last week, which takes the remainder."""
+    plan = []
+    left = amount
+    for week in range(1, max(duration, 1) + 1):
+        due = left if week == duration else min(weekly, left)
+        plan.append(due)
+        left -= due
+    if left > 0:
+        plan[-1] += left
+    return plan
+
+def payment_week(start: date, paid_on: date) -> int:
+    """1-based instalment week a payment counts towards (early payments count for week 1)."""
+    days = (paid_on - start).days
+    return max(1, -(-days // 7))
+
+def elapsed_weeks(start: date, today: date) -> int:
+    """Instalments whose due date is on or before ``today``."""
+    return max(0, (today - start).days // 7)
+
+class Projection:
+    """
+    Result of :func:`project` for ``rows`` rows over ``weeks`` weeks.
+
+    ``payments[i][t]`` / ``balances[i][t]`` are row i's payment in and balance
+    after week t+1 (lists of ints, or NumPy arrays); ``payoff_weeks[i]`` is
+    the 1-based week the balance reaches zero (0 if already repaid, None if
+    not within the horizon); ``total_paid[i]`` is the sum of the payments.
+    """
+    __slots__ = ('payments', 'balances', 'payoff_weeks', 'total_paid')
+
+    def __init__(self, payments, balances, payoff_weeks, total_paid):
+        self.payments = payments
+        self.balances = balances
+        self.payoff_weeks = payoff_weeks
+        self.total_paid = total_paid
+
+def _horizon(balances, weekly, extra, lump, skips) -> int:
+    weeks = 1
+    for b, w, e, l, s in zip(balances, weekly, extra, lump, skips):
+        per_week = w + e
+        if b - l <= 0:
+            continue
+        if per_week <= 0:
+            return MAX_PROJECTION_WEEKS
+        weeks = max(weeks, -(-(b - l) // per_week) + len(s) + 1)
+    return min(weeks, MAX_PROJECTION_WEEKS)
+
+def _project_numpy(balances, weekly, extra, lump, skips, weeks):
+    start = np.asarray(balances, dtype=np.int64)
+    planned = np.repeat((np.asarray(weekly, dtype=np.int64) + np.asarray(extra, dtype=np.int64))[:, None], weeks, axis=1)
+    for row, skipped in enumerate(skips):
+        cols = [w - 1 for w in skipped if 1 <= w <= weeks]
+        if cols:
+            planned[row, cols] = 0
+    planned[:, 0] += np.asarray(lump, dtype=np.int64)
+    paid_cum = np.minimum(np.cumsum(planned, axis=1), np.maximum(start, 0)[:, None])
+    payments = np.diff(paid_cum, axis=1, prepend=0)
+    balance = start[:, None] - paid_cum
+    cleared = balance <= 0
+    payoff = [0 if b <= 0 else (int(idx) + 1 if row_cleared.any() else None)
+              for b, idx, row_cleared in zip(balances, cleared.argmax(axis=1), cleared)]
+    return Projection(payments, balance, payoff, paid_cum[:, -1].tolist())
+
+def _project_python(balances, weekly, extra, lump, skips, weeks):
+    all_payments, all_balances, payoff, total = [], [], [], []
+    for b, w, e, l, skipped in zip(balances, weekly, extra, lump, skips):
+        skipped = set(skipped)
+        left = max(b, 0)
+        row_payments, row_balances = [], []
+        paid_off = 0 if b <= 0 else None
+        for week in range(1, weeks + 1):
+            due = 0 if week in skipped else w + e
+            if week == 1:
+                due += l
+            pay = min(due, left)
+            left -= pay
+            row_payments.append(pay)
+            row_balances.append(left)
+            if paid_off is None and left <= 0:
+                paid_off = week
+        all_payments.append(row_payments)
+        all_balances.append(row_balances)
+        payoff.append(paid_off)
+        total.append(sum(row_payments))
+    return Projection(all_payments, all_balances, payoff, total)
+
+def project(balances, weekly, extra=None, lump=None, skips=None, weeks: int | None = None) -> Projection:
+    """
+    Project repayment of several balances at once.
+
+    Each row i starts at ``balances[i]`` cents and pays ``weekly[i] +
+    extra[i]`` per week, plus ``lump[i]`` on top in week 1, except in the
+    1-based weeks listed in ``skips[i]``. Payments never exceed the remaining
+    balance. ``weeks`` defaults to just long enough for every row to pay off
+    (capped at MAX_PROJECTION_WEEKS).
+    """
+    rows = len(balances)
+    extra = list(extra) if extra is not None else [0] * rows
+    lump = list(lump) if lump is not None else [0] * rows
+    skips = list(skips) if skips is not None else [()] * rows
+    if weeks is None:
+        weeks = _horizon(balances, weekly, extra, lump, skips)
+    if np is not None and rows:
+        return _project_numpy(balances, weekly, extra, lump, skips, weeks)
+    return _project_python(balances, weekly, extra, lump, skips, weeks)
+
+def _history(loan: dict, payments: list, today: date):
+    """(start, paid_by_week, elapsed weeks, last history week) for one loan."""
+    start = loan_start(loan, today)
+    paid_by_week = {}
+    for p in payments:
+        paid_on = parse_date(p.get('payment_date')) or parse_date(p.get('created_at'))
+        cents = to_cents(p.get('amount'))
+        if paid_on is None or not cents:
+            continue
+        week = payment_week(start, paid_on)
+        paid_by_week[week] = paid_by_week.get(week, 0) + cents
+    elapsed = elapsed_weeks(start, today) if loan.get('approved_at') else 0
+    # Payments made ahead of their due date still belong to the history
+    return start, paid_by_week, elapsed, max([elapsed] + list(paid_by_week))
+
+def _remaining(loan: dict) -> int:
+    remaining = to_cents(loan.get('remaining_balance'))
+    return max(remaining if remaining is not None else (to_cents(loan.get('amount')) or 0), 0)
+
+def _is_open(loan: dict) -> bool:
+    return loan.get('status') in OPEN_LOAN_STATUSES and _remaining(loan) > 0
+
+def build_schedule(loan: dict, payments: list, today: date) -> dict:
+    """
+    Full weekly schedule for one loan: history from ``payments`` (loan_payments
+    rows) up to ``today``, then the projected regular instalments until payoff.
+    Money values are integer cents.
+    """
+    start, paid_by_week, elapsed, history_weeks = _history(loan, payments, today)
+    amount = to_cents(loan.get('amount')) or 0
+    duration = max(int(loan.get('duration_weeks') or 1), 1)
+    weekly = weekly_payment_cents(loan)
+    plan = installments(amount, weekly, duration)
+    remaining = _remaining(loan)
+    paid_to_date = sum(paid_by_week.values())
+    is_open = _is_open(loan)
+
+    projection = project([remaining], [weekly]) if is_open else None
+    projected_weeks = projection.payoff_weeks[0] if projection is not None else 0
+    last_week = max(duration, history_weeks + (projected_weeks or len(projection.payments[0]) if projection is not None else 0))
+
+    rows = []
+    scheduled_cum = paid_cum = 0
+    for week in range(1, last_week + 1):
+        scheduled = plan[week - 1] if week <= duration else 0
+        scheduled_cum += scheduled
+        if week <= history_weeks:
+            payment = paid_by_week.get(week, 0)
+            paid_cum += payment
+            balance = amount - paid_cum
+            if paid_cum >= scheduled_cum:
+                status = 'paid'
+            elif week > elapsed:
+                status = 'upcoming'
+            else:
+                status = 'partial' if payment else 'missed'
+        else:
+            offset = week - history_weeks - 1
+            payment = 0
+            if projection is not None and offset < len(projection.payments[0]):
+                payment = int(projection.payments[0][offset])
+            paid_cum += payment
+            balance = remaining - (paid_cum - paid_to_date)
+            status = 'projected' if is_open else 'upcoming'
+        rows.append({
+            'week': week,
+            'due_date': start + timedelta(weeks=week),
+            'scheduled_payment': scheduled,
+            'scheduled_balance': amount - scheduled_cum,
+            'payment': payment,
+            'balance': max(balance, 0),
+            'arrears': max(scheduled_cum - paid_cum, 0),
+            'status': status,
+        })
+
+    scheduled_to_date = sum(plan[:min(elapsed, duration)])
+    payoff_week = None
+    if not is_open:
+        payoff_week = history_weeks if remaining <= 0 and loan.get('status') == 'paid' else None
+    elif projected_weeks is not None:
+        payoff_week = history_weeks + projected_weeks
+    return {
+        'start_date': start,
+        'amount': amount,
+        'weekly_payment': weekly,
+        'duration_weeks': duration,
+        'paid_to_date': paid_to_date,
+        'remaining_balance': remaining,
+        'arrears': max(scheduled_to_date - paid_to_date, 0) if is_open else 0,
+        'weeks_elapsed': elapsed,
+        'weeks_remaining': max(payoff_week - elapsed, 0) if is_open and payoff_week is not None else (0 if not is_open else None),
+        'payoff_date': start + timedelta(weeks=payoff_week) if payoff_week is not None else None,
+        'on_track': not is_open or paid_to_date >= scheduled_to_date,
+        'schedule': rows,
+    }
+
+def _scenario_results(rows: list, projection: Projection, offsets: list, starts: list, include_balances: bool) -> list:
+    results = []
+    for i, scenario in enumerate(rows):
+        weeks = projection.payoff_weeks[i]
+        result = {
+            'name': scenario.get('name'),
+            'weeks_to_payoff': weeks,
+            'payoff_date': starts[i] + timedelta(weeks=offsets[i] + weeks) if weeks is not None else None,
+            'total_paid': int(projection.total_paid[i]),
+        }
+        if include_balances:
+            horizon = weeks if weeks else len(projection.balances[i])
+            result['balances'] = [int(b) for b in projection.balances[i][:horizon]]
+        results.append(result)
+    return results
+
+BASELINE = {'name': 'baseline', 'extra_weekly': 0, 'lump_sum': 0, 'skip_weeks': ()}
+
+def simulate(loan: dict, payments: list, scenarios: list, today: date, include_balances: bool = False) -> dict:
+    """
+    What-if projections for one open loan: a baseline (regular instalments)
+    plus one row per scenario, solved in a single :func:`project` call.
+
+    ``scenarios`` are dicts with ``name``, ``extra_weekly``, ``lump_sum`` (cents)
+    and ``skip_weeks`` (1-based offsets from the first week not yet paid).
+    """
+    start, _, _, history_weeks = _history(loan, payments, today)
+    remaining = _remaining(loan) if _is_open(loan) else 0
+    weekly = weekly_payment_cents(loan)
+    rows = [BASELINE] + list(scenarios)
+    projection = project(
+        [remaining] * len(rows), [weekly] * len(rows),
+        extra=[s['extra_weekly'] for s in rows],
+        lump=[s['lump_sum'] for s in rows],
+        skips=[tuple(s['skip_weeks']) for s in rows],
+    )
+    results = _scenario_results(rows, projection, [history_weeks] * len(rows), [start] * len(rows), include_balances)
+    base_weeks = results[0]['weeks_to_payoff']
+    for result in results:
+        weeks = result['weeks_to_payoff']
+        result['weeks_saved'] = base_weeks - weeks if weeks is not None and base_weeks is not None else None
+    return {'remaining_balance': remaining, 'baseline': results[0], 'scenarios': results[1:]}
+
+def project_open_loans(loans: list, today: date, scenario: dict | None = None, weeks: int | None = None):
+    """
+    Project every open loan in ``loans`` under one scenario (default: regular
+    instalments) in a single vectorized :func:`project` call. Projections
+    start from ``today``; last-paid history is not needed fund-wide.
+
+    Returns ``(open_loans, projection)`` with rows in ``open_loans`` order.
+    """
+    scenario = scenario or BASELINE
+    open_loans = [l for l in loans if _is_open(l)]
+    projection = project(
+        [_remaining(l) for l in open_loans], [weekly_payment_cents(l) for l in open_loans],
+        extra=[scenario['extra_weekly']] * len(open_loans),
+        lump=[scenario['lump_sum']] * len(open_loans),
+        skips=[tuple(scenario['skip_weeks'])] * len(open_loans),
+        weeks=weeks,
+    )
+    return open_loans, projection
+
+def weekly_totals(projection: Projection) -> list:
+    """Sum of all rows' payments per projected week."""
+    if np is not None and isinstance(projection.payments, np.ndarray):
+        return [int(v) for v in projection.payments.sum(axis=0)]
+    return [sum(col) for col in zip(*projection.payments)]
@@ -10,75 +10,94 @@ We can fix by either:
   B) Reducing loan remaining balances (NOT applied automatically here)
 
 This script only GENERATES SQL; it does not mutate the database directly.
+Members are paged and audited in parallel chunks (see batch.py); the repair
+SQL is written as multi-row statements of --batch-size rows each.
 Run:
   python backend/audit_repair_user_financials.py > repair_plan.sql
+  python backend/audit_repair_user_financials.py --workers 8 --output repair_plan.sql
 Then review and execute chosen sections.
 """
-from decimal import Decimal, ROUND_HALF_UP
-from collections import defaultdict
+import argparse
 import datetime
-import supabase_client
+import sys
+from decimal import Decimal, ROUND_HALF_UP
 
-if not hasattr(supabase_client, 'supabase'):
-    raise RuntimeError('Supabase client failed to initialize (missing credentials or version mismatch).')
-supabase = getattr(supabase_client, 'supabase')
+import batch
+from aggregation import cents_to_decimal
 
 CONTRIB_STATUS_TARGET = 'completed'  # matches enum
+LIMIT_RATIO = Decimal('0.75')
 
-# Pull data
-profiles = supabase.table('profiles').select('*').execute().data or []
-contribs = supabase.table('contributions').select('user_id, amount, status, period_year, period_week').execute().data or []
-loans = supabase.table('loans').select('user_id, remaining_balance, status').eq('status','approved').execute().data or []
+def audit_chunk(members, agg):
+    """Under-collateralized members of one chunk."""
+    rows = []
+    for m in members:
+        uid = m['id']
+        total_contributed = cents_to_decimal(agg.contributed.get(uid))
+        loan_balance = cents_to_decimal(agg.loan_balance.get(uid))
+        if loan_balance > 0 and total_contributed * LIMIT_RATIO < loan_balance:
+            required_min = loan_balance / LIMIT_RATIO
+            rows.append({
+                'id': uid,
+                'current_total_contributed': total_contributed,
+                'current_loan_balance': loan_balance,
+                'required_min_total_contributed': required_min.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+                'deficit_to_cover': (required_min - total_contributed).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+            })
+    return rows
 
-paid_sum = defaultdict(lambda: Decimal('0.00'))
-for c in contribs:
-    if c.get('status') == CONTRIB_STATUS_TARGET:
-        try:
-            paid_sum[c['user_id']] += Decimal(str(c.get('amount',0)))
-        except Exception:
-            pass
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', '-o', help='write SQL here instead of stdout')
+    parser.add_argument('--workers', type=int, default=batch.DEFAULT_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=batch.DEFAULT_CHUNK_SIZE, help='members per worker task')
+    parser.add_argument('--page-size', type=int, default=batch.DEFAULT_PAGE_SIZE, help='rows per request')
+    parser.add_argument('--batch-size', type=int, default=batch.DEFAULT_SQL_BATCH, help='rows per generated statement')
+    args = parser.parse_args(argv)
 
-loan_balance = defaultdict(lambda: Decimal('0.00'))
-for l in loans:
-    try:
-        loan_balance[l['user_id']] += Decimal(str(l.get('remaining_balance',0)))
-    except Exception:
-        pass
+    import supabase_client
+    if not hasattr(supabase_client, 'supabase'):
+        raise RuntimeError('Supabase client failed to initialize (missing credentials or version mismatch).')
 
-now = datetime.datetime.utcnow()
-iso_year, iso_week, _ = now.isocalendar()
+    # Only offending members are kept; the sections below all need the full list
+    under_collateralized = []
+    for chunk in batch.run_member_batches(supabase_client.supabase, audit_chunk, 'id', args.workers,
+                                          args.chunk_size, args.page_size, batch.stderr_progress('audit')):
+        under_collateralized.extend(chunk)
 
-under_collateralized = []
-for p in profiles:
-    uid = p['id']
-    total_contributed = paid_sum[uid]
-    required_min = loan_balance[uid] / Decimal('0.75') if loan_balance[uid] > 0 else Decimal('0.00')
-    if loan_balance[uid] > 0 and total_contributed * Decimal('0.75') < loan_balance[uid]:
-        deficit = (required_min - total_contributed).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        under_collateralized.append({
-            'id': uid,
-            'current_total_contributed': total_contributed,
-            'current_loan_balance': loan_balance[uid],
-            'required_min_total_contributed': required_min.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
-            'deficit_to_cover': deficit
-        })
+    iso_year, iso_week, _ = datetime.datetime.utcnow().isocalendar()
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        writer = batch.SqlWriter(out, args.batch_size)
+        writer.comment('AUDIT REPORT: Under-collateralized Users')
+        for row in under_collateralized:
+            writer.comment(f"User {row['id']} loan_balance={row['current_loan_balance']} total_contributed={row['current_total_contributed']} "
+                           f"required_min={row['required_min_total_contributed']} deficit={row['deficit_to_cover']}")
 
-print('-- AUDIT REPORT: Under-collateralized Users')
-for row in under_collateralized:
-    print(f"-- User {row['id']} loan_balance={row['current_loan_balance']} total_contributed={row['current_total_contributed']} required_min={row['required_min_total_contributed']} deficit={row['deficit_to_cover']}")
+        writer.comment()
+        writer.comment('OPTION A: Direct profile field adjustments (does NOT create contribution records)')
+        writer.update_from_values(
+            'profiles', 'id', ['total_contributed', 'borrowing_limit'],
+            ((row['id'], row['required_min_total_contributed'], (row['required_min_total_contributed'] * LIMIT_RATIO).quantize(Decimal('0.01')))
+             for row in under_collateralized),
+            casts={'id': 'uuid', 'total_contributed': 'numeric', 'borrowing_limit': 'numeric'},
+            extra_set='updated_at = NOW()')
 
-print('\n-- OPTION A: Direct profile field adjustments (does NOT create contribution records)')
-for row in under_collateralized:
-    new_total = row['required_min_total_contributed']
-    new_borrowing_limit = (new_total * Decimal('0.75')).quantize(Decimal('0.01'))
-    print(f"UPDATE profiles SET total_contributed = {new_total}, borrowing_limit = {new_borrowing_limit}, updated_at = NOW() WHERE id = '{row['id']}';")
+        writer.comment()
+        writer.comment('OPTION B: Backfill a single synthetic completed contribution to cover deficit')
+        writer.comment('NOTE: Adjust period_year/week if collision occurs with existing UNIQUE(user_id, period_year, period_week).')
+        writer.insert(
+            'contributions', ['id', 'user_id', 'period_year', 'period_week', 'amount', 'status', 'due_date', 'paid_at'],
+            ((batch.SqlExpr('gen_random_uuid()'), row['id'], iso_year, iso_week, row['deficit_to_cover'], CONTRIB_STATUS_TARGET,
+              batch.SqlExpr('CURRENT_DATE'), batch.SqlExpr('NOW()'))
+             for row in under_collateralized if row['deficit_to_cover'] > 0),
+            suffix='ON CONFLICT DO NOTHING')
 
-print('\n-- OPTION B: Backfill a single synthetic completed contribution to cover deficit')
-print('-- NOTE: Adjust period_year/week if collision occurs with existing UNIQUE(user_id, period_year, period_week).')
-for row in under_collateralized:
-    deficit = row['deficit_to_cover']
-    if deficit <= 0:
-        continue
-    print(f"INSERT INTO contributions (id, user_id, period_year, period_week, amount, status, due_date, paid_at) VALUES (gen_random_uuid(), '{row['id']}', {iso_year}, {iso_week}, {deficit}, '{CONTRIB_STATUS_TARGET}', CURRENT_DATE, NOW()) ON CONFLICT DO NOTHING;")
+        writer.comment()
+        writer.comment('After choosing & executing one option, run 002_recompute_user_metrics.sql to normalize derived fields again.')
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
-print('\n-- After choosing & executing one option, run 002_recompute_user_metrics.sql to normalize derived fields again.')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Supabase access-token verification.
+
+Tokens are verified locally; no request waits on the network:
+  * Signing keys come from the project's JWKS endpoint and are kept in memory.
+    A background thread refetches them every JWKS_REFRESH_SECONDS. A token
+    whose ``kid`` is unknown (a rotated key) triggers one inline refetch, at
+    most once per JWKS_MIN_REFETCH_SECONDS.
+  * Projects that still sign with the shared HS256 secret set
+    SUPABASE_JWT_SECRET instead; no keys are fetched then.
+  * Verified claims are kept in a bounded LRU keyed by the SHA-256 of the
+    token, and only until the token's ``exp``, so a client sending the same
+    token again costs one hash and a dict lookup, not a signature check.
+
+The member's role and family are read from the token (``user_role`` /
+``family_id`` from a custom access token hook, else ``app_metadata``), not
+looked up per request. Deployment operators (who run maintenance across all
+families, see routers/admin.py) carry ``operator: true`` the same way; it
+is granted through the service role, never by a family admin.
+
+Configuration (environment):
+  SUPABASE_URL               project URL; the JWKS lives under /auth/v1/.well-known/jwks.json
+  SUPABASE_JWT_SECRET        (optional) legacy HS256 secret
+  JWT_AUDIENCE               expected ``aud`` (default 'authenticated')
+  JWKS_REFRESH_SECONDS       background key refresh interval (default 600)
+  JWKS_MIN_REFETCH_SECONDS   least time between inline refetches for unknown keys (default 30)
+  AUTH_TOKEN_CACHE_SIZE      verified tokens kept (default 2048)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+from jose import jwt
+from jose.exceptions import JOSEError
+
+FETCH_TIMEOUT = 5.0
+ASYMMETRIC_ALGORITHMS = ('RS256', 'ES256')
+
+class AuthError(Exception):
+    """The token is missing, malformed, expired or not signed by the project."""
+
+class JwksCache:
+    def __init__(self, url: str | None, refresh_seconds: float = 600.0, min_refetch_seconds: float = 30.0):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refetch_seconds = min_refetch_seconds
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.stats = {'fetches': 0, 'fetch_errors': 0, 'inline_fetches': 0}
+
+    @classmethod
+    def from_env(cls) -> 'JwksCache':
+        base = os.getenv('SUPABASE_URL')
+        return cls(
+            f"{base.rstrip('/')}/auth/v1/.well-known/jwks.json" if base else None,
+            refresh_seconds=float(os.getenv('JWKS_REFRESH_SECONDS', '600')),
+            min_refetch_seconds=float(os.getenv('JWKS_MIN_REFETCH_SECONDS', '30')),
+        )
+
+    def _fetch(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=FETCH_TIMEOUT) as resp:
+                keys = json.load(resp).get('keys', [])
+        except (OSError, ValueError):
+            with self._lock:
+                self.stats['fetch_errors'] += 1
+            return
+        with self._lock:
+            # Keep the old keys on an empty answer; tokens signed with them are still valid
+            if keys:
+                self._keys = {k.get('kid'): k for k in keys}
+            self._fetched_at = time.monotonic()
+            self.stats['fetches'] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.refresh_seconds):
+            self._fetch()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='jwks-refresh', daemon=True)
+        self._fetch()
+        self._thread.start()
+
+    def get(self, kid: str | None) -> dict | None:
+        if self.url is None:
+            raise AuthError('SUPABASE_URL is not configured')
+        if self._thread is None:
+            self._start()
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._fetched_at >= self.min_refetch_seconds:
+            with self._lock:
+                self.stats['inline_fetches'] += 1
+            self._fetch()
+            key = self._keys.get(kid)
+        return key
+
+    def prefetch(self):
+        """Fetch the keys and start the refresh thread now instead of on the first token (startup warm-up)."""
+        if self.url is not None and self._thread is None:
+            self._start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def info(self) -> dict:
+        return {'url': self.url, 'keys': len(self._keys), 'age_seconds': round(time.monotonic() - self._fetched_at, 1)
+                if self._fetched_at else None, **self.stats}
+
+class VerifiedTokenCache:
+    """LRU of token hash -> (exp, claims); an entry is never served past its exp."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, digest: str, claims: dict):
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entries[digest] = (exp, claims)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self) -> dict:
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+jwks_cache = JwksCache.from_env()
+token_cache = VerifiedTokenCache(int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '2048')))
+
+def _decode(token: str) -> dict:
+    try:
+        header = jwt.get_unverified_header(token)
+    except JOSEError:
+        raise AuthError('Malformed token')
+    alg = header.get('alg')
+    audience = os.getenv('JWT_AUDIENCE', 'authenticated')
+    secret = os.getenv('SUPABASE_JWT_SECRET')
+    if alg == 'HS256' and secret:
+        key = secret
+    elif alg in ASYMMETRIC_ALGORITHMS:
+        key = jwks_cache.get(header.get('kid'))
+        if key is None:
+            raise AuthError('Unknown signing key')
+    else:
+        raise AuthError(f"Unsupported token algorithm {alg}")
+    try:
+        # A token without exp would never expire; one without sub names nobody
+        return jwt.decode(token, key, algorithms=[alg], audience=audience,
+                          options={'require_exp': True, 'require_sub': True})
+    except JOSEError as exc:
+        raise AuthError(str(exc) or 'Invalid token')
+
+def verify_token(token: str) -> dict:
+    """Claims of a valid access token; raises AuthError otherwise."""
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    claims = token_cache.get(digest)
+    if claims is None:
+        claims = _decode(token)
+        if not claims.get('sub'):
+            raise AuthError('Token has no subject')
+        token_cache.put(digest, claims)
+    return claims
+
+def role_from_claims(claims: dict) -> str:
+    role = claims.get('user_role') or (claims.get('app_metadata') or {}).get('role')
+    return role if role in ('admin', 'member', 'user') else 'member'
+
+def operator_from_claims(claims: dict) -> bool:
+    """Whether the token belongs to a deployment operator rather than only a family's admin."""
+    return (claims.get('operator') or (claims.get('app_metadata') or {}).get('operator')) is True
+
+def family_from_claims(claims: dict) -> str | None:
+    """The member's family (see tenancy.py), if the token carries it."""
+    return claims.get('family_id') or (claims.get('app_metadata') or {}).get('family_id')
@@ -0,0 +1,170 @@
+"""
+Paged, streaming batch engine for fund-wide maintenance jobs.
+
+The audit and recompute scripts used to pull whole tables with a single
+``execute()`` at import time. Here members are read page by page (keyset
+pagination on ``id``), split into chunks, and each chunk's contributions and
+loans are folded into integer-cent totals (see aggregation.py) on a worker
+thread. Only per-member totals are kept, so memory stays bounded by the page
+size no matter how many contribution rows exist.
+
+Generated SQL is written through :class:`SqlWriter`, which batches rows into
+multi-row ``INSERT`` / ``UPDATE ... FROM (VALUES ...)`` statements.
+"""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from aggregation import FundAggregator
+
+DEFAULT_PAGE_SIZE = 5000     # rows per PostgREST request
+DEFAULT_CHUNK_SIZE = 200     # members per worker task
+DEFAULT_WORKERS = 4
+DEFAULT_SQL_BATCH = 500      # rows per generated SQL statement
+
+def iter_pages(client, table: str, columns: str, filters: list = (), page_size: int = DEFAULT_PAGE_SIZE, key: str = 'id'):
+    """
+    Yield lists of rows from ``table`` using keyset pagination on ``key``.
+
+    ``filters`` is a list of ``(method, column, value)`` tuples applied to each
+    page query, e.g. ``[('eq', 'status', 'approved'), ('in_', 'user_id', ids)]``.
+    ``key`` must be part of ``columns``.
+    """
+    last = None
+    while True:
+        query = client.table(table).select(columns)
+        for method, column, value in filters:
+            query = getattr(query, method)(column, value)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.order(key).limit(page_size).execute().data or []
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1][key]
+
+def iter_member_chunks(client, columns: str = 'id', chunk_size: int = DEFAULT_CHUNK_SIZE, page_size: int = DEFAULT_PAGE_SIZE):
+    """Yield lists of profile rows, ``chunk_size`` members at a time."""
+    chunk = []
+    for page in iter_pages(client, 'profiles', columns, page_size=page_size):
+        for row in page:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def aggregate_chunk(client, members: list, contribution_status: str = 'completed', page_size: int = DEFAULT_PAGE_SIZE) -> FundAggregator:
+    """Fold one chunk of members' completed contributions and approved loan balances."""
+    member_ids = [m['id'] for m in members]
+    agg = FundAggregator(member_ids)
+    contrib_filters = [('eq', 'status', contribution_status), ('in_', 'user_id', member_ids)]
+    for page in iter_pages(client, 'contributions', 'id, user_id, amount', contrib_filters, page_size):
+        agg.add_contributions(page)
+    loan_filters = [('eq', 'status', 'approved'), ('in_', 'user_id', member_ids)]
+    for page in iter_pages(client, 'loans', 'id, user_id, remaining_balance', loan_filters, page_size):
+        agg.add_loans(page)
+    return agg
+
+def run_member_batches(client, process_chunk, member_columns: str = 'id', workers: int = DEFAULT_WORKERS,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, page_size: int = DEFAULT_PAGE_SIZE, progress=None):
+    """
+    Run ``process_chunk(members, agg)`` for every member chunk on a thread pool.
+
+    Yields each chunk's return value in member order as soon as it (and every
+    chunk before it) is done, so callers can stream output. At most
+    ``2 * workers`` chunks are in flight at a time.
+    """
+    def work(members):
+        return process_chunk(members, aggregate_chunk(client, members, page_size=page_size))
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = []
+        for members in iter_member_chunks(client, member_columns, chunk_size, page_size):
+            pending.append((len(members), pool.submit(work, members)))
+            while len(pending) >= 2 * max(workers, 1):
+                count, future = pending.pop(0)
+                result = future.result()
+                done += count
+                if progress:
+                    progress(done)
+                yield result
+        for count, future in pending:
+            result = future.result()
+            done += count
+            if progress:
+                progress(done)
+            yield result
+
+def stderr_progress(label: str):
+    def report(done: int):
+        print(f"-- {label}: {done} members processed", file=sys.stderr)
+    return report
+
+class SqlExpr(str):
+    """A raw SQL expression (e.g. ``NOW()``) written verbatim instead of quoted."""
+
+def sql_literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, SqlExpr):
+        return str(value)
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, Decimal)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+class SqlWriter:
+    """Buffer rows and write them as multi-row SQL statements."""
+
+    def __init__(self, out, batch_size: int = DEFAULT_SQL_BATCH):
+        self.out = out
+        self.batch_size = batch_size
+        self.statements = 0
+
+    def comment(self, text: str = ''):
+        self.out.write(f"-- {text}\n" if text else "\n")
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def insert(self, table: str, columns: list, rows, suffix: str = ''):
+        """``INSERT INTO table (...) VALUES (...), (...) [suffix];`` per batch."""
+        for batch in self._batches(rows):
+            values = ',\n  '.join('(' + ', '.join(sql_literal(v) for v in row) + ')' for row in batch)
+            self.out.write(f"INSERT INTO {table} ({', '.join(columns)}) VALUES\n  {values}{' ' + suffix if suffix else ''};\n")
+            self.statements += 1
+
+    def update_from_values(self, table: str, key: str, columns: list, rows, casts: dict | None = None, extra_set: str = ''):
+        """
+        ``UPDATE table SET col = v.col ... FROM (VALUES ...) v WHERE table.key = v.key;`` per batch.
+
+        ``rows`` are tuples of ``(key, *columns)``; ``casts`` maps column names
+        to SQL types applied inside the VALUES list (e.g. ``{'id': 'uuid'}``).
+        """
+        casts = casts or {}
+        names = [key] + list(columns)
+        assignments = ', '.join(f"{c} = v.{c}" for c in columns)
+        if extra_set:
+            assignments += f", {extra_set}"
+        for batch in self._batches(rows):
+            values = ',\n  '.join(
+                '(' + ', '.join(sql_literal(v) + (f"::{casts[n]}" if n in casts else '') for n, v in zip(names, row)) + ')'
+                for row in batch)
+            self.out.write(
+                f"UPDATE {table} AS t SET {assignments}\nFROM (VALUES\n  {values}\n) AS v({', '.join(names)})\n"
+                f"WHERE t.{key} = v.{key};\n")
+            self.statements += 1
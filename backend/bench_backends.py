@@ -0,0 +1,95 @@
+"""Compare per-endpoint latency of the PostgREST and direct Postgres backends.
+
+Each backend runs in its own process (DATA_BACKEND is read at import) against
+the same database with mock auth, and serves the endpoints below in-process
+through FastAPI's TestClient. Timings therefore cover routing, data access
+and serialization, but not a network hop to the API itself. The first
+--warmup requests per endpoint are discarded (connection setup, statement
+preparation, catalog lookups).
+
+Needs SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY for PostgREST and DATABASE_URL
+for Postgres (see pg_backend.py).
+
+Run:
+  python backend/bench_backends.py --requests 200 --member <member uuid> --admin <admin uuid>
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKENDS = ('postgrest', 'postgres')
+MEMBER_ENDPOINTS = ('/users/me', '/stats/me', '/loans/mine', '/loans/my-capacity', '/contributions/mine')
+ADMIN_ENDPOINTS = ('/users', '/loans', '/contributions')
+
+def run_child(args):
+    """Time every endpoint on the backend this process was started with; print JSON."""
+    import io
+    import contextlib
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main.app)
+    plan = [(path, args.member, 'member') for path in MEMBER_ENDPOINTS]
+    plan += [(path, args.admin, 'admin') for path in ADMIN_ENDPOINTS]
+    results = {}
+    for path, user_id, role in plan:
+        headers = {'X-User-Id': user_id, 'X-User-Role': role}
+        samples = []
+        for i in range(args.warmup + args.requests):
+            started = time.perf_counter()
+            resp = client.get(path, headers=headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            if resp.status_code != 200:
+                results[path] = {'error': f"HTTP {resp.status_code}: {resp.text[:200]}"}
+                break
+            if i >= args.warmup:
+                samples.append(elapsed)
+        else:
+            samples.sort()
+            results[path] = {
+                'p50': statistics.median(samples),
+                'p95': samples[int(len(samples) * 0.95) - 1],
+                'mean': statistics.fmean(samples),
+                'bytes': len(resp.content),
+            }
+    print(json.dumps(results))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--member', required=True, help='member user id for the member endpoints')
+    parser.add_argument('--admin', required=True, help='admin user id for the admin endpoints')
+    parser.add_argument('--backend', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        return run_child(args)
+
+    results = {}
+    for backend in BACKENDS:
+        print(f"Running {backend} ...", file=sys.stderr)
+        env = dict(os.environ, DATA_BACKEND=backend, UVICORN_MOCK_AUTH='1')
+        out = subprocess.run([sys.executable, __file__, *sys.argv[1:], '--backend', backend],
+                             env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            raise SystemExit(f"{backend} run failed")
+        results[backend] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"{'endpoint':<22} {'postgrest p50/p95 ms':>22} {'postgres p50/p95 ms':>22} {'p50 speedup':>12}")
+    for path in MEMBER_ENDPOINTS + ADMIN_ENDPOINTS:
+        rest, pg = results['postgrest'].get(path, {}), results['postgres'].get(path, {})
+        if 'error' in rest or 'error' in pg:
+            print(f"{path:<22} {rest.get('error', ''):>22} {pg.get('error', ''):>22}")
+            continue
+        print(f"{path:<22} {rest['p50']:>10.1f} / {rest['p95']:<9.1f} {pg['p50']:>10.1f} / {pg['p95']:<9.1f}"
+              f" {rest['p50'] / pg['p50']:>11.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark the fast_json response paths against FastAPI's defaults.
+
+Raw rows, shaped like /contributions and /loans responses, from both data
+backends (PostgREST gives money as floats, the direct Postgres backend as
+Decimal):
+
+  legacy   jsonable_encoder + json.dumps, what FastAPI did for a returned list
+  fast     fast_json.dumps, what FastJSONResponse renders
+
+Typed responses (a LoanScheduleOut per loan, as /loans/{id}/schedule):
+
+  legacy   TypeAdapter validate + dump_python(mode='json') + json.dumps,
+           FastAPI's response_model path
+  typed    fast_json.typed_response: validate + dump_json
+
+and checks every path produces the same JSON document.
+
+Run:
+  python backend/bench_json.py --rows 200000 --weeks 520
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import fast_json
+from models import LoanScheduleOut
+
+def starlette_dumps(content) -> bytes:
+    """JSONResponse.render as shipped with Starlette."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+def legacy_rows(rows) -> bytes:
+    return starlette_dumps(jsonable_encoder(rows))
+
+def legacy_typed(type_adapter: TypeAdapter, content) -> bytes:
+    value = type_adapter.validate_python(content, from_attributes=True)
+    return starlette_dumps(type_adapter.dump_python(value, mode='json'))
+
+def money(rnd, low: float, high: float, decimal: bool):
+    value = round(rnd.uniform(low, high), 2)
+    return Decimal(f"{value:.2f}") if decimal else value
+
+def make_rows(rows: int, seed: int, decimal: bool) -> tuple:
+    rnd = random.Random(seed)
+    family_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+    members = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(200)]
+    contributions = []
+    for i in range(rows):
+        due = date(2024, 1, 1) + timedelta(weeks=i % 104)
+        contributions.append({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'user_id': rnd.choice(members), 'family_id': family_id,
+            'amount': money(rnd, 10, 500, decimal), 'status': rnd.choice(['completed', 'pending', 'late', 'missed']),
+            'period_year': due.year, 'period_week': due.isocalendar()[1], 'due_date': due.isoformat(),
+            'paid_at': f"{due.isoformat()}T09:30:00+00:00" if i % 3 else None, 'method': rnd.choice(['bank', 'cash', None]),
+            'late_fee': money(rnd, 0, 20, decimal) if i % 11 == 0 else None,
+        })
+    loans = []
+    for _ in range(max(1, rows // 20)):
+        amount = money(rnd, 100, 5000, decimal)
+        loans.append({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))), 'user_id': rnd.choice(members), 'family_id': family_id,
+            'amount': amount, 'remaining_balance': money(rnd, 0, 5000, decimal), 'weekly_payment': money(rnd, 5, 200, decimal),
+            'interest_rate': Decimal('0.0500') if decimal else 0.05, 'status': 'approved', 'duration_weeks': 52,
+            'reason': 'school fees', 'created_at': '2024-03-04T12:00:00+00:00', 'approved_at': '2024-03-05T08:00:00+00:00',
+        })
+    return contributions, loans
+
+def make_schedule(weeks: int, seed: int) -> dict:
+    """A LoanScheduleOut payload as loan_schedule builds it (money already converted to Decimal)."""
+    rnd = random.Random(seed)
+    start = date(2024, 1, 1)
+    weekly = Decimal('25.00')
+    rows = []
+    for week in range(1, weeks + 1):
+        paid = weekly if rnd.random() < 0.9 else Decimal('0.00')
+        balance = max(Decimal('0.00'), weekly * (weeks - week))
+        rows.append({
+            'week': week, 'due_date': start + timedelta(weeks=week), 'scheduled_payment': weekly,
+            'scheduled_balance': balance, 'payment': paid, 'balance': balance + weekly - paid,
+            'arrears': weekly - paid, 'status': 'paid' if paid else 'missed',
+        })
+    return {
+        'loan_id': str(uuid.UUID(int=rnd.getrandbits(128))), 'status': 'approved', 'as_of': start + timedelta(weeks=weeks // 2),
+        'start_date': start, 'amount': weekly * weeks, 'weekly_payment': weekly, 'duration_weeks': weeks,
+        'paid_to_date': sum((r['payment'] for r in rows), Decimal('0.00')), 'remaining_balance': rows[-1]['balance'],
+        'arrears': rows[-1]['arrears'], 'weeks_elapsed': weeks // 2, 'weeks_remaining': weeks - weeks // 2,
+        'payoff_date': start + timedelta(weeks=weeks), 'on_track': True, 'schedule': rows,
+    }
+
+def timed(fn, *args, repeat: int = 3) -> tuple:
+    """Best of ``repeat`` runs: (seconds, result)."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def report(label: str, legacy: tuple, new: tuple) -> bool:
+    same = json.loads(legacy[1]) == json.loads(new[1])
+    print(f"{label:<34} legacy {legacy[0] * 1000:9.1f}ms  new {new[0] * 1000:9.1f}ms  "
+          f"({legacy[0] / new[0]:5.1f}x faster, {len(new[1]) / 1e6:.1f} MB)  identical: {same}")
+    return same
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--weeks', type=int, default=520)
+    parser.add_argument('--schedules', type=int, default=200, help='schedule responses serialized per timing')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"orjson available: {fast_json.orjson is not None}")
+    ok = True
+    for backend, decimal in (('PostgREST', False), ('Postgres', True)):
+        contributions, loans = make_rows(args.rows, args.seed, decimal)
+        ok &= report(f"{len(contributions):,} contributions ({backend})",
+                     timed(legacy_rows, contributions), timed(fast_json.dumps, contributions))
+        ok &= report(f"{len(loans):,} loans ({backend})", timed(legacy_rows, loans), timed(fast_json.dumps, loans))
+
+    schedule = make_schedule(args.weeks, args.seed)
+    fastapi_adapter = TypeAdapter(LoanScheduleOut)
+    ok &= report(f"{args.schedules} x {args.weeks}-week schedules",
+                 timed(lambda: [legacy_typed(fastapi_adapter, schedule) for _ in range(args.schedules)][-1]),
+                 timed(lambda: [fast_json.typed_response(LoanScheduleOut, schedule).body for _ in range(args.schedules)][-1]))
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
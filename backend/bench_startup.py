@@ -0,0 +1,130 @@
+"""Measure cold start: import time and time to first request, in fresh interpreters.
+
+Each run starts a new Python process that imports main, builds the app, runs
+the ASGI lifespan startup and sends GET /health, then waits for warm-up and
+asks GET /ready. Reported in milliseconds from the start of the process's
+script, median over ``--runs``:
+
+  import       ``import main``
+  app          + create_app() (routers imported, app built)
+  startup      + lifespan startup (warm-up starts in the background)
+  first        + the first response (GET /health)
+  client       (eager only) the storage client built before main
+  ready        when GET /ready answered 200 (or the warm-up outcome)
+
+Modes:
+  lazy     the app as shipped: clients are created by the warm-up
+  nowarm   STARTUP_WARMUP=0, nothing is created until a request needs it
+  eager    the storage client is built before importing main, as
+           supabase_client did at import before the app factory
+
+Run:
+  python backend/bench_startup.py --runs 5
+  cd backend && python -X importtime -c "import main; main.create_app()" 2> importtime.log   # per-module detail
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# The app's JSON logs (logs.py) share the child's stdout; the marks line is found by this prefix
+MARKS_PREFIX = 'bench-startup-marks: '
+
+CHILD = r'''
+import time
+t0 = time.perf_counter()
+ms = lambda: round((time.perf_counter() - t0) * 1000, 1)
+import asyncio, json, os, sys
+sys.path.insert(0, os.environ['BENCH_BACKEND'])
+MARKS_PREFIX = os.environ['BENCH_MARKS_PREFIX']
+marks = {}
+if os.environ['BENCH_MODE'] == 'eager':
+    import supabase_client
+    try:
+        supabase_client.get_client()
+    except Exception as e:
+        marks['client_error'] = str(e)
+    marks['client'] = ms()
+import main
+marks['import'] = ms()
+app = main.create_app()
+marks['app'] = ms()
+
+async def call(path):
+    sent, requests = [], [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Future()  # the client never disconnects
+    async def send(message):
+        sent.append(message)
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+             'headers': [], 'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('bench', 1),
+             'root_path': ''}
+    await app(scope, receive, send)
+    status = next(m['status'] for m in sent if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+    return status, json.loads(body)
+
+async def run():
+    events = asyncio.Queue()
+    await events.put({'type': 'lifespan.startup'})
+    started = asyncio.get_running_loop().create_future()
+    async def send(message):
+        if message['type'].startswith('lifespan.startup'):
+            started.set_result(message)
+    async def receive():
+        return await events.get()
+    lifespan = asyncio.create_task(app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, receive, send))
+    await started
+    marks['startup'] = ms()
+    await call('/health')
+    marks['first'] = ms()
+    import lifecycle
+    await asyncio.get_running_loop().run_in_executor(None, lifecycle.readiness.done.wait, 30)
+    status, report = await call('/ready')
+    marks['ready'] = ms() if status == 200 else report['status']
+    marks['steps'] = {name: f"{step['state']} {step.get('ms', '')}".strip() for name, step in report['steps'].items()}
+    await events.put({'type': 'lifespan.shutdown'})
+    await lifespan
+
+asyncio.run(run())
+print(MARKS_PREFIX + json.dumps(marks), flush=True)
+'''
+
+MODES = {
+    'lazy': {},
+    'nowarm': {'STARTUP_WARMUP': '0'},
+    'eager': {},
+}
+
+def run_once(mode: str) -> dict:
+    env = dict(os.environ, BENCH_MODE=mode, BENCH_MARKS_PREFIX=MARKS_PREFIX, BENCH_BACKEND=os.path.dirname(os.path.abspath(__file__)), **MODES[mode])
+    out = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True, timeout=120)
+    if out.returncode != 0:
+        raise SystemExit(f"{mode} run failed:\n{out.stderr}")
+    marks = [line[len(MARKS_PREFIX):] for line in out.stdout.splitlines() if line.startswith(MARKS_PREFIX)]
+    if not marks:
+        raise SystemExit(f"{mode} run printed no marks:\n{out.stdout}{out.stderr}")
+    return json.loads(marks[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', default='eager,lazy,nowarm')
+    args = parser.parse_args()
+
+    columns = ('import', 'app', 'startup', 'first', 'client', 'ready')
+    print(f"{'mode':<8}" + ''.join(f"{c:>10}" for c in columns) + '   warm-up steps')
+    for mode in args.modes.split(','):
+        runs = [run_once(mode) for _ in range(args.runs)]
+        cells = []
+        for column in columns:
+            values = [r[column] for r in runs if isinstance(r.get(column), (int, float))]
+            cells.append(f"{statistics.median(values):10.1f}" if values else f"{runs[-1].get(column, '-'):>10}")
+        print(f"{mode:<8}" + ''.join(cells) + f"   {runs[-1]['steps']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Members × ISO-weeks contribution status matrix.
+
+Each member's row is a ``bytearray`` with one status code per ISO week,
+starting at the member's first recorded week, plus an ``array('q')`` of
+amounts in cents. A member's row is read from ``contributions`` the first
+time it is asked for (a family's members together, paged, see batch.py).
+After that, the contributions router applies every insert, update and delete
+to the rows it holds, so heatmaps, missed weeks and streaks are answered
+without touching the contributions table.
+
+Members are held per family. Each family records its contributions table
+version (data_cache.table_versions, family namespace) and counts the writes
+applied to it since. If a write reaches the family's rows some other way
+(bulk import, another data-layer caller, a write not confined to one
+family), the count falls short of the version and that family's members
+are dropped, to be read again when next asked for; other families keep
+theirs. A member is also read again DATA_CACHE_TTL after it was read, which
+covers writes outside the API. Reads from the table hold no lock, and what
+they return is kept only if no write to the family landed meanwhile.
+
+Weeks are numbered absolutely (Monday ordinal // 7), so a member's row is
+contiguous across ISO years with 52 or 53 weeks.
+"""
+
+import threading
+import time
+from array import array
+from datetime import date
+
+import batch
+import supabase_client
+from aggregation import to_cents
+from data_cache import DEFAULT_TTL, table_versions
+
+NONE, PENDING, COMPLETED, LATE, MISSED = range(5)
+STATUS_CODES = {'pending': PENDING, 'completed': COMPLETED, 'paid': COMPLETED, 'late': LATE, 'missed': MISSED}
+STATUS_NAMES = {NONE: None, PENDING: 'pending', COMPLETED: 'completed', LATE: 'late', MISSED: 'missed'}
+# One character per week in the compact heatmap encoding
+STATUS_CHARS = '-pclm'
+_CHAR_TABLE = bytes.maketrans(bytes(range(len(STATUS_CHARS))), STATUS_CHARS.encode('ascii'))
+
+_MISSED_KEYS = {MISSED: 'missed', LATE: 'late', NONE: 'unrecorded'}
+
+CALENDAR_COLUMNS = 'id, user_id, period_year, period_week, status, amount'
+
+def week_index(year: int, week: int) -> int | None:
+    """Absolute index of ISO (year, week), None if that week does not exist."""
+    try:
+        return (date.fromisocalendar(int(year), int(week), 1).toordinal() - 1) // 7
+    except (TypeError, ValueError):
+        return None
+
+def week_of(index: int) -> tuple:
+    """ISO (year, week) for an absolute week index."""
+    year, week, _ = date.fromordinal(index * 7 + 1).isocalendar()
+    return year, week
+
+def current_week_index(today: date | None = None) -> int:
+    return ((today or date.today()).toordinal() - 1) // 7
+
+class MemberRow:
+    __slots__ = ('start', 'statuses', 'amounts')
+
+    def __init__(self, start: int):
+        self.start = start
+        self.statuses = bytearray()
+        self.amounts = array('q')
+
+    def set(self, index: int, status: int, cents: int):
+        if index < self.start:
+            pad = self.start - index
+            self.statuses[0:0] = bytes(pad)
+            self.amounts[0:0] = array('q', bytes(8 * pad))
+            self.start = index
+        offset = index - self.start
+        if offset >= len(self.statuses):
+            grow = offset + 1 - len(self.statuses)
+            self.statuses.extend(bytes(grow))
+            self.amounts.extend(array('q', bytes(8 * grow)))
+        self.statuses[offset] = status
+        self.amounts[offset] = cents
+
+    def get(self, index: int) -> tuple:
+        offset = index - self.start
+        if 0 <= offset < len(self.statuses):
+            return self.statuses[offset], self.amounts[offset]
+        return NONE, 0
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.statuses)
+
+class FamilyRows:
+    """One family's loaded members and the contributions version they are current as of."""
+    __slots__ = ('rows', 'loaded', 'version', 'applied')
+
+    def __init__(self):
+        self.rows = {}
+        self.loaded = {}            # user_id -> monotonic time the member was read from the table
+        self.version = None         # table_versions.get('contributions', family_id=...) when last in sync
+        self.applied = 0            # writes applied since then
+
+    def expected(self) -> tuple | None:
+        """The family's table version if every write since the sync was applied here."""
+        if self.version is None:
+            return None
+        shared, scoped = self.version
+        return shared, scoped + self.applied
+
+    def reset(self, version: tuple | None):
+        self.rows, self.loaded = {}, {}
+        self.version, self.applied = version, 0
+
+class ContributionCalendar:
+    def __init__(self, ttl: float = DEFAULT_TTL, page_size: int = batch.DEFAULT_PAGE_SIZE,
+                 chunk_size: int = batch.DEFAULT_CHUNK_SIZE):
+        self.ttl = ttl
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self._families = {}         # family_id -> FamilyRows
+        self._lock = threading.RLock()
+
+    # Maintenance -----------------------------------------------------------
+
+    @staticmethod
+    def _set(rows: dict, row: dict):
+        index = week_index(row.get('period_year'), row.get('period_week'))
+        user_id = row.get('user_id')
+        if index is None or not user_id:
+            return
+        member = rows.get(user_id)
+        if member is None:
+            member = rows[user_id] = MemberRow(index)
+        member.set(index, STATUS_CODES.get(row.get('status'), NONE), to_cents(row.get('amount')) or 0)
+
+    @staticmethod
+    def _version(family_id: str) -> tuple:
+        return table_versions.get('contributions', family_id=family_id)[0]
+
+    def _family(self, family_id: str) -> FamilyRows:
+        family = self._families.get(family_id)
+        if family is None:
+            family = self._families[family_id] = FamilyRows()
+        return family
+
+    def _load(self, family_id: str, user_ids) -> dict:
+        """Read the rows of ``user_ids`` (None: every member of the family) from the contributions table; no lock is held."""
+        rows = {}
+        if user_ids is None:
+            chunks = [[]]
+        else:
+            chunks = [user_ids[i:i + self.chunk_size] for i in range(0, len(user_ids), self.chunk_size)]
+        for chunk in chunks:
+            filters = [('eq', 'family_id', family_id)] + ([('in_', 'user_id', chunk)] if chunk else [])
+            for page in batch.iter_pages(supabase_client.supabase, 'contributions', CALENDAR_COLUMNS, filters,
+                                         page_size=self.page_size):
+                for row in page:
+                    self._set(rows, row)
+        return rows
+
+    def _current(self, family_id: str, user_ids=None) -> dict:
+        """
+        Rows of ``user_ids`` (None: every member of the family) as of the
+        family's current table version. Members read longer than
+        DATA_CACHE_TTL ago, or dropped after a missed write, are read again;
+        only they are paged, and the lock is not held while paging.
+        """
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            family = self._family(family_id)
+            version = self._version(family_id)
+            if family.expected() != version:
+                # A write to this family the calendar did not apply: any of its members may have changed
+                family.reset(version)
+            if user_ids is None:
+                missing = None
+            else:
+                missing = []
+                for user_id in dict.fromkeys(user_ids):
+                    if user_id not in family.loaded or now - family.loaded[user_id] > self.ttl:
+                        missing.append(user_id)
+                    elif user_id in family.rows:
+                        result[user_id] = family.rows[user_id]
+                if not missing:
+                    return result
+        loaded = self._load(family_id, missing)
+        with self._lock:
+            # Keep what was read only if no write to the family landed while paging
+            if family is self._families.get(family_id) and family.expected() == version == self._version(family_id):
+                if missing is None:
+                    family.rows, family.loaded = dict(loaded), dict.fromkeys(loaded, now)
+                else:
+                    for user_id in missing:
+                        family.loaded[user_id] = now
+                        if user_id in loaded:
+                            family.rows[user_id] = loaded[user_id]
+                        else:
+                            family.rows.pop(user_id, None)
+        result.update(loaded)
+        return result
+
+    def build(self, family_id: str):
+        """(Re)load a family's whole matrix from the contributions table."""
+        with self._lock:
+            self._family(family_id).reset(None)
+        self._current(family_id)
+
+    def _write(self, rows, family_id: str | None) -> FamilyRows | None:
+        """
+        The family one write went to, counted as applied. Each write bumped
+        the family's table version once; writes applied in any order add up
+        to the same count, so concurrent requests do not drop anything. A
+        write that is not applied here leaves the count short, and the
+        family is read again when next asked for.
+        """
+        if family_id is None:
+            families = {row.get('family_id') for row in rows or []}
+            if len(families) != 1 or None in families:
+                return None
+            family_id = families.pop()
+        family = self._family(family_id)
+        family.applied += 1
+        return family
+
+    def apply(self, rows, family_id: str | None = None):
+        """Apply the rows returned by one insert/update of contributions in ``family_id`` (default: the rows' family)."""
+        with self._lock:
+            family = self._write(rows, family_id)
+            if family is None:
+                return
+            for row in rows or []:
+                user_id = row.get('user_id')
+                if user_id is None:
+                    # Partial representation: the member is unknown, read the family again
+                    family.reset(None)
+                    return
+                if user_id not in family.loaded:
+                    continue
+                if 'period_year' not in row:
+                    family.rows.pop(user_id, None)
+                    family.loaded.pop(user_id, None)
+                    continue
+                self._set(family.rows, row)
+
+    def remove(self, rows, family_id: str | None = None):
+        """Clear the weeks of the rows returned by one delete of contributions in ``family_id``."""
+        with self._lock:
+            family = self._write(rows, family_id)
+            if family is None:
+                return
+            for row in rows or []:
+                user_id = row.get('user_id')
+                if user_id is None:
+                    family.reset(None)
+                    return
+                if user_id not in family.loaded:
+                    continue
+                member = family.rows.get(user_id)
+                index = week_index(row.get('period_year'), row.get('period_week'))
+                if member is None or index is None:
+                    family.rows.pop(user_id, None)
+                    family.loaded.pop(user_id, None)
+                elif member.start <= index < member.end:
+                    member.set(index, NONE, 0)
+
+    # Queries ---------------------------------------------------------------
+
+    def member(self, user_id: str, family_id: str) -> MemberRow | None:
+        return self._current(family_id, [user_id]).get(user_id)
+
+    def heatmap(self, user_id: str, family_id: str, first: int | None = None, last: int | None = None) -> list:
+        """(index, status code, cents) for every week from ``first`` to ``last`` inclusive."""
+        member = self.member(user_id, family_id)
+        if member is None:
+            return []
+        first = member.start if first is None else first
+        last = max(member.end - 1, current_week_index()) if last is None else last
+        return [(i,) + member.get(i) for i in range(first, last + 1)]
+
+    def matrix(self, family_id: str, first: int, last: int, user_ids=None) -> dict:
+        """Compact status string per member (every member of the family, or those in ``user_ids``) for weeks ``first``..``last``."""
+        members = self._current(family_id, None if user_ids is None else list(user_ids))
+        with self._lock:
+            out = {}
+            for user_id, member in members.items():
+                lo, hi = max(first, member.start), min(last + 1, member.end)
+                if lo >= hi:
+                    out[user_id] = STATUS_CHARS[NONE] * (last - first + 1)
+                    continue
+                codes = member.statuses[lo - member.start:hi - member.start]
+                out[user_id] = (STATUS_CHARS[NONE] * (lo - first)
+                                + codes.translate(_CHAR_TABLE).decode('ascii')
+                                + STATUS_CHARS[NONE] * (last + 1 - hi))
+            return out
+
+    def missed(self, user_id: str, family_id: str, today: date | None = None) -> dict:
+        """Past weeks marked missed or late, and weeks with no record since the member's first week."""
+        member = self.member(user_id, family_id)
+        result = {'missed': [], 'late': [], 'unrecorded': []}
+        if member is None:
+            return result
+        current = current_week_index(today)
+        # The current week is still open, so only earlier weeks count
+        for index in range(member.start, min(member.end, current)):
+            key = _MISSED_KEYS.get(member.statuses[index - member.start])
+            if key:
+                result[key].append(index)
+        result['unrecorded'].extend(range(member.end, current))
+        return result
+
+    def streak(self, user_id: str, family_id: str, today: date | None = None) -> dict:
+        """Current and longest runs of consecutive completed weeks."""
+        member = self.member(user_id, family_id)
+        if member is None:
+            return {'current': 0, 'longest': 0, 'longest_end': None}
+        current_index = current_week_index(today)
+        longest = run = 0
+        longest_end = None
+        for offset, status in enumerate(member.statuses):
+            if member.start + offset > current_index:
+                break
+            run = run + 1 if status == COMPLETED else 0
+            if run > longest:
+                longest, longest_end = run, member.start + offset
+        # The current streak may end last week if this week is still pending
+        current = 0
+        index = current_index
+        if member.get(index)[0] in (PENDING, NONE):
+            index -= 1
+        while index >= member.start and member.get(index)[0] == COMPLETED:
+            current += 1
+            index -= 1
+        return {'current': current, 'longest': longest, 'longest_end': longest_end}
+
+contribution_calendar = ContributionCalendar()
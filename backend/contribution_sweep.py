@@ -0,0 +1,95 @@
+"""
+Overdue contribution sweep.
+
+Runs ``sweep_overdue_contributions`` (supabase/migrations/005_contribution_sweep.sql),
+which moves overdue pending contributions to late or missed and assesses late
+fees in one set-based UPDATE. The member totals of every affected member are
+then refreshed once, in batches of TOTALS_BATCH_SIZE (see
+``db_utils.recalculate_users_totals``). A year of backlog is one statement
+plus one refresh per member, not one round trip per contribution.
+
+Grace rules (environment):
+  CONTRIBUTION_GRACE_DAYS          days after due_date before pending becomes late (default 3)
+  CONTRIBUTION_MISSED_AFTER_DAYS   days after due_date before pending/late becomes missed (default 28)
+  LATE_FEE_FLAT                    minimum late fee (default 0)
+  LATE_FEE_PERCENT                 late fee as a percentage of the amount (default 0)
+"""
+
+import os
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+
+import supabase_client
+from aggregation import cents_to_decimal, to_cents
+from data_cache import table_versions
+from db_utils import recalculate_users_totals, totals_queue
+
+class SweepRules:
+    def __init__(self, grace_days: int = 3, missed_after_days: int = 28, late_fee_flat: Decimal = Decimal('0'), late_fee_percent: Decimal = Decimal('0')):
+        if missed_after_days < grace_days:
+            raise ValueError("missed_after_days must be >= grace_days")
+        self.grace_days = grace_days
+        self.missed_after_days = missed_after_days
+        self.late_fee_flat = late_fee_flat
+        self.late_fee_percent = late_fee_percent
+
+    @classmethod
+    def from_env(cls) -> 'SweepRules':
+        return cls(
+            grace_days=int(os.getenv('CONTRIBUTION_GRACE_DAYS', '3')),
+            missed_after_days=int(os.getenv('CONTRIBUTION_MISSED_AFTER_DAYS', '28')),
+            late_fee_flat=Decimal(os.getenv('LATE_FEE_FLAT', '0')),
+            late_fee_percent=Decimal(os.getenv('LATE_FEE_PERCENT', '0')),
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            'grace_days': self.grace_days,
+            'missed_after_days': self.missed_after_days,
+            'late_fee_flat': str(self.late_fee_flat),
+            'late_fee_percent': str(self.late_fee_percent),
+        }
+
+def sweep_overdue_contributions(ctx, as_of: date | None = None, rules: SweepRules | None = None, dry_run: bool = False, sample: int = 50) -> dict:
+    """
+    Job body (see jobs.py): sweep overdue contributions, then refresh totals
+    once per affected member. With ``dry_run`` nothing is written and the
+    would-be changes are returned.
+    """
+    rules = rules or SweepRules.from_env()
+    as_of = as_of or date.today()
+    ctx.set_message('sweeping contributions')
+    res = supabase_client.supabase.rpc('sweep_overdue_contributions', {
+        'p_as_of': as_of.isoformat(),
+        'p_grace_days': rules.grace_days,
+        'p_missed_after_days': rules.missed_after_days,
+        'p_late_fee_flat': float(rules.late_fee_flat),
+        'p_late_fee_percent': float(rules.late_fee_percent),
+        'p_dry_run': dry_run,
+    }).execute()
+    changes = res.data or []
+
+    members = list(dict.fromkeys(c['user_id'] for c in changes))
+    if changes and not dry_run:
+        # RPC writes bypass the data-layer observer
+        table_versions.bump('contributions')
+        ctx.set_message('refreshing member totals')
+        ctx.set_total(len(members))
+        for start in range(0, len(members), totals_queue.batch_size):
+            chunk = members[start:start + totals_queue.batch_size]
+            recalculate_users_totals(chunk)
+            ctx.advance(len(chunk))
+
+    transitions = Counter(f"{c['old_status']}->{c['new_status']}" for c in changes)
+    fees = sum(to_cents(c.get('late_fee')) or 0 for c in changes if c.get('old_status') == 'pending')
+    return {
+        'as_of': as_of.isoformat(),
+        'dry_run': dry_run,
+        'rules': rules.as_dict(),
+        'contributions_changed': len(changes),
+        'members_affected': len(members),
+        'transitions': dict(transitions),
+        'late_fees_assessed': str(cents_to_decimal(fees)),
+        'changes': changes[:sample],
+    }
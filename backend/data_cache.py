@@ -0,0 +1,120 @@
+"""
+Caches for values derived from database tables.
+
+A data-layer observer bumps a per-table version after every successful
+insert/update/upsert/delete issued through the API. A cached value is stored
+together with the versions of the tables it was computed from, and it is
+reused only while those versions are unchanged, so repeated reads are cheap
+and the first read after a write recomputes.
+
+Writes the API cannot see (SQL console, cron jobs, RPC functions) do not bump
+versions. Call ``table_versions.bump(...)`` after RPCs that write, and give
+entries a TTL so out-of-band changes are picked up eventually. Values are
+always computed from the primary, never a read replica (see read_routing.py).
+
+Per-family namespaces (see tenancy.py): a write whose query is confined to
+one family (``eq('family_id', ...)`` or rows that all carry the same
+family_id) only invalidates that family's entries, and each family's
+entries are bounded separately. A large family's recompute or export
+therefore neither invalidates nor evicts another family's cached values.
+Writes that may span families invalidate every namespace.
+
+Configuration (environment):
+  DATA_CACHE_TTL   seconds a cached value may be reused at most (default 300)
+"""
+
+import os
+import threading
+import time
+
+import data_layer
+import read_routing
+
+WRITE_OPERATIONS = {'insert', 'update', 'upsert', 'delete'}
+
+class TableVersions:
+    def __init__(self):
+        self._versions = {}     # table -> all writes
+        self._shared = {}       # table -> writes that may touch any family
+        self._scoped = {}       # (table, family_id) -> writes confined to that family
+        self._lock = threading.Lock()
+
+    def observe(self, query: data_layer.QueryInfo, duration_ms: float, row_count: int, error: Exception | None = None):
+        """Data-layer observer: a successful write invalidates everything derived from the table."""
+        if error is None and query.operation in WRITE_OPERATIONS:
+            self.bump(query.table, family_id=query.family_id)
+
+    def bump(self, *tables: str, family_id: str | None = None):
+        """Record a write to ``tables``; without ``family_id`` it counts against every family."""
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                if family_id is None:
+                    self._shared[table] = self._shared.get(table, 0) + 1
+                else:
+                    self._scoped[table, family_id] = self._scoped.get((table, family_id), 0) + 1
+
+    def get(self, *tables: str, family_id: str | None = None) -> tuple:
+        """Versions of ``tables``: across all families, or as seen by one family."""
+        if family_id is None:
+            return tuple(self._versions.get(table, 0) for table in tables)
+        return tuple((self._shared.get(table, 0), self._scoped.get((table, family_id), 0)) for table in tables)
+
+class VersionedCache:
+    """
+    Small keyed cache whose entries depend on table versions.
+
+    ``get_or_compute(key, tables, compute)`` returns the cached value for
+    ``key`` if none of ``tables`` changed since it was computed and it is
+    younger than ``ttl`` seconds; otherwise it calls ``compute()``.
+
+    With ``family_id`` the entry lives in that family's namespace: only
+    writes to that family (or writes not confined to one) invalidate it, and
+    ``max_entries`` applies to each namespace separately.
+    """
+
+    def __init__(self, versions: TableVersions, ttl: float = 300.0, max_entries: int = 256):
+        self.versions = versions
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._namespaces = {}   # family_id (None = fund-wide) -> {key: (versions, time, value)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, tables: tuple, compute, family_id: str | None = None):
+        current = self.versions.get(*tables, family_id=family_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._namespaces.get(family_id, {}).get(key)
+            if entry is not None and entry[0] == current and now - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        with read_routing.primary_reads():
+            value = compute()
+        with self._lock:
+            entries = self._namespaces.setdefault(family_id, {})
+            if len(entries) >= self.max_entries and key not in entries:
+                entries.pop(next(iter(entries)))
+            entries[key] = (current, now, value)
+        return value
+
+    def peek(self, key, tables: tuple, family_id: str | None = None):
+        """The cached value for ``key`` if it is still valid, else None (never computes)."""
+        current = self.versions.get(*tables, family_id=family_id)
+        with self._lock:
+            entry = self._namespaces.get(family_id, {}).get(key)
+            if entry is not None and entry[0] == current and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[2]
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+
+table_versions = TableVersions()
+data_layer.add_observer(table_versions.observe)
+
+DEFAULT_TTL = float(os.getenv('DATA_CACHE_TTL', '300'))
@@ -0,0 +1,292 @@
+"""
+Instrumented access to the Supabase query builder.
+
+Routers and utilities keep building queries the usual way
+(``supabase.table('loans').select('*').eq('user_id', uid).execute()``).
+The wrappers here record what each query looks like while it is being built
+and time the final ``execute()`` so observers (e.g. the slow-query log) can
+see every data-layer call without the call sites changing.
+
+Within a :func:`memoized` scope (one ``POST /batch`` request, see
+routers/batch.py) identical reads are issued once: the first caller runs
+the query and concurrent callers with the same query wait for its result.
+Every caller gets its own copy of the rows, because handlers modify the
+rows they read. A write to a table drops that table's memoized reads, so
+later reads in the scope see the write.
+"""
+
+import contextlib
+import contextvars
+import copy
+import logging
+import os
+import sys
+import threading
+import time
+
+import deadlines
+
+log = logging.getLogger(__name__)
+
+# Builder methods that narrow a query; recorded as (column, operator, value)
+FILTER_METHODS = {
+    'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'is_', 'in_',
+    'contains', 'contained_by', 'match', 'filter',
+}
+# Builder methods that pick the kind of statement being issued
+OPERATION_METHODS = {'select', 'insert', 'update', 'upsert', 'delete'}
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Instrumentation modules that sit between the caller and execute()
+_SKIP_MODULES = {'data_layer', 'query_log'}
+
+_observers = []
+
+def add_observer(callback):
+    """
+    Register a callback invoked after every ``execute()``.
+
+    The callback receives ``(query, duration_ms, row_count, error)`` where
+    ``query`` is the :class:`QueryInfo` for the call. Observers must be cheap;
+    they run inline on the request thread.
+    """
+    if callback not in _observers:
+        _observers.append(callback)
+
+class QueryInfo:
+    """Shape of a single data-layer call, filled in as the query is built."""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.operation = 'select'
+        self.columns = None
+        self.filters = []
+        # Family the statement is confined to, when the query says so (see data_cache.py)
+        self.family_id = None
+        # Every builder call with its arguments; recorded only inside a memoized scope
+        self.calls = []
+
+    def shape(self) -> tuple:
+        """Value-free key identifying queries that differ only in parameters."""
+        return (self.table, self.operation, tuple((col, op) for col, op, _ in self.filters))
+
+    def describe(self) -> str:
+        where = ' AND '.join(f"{col} {op}" for col, op, _ in self.filters)
+        text = f"{self.operation.upper()} {self.table}"
+        if self.columns and self.operation == 'select':
+            text = f"SELECT {self.columns} FROM {self.table}"
+        return f"{text} WHERE {where}" if where else text
+
+def find_call_site() -> tuple:
+    """
+    Walk the stack to find who issued the current query.
+
+    Returns ``(call_site, caller)``: ``call_site`` is the outermost router
+    function on the stack (the endpoint that triggered the query) and
+    ``caller`` is the nearest application frame that built it, which may be
+    a helper such as ``db_utils.recalculate_user_totals``.
+    """
+    frame = sys._getframe(1)
+    caller = None
+    call_site = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '?')
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if module not in _SKIP_MODULES and filename.startswith(_BACKEND_DIR) and os.sep + 'venv' + os.sep not in filename:
+            name = f"{module}.{frame.f_code.co_name}"
+            if caller is None:
+                caller = name
+            if name.startswith('routers.'):
+                call_site = name
+        frame = frame.f_back
+    return call_site or caller or 'unknown', caller or 'unknown'
+
+class TracedQuery:
+    """Proxy around a postgrest request builder that times ``execute()``."""
+
+    def __init__(self, builder, info: QueryInfo):
+        self._builder = builder
+        self._info = info
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._record(name, args)
+            if _memo.get() is not None:
+                self._info.calls.append(repr((name, args, sorted(kwargs.items()))))
+            result = attr(*args, **kwargs)
+            # Builders return themselves (or a new builder) for chaining
+            if result is self._builder or hasattr(result, 'execute'):
+                return TracedQuery(result, self._info)
+            return result
+        return call
+
+    def _record(self, name: str, args: tuple):
+        info = self._info
+        if name in OPERATION_METHODS:
+            info.operation = name
+            if name == 'select' and args:
+                info.columns = ', '.join(str(a) for a in args)
+            elif name in ('insert', 'upsert') and args:
+                rows = args[0] if isinstance(args[0], list) else [args[0]]
+                families = {row.get('family_id') for row in rows if isinstance(row, dict)}
+                if len(families) == 1:
+                    info.family_id = families.pop()
+        elif name in FILTER_METHODS and args:
+            value = args[1] if len(args) > 1 else None
+            info.filters.append((str(args[0]), name.rstrip('_'), value))
+            if name == 'eq' and args[0] == 'family_id':
+                info.family_id = value
+
+    def execute(self):
+        memo = _memo.get()
+        if memo is not None:
+            if self._info.operation == 'select':
+                return memo.execute((self._info.table, tuple(self._info.calls)), self._execute)
+            memo.invalidate(self._info.table)
+        return self._execute()
+
+    def _execute(self):
+        # Work left over from a request that timed out or was abandoned is skipped,
+        # up to its first write; after that the request runs to the end (see deadlines.py)
+        if self._info.operation == 'select':
+            deadlines.check()
+        else:
+            deadlines.commit()
+        started = time.perf_counter()
+        error = None
+        response = None
+        try:
+            response = self._builder.execute()
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            data = getattr(response, 'data', None)
+            if isinstance(data, list):
+                row_count = len(data)
+            elif isinstance(data, str):
+                row_count = data.count('\n')  # CSV body: header line + one line per row
+            else:
+                row_count = 1 if data else 0
+            for observer in _observers:
+                try:
+                    observer(self._info, duration_ms, row_count, error)
+                except Exception as obs_err:
+                    log.exception("Query observer failed", extra={'event': 'query_observer_failed', 'table': self._info.table})
+
+class _MemoEntry:
+    __slots__ = ('done', 'response', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+def _copy_response(response):
+    """A response whose rows the caller may modify without affecting other callers."""
+    clone = copy.copy(response)
+    data = getattr(response, 'data', None)
+    if isinstance(data, list):
+        clone.data = [dict(row) if isinstance(row, dict) else row for row in data]
+    elif isinstance(data, dict):
+        clone.data = dict(data)
+    return clone
+
+class QueryMemo:
+    """Single-flight results of the reads issued within one :func:`memoized` scope."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.hits = 0
+
+    def execute(self, key: tuple, run):
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _MemoEntry()
+                self.queries += 1
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                entry.response = run()
+            except BaseException as e:
+                entry.error = e
+                # A failed read is not remembered; a later caller tries again
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                raise
+            finally:
+                entry.done.set()
+        else:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+        return _copy_response(entry.response)
+
+    def invalidate(self, table: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def info(self) -> dict:
+        return {'queries': self.queries, 'memo_hits': self.hits}
+
+_memo = contextvars.ContextVar('query_memo', default=None)
+
+@contextlib.contextmanager
+def memoized():
+    """Share identical reads for the rest of the current context (and the tasks and threads it starts)."""
+    memo = QueryMemo()
+    token = _memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _memo.reset(token)
+
+class TracedClient:
+    """Wraps a Supabase client so every ``table()`` query is instrumented."""
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def raw(self):
+        """The underlying, uninstrumented client."""
+        return self._client
+
+    def table(self, name: str) -> TracedQuery:
+        return TracedQuery(self._client.table(name), QueryInfo(name))
+
+    def from_(self, name: str) -> TracedQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: dict | None = None):
+        call = self._client.rpc(name, params or {})
+        return call if name in READ_FUNCTIONS else _CommittingRpc(call)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+# Database functions that only read; calling them does not commit the request
+READ_FUNCTIONS = {'member_totals', 'replication_lsn'}
+
+class _CommittingRpc:
+    """A function call may write, so it commits the request like any write (see deadlines.commit)."""
+
+    def __init__(self, call):
+        self._call = call
+
+    def execute(self):
+        deadlines.commit()
+        return self._call.execute()
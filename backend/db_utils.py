@@ -3,43 +3,101 @@ Database utilities for maintaining calculated fields.
 This module provides functions to keep total_contributed and current_loan_balance accurate.
 """
 
-from supabase_client import supabase
+import logging
+from decimal import Decimal
 
-def recalculate_user_totals(user_id: str):
+import batch
+import supabase_client
+import tenancy
+from aggregation import DEFAULT_BORROW_LIMIT_PERCENT, FundAggregator, cents_to_decimal, percent_of_cents
+from totals_queue import TotalsQueue
+
+log = logging.getLogger(__name__)
+
+def recalculate_users_totals(user_ids: list):
     """
-    Recalculate and update total_contributed and current_loan_balance for a user.
+    Recalculate and update total_contributed and current_loan_balance for several users.
+    Contributions and loans are fetched with one paged query each for the whole batch.
     
     Args:
-        user_id (str): UUID of the user to recalculate
+        user_ids (list): UUIDs of the users to recalculate
     
     Returns:
-        dict: The updated totals
+        list: The updated totals, one dict per user
     """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return []
     try:
-        # Calculate total contributions (paid only)
-        contrib_res = supabase.table('contributions').select('amount').eq('user_id', user_id).eq('status', 'paid').execute()
-        total_contributed = sum(float(contrib['amount']) for contrib in contrib_res.data)
-        
-        # Calculate current loan balance (approved loans only)
-        loans_res = supabase.table('loans').select('remaining_balance').eq('user_id', user_id).eq('status', 'approved').execute()
-        current_loan_balance = sum(float(loan['remaining_balance']) for loan in loans_res.data)
-        
-        # Update the profile
-        update_res = supabase.table('profiles').update({
-            'total_contributed': total_contributed,
-            'current_loan_balance': current_loan_balance
-        }).eq('id', user_id).execute()
+        # Completed contributions and approved loan balances, paged so no response is truncated
+        agg = batch.aggregate_chunk(supabase_client.supabase, [{'id': user_id} for user_id in user_ids])
         
-        return {
-            'user_id': user_id,
-            'total_contributed': total_contributed,
-            'current_loan_balance': current_loan_balance
-        }
+        # Confine each update to the member's family so only that family's cached values are invalidated
+        families = tenancy.directory.families_of(user_ids)
+        results = []
+        for user_id in user_ids:
+            total_contributed = float(cents_to_decimal(agg.contributed.get(user_id)))
+            current_loan_balance = float(cents_to_decimal(agg.loan_balance.get(user_id)))
+            
+            # Update the profile
+            update = supabase_client.supabase.table('profiles').update({
+                'total_contributed': total_contributed,
+                'current_loan_balance': current_loan_balance
+            }).eq('id', user_id)
+            if user_id in families:
+                update = update.eq('family_id', families[user_id])
+            update.execute()
+            
+            results.append({
+                'user_id': user_id,
+                'total_contributed': total_contributed,
+                'current_loan_balance': current_loan_balance
+            })
+        return results
         
     except Exception as e:
-        print(f"Error recalculating totals for user {user_id}: {e}")
+        log.exception("Recalculating totals failed", extra={'event': 'recalculate_totals_failed',
+                                                            'users': len(user_ids), 'user_ids': user_ids[:20]})
         raise e
 
+def recalculate_user_totals(user_id: str):
+    """
+    Recalculate and update total_contributed and current_loan_balance for a user.
+    
+    Args:
+        user_id (str): UUID of the user to recalculate
+    
+    Returns:
+        dict: The updated totals
+    """
+    return recalculate_users_totals([user_id])[0]
+
+def calculate_borrowing_limit(user_id: str) -> Decimal:
+    """
+    Live borrowing limit: the user's borrow_limit_percent of their completed
+    contributions, rounded to the cent like every other limit (see
+    aggregation.percent_of_cents). 0.00 for an unknown user.
+    """
+    user_res = supabase_client.supabase.table('users').select('borrow_limit_percent').eq('id', user_id).execute()
+    if not user_res.data:
+        return Decimal('0.00')
+    percent = user_res.data[0].get('borrow_limit_percent')
+    agg = FundAggregator([user_id])
+    agg.add_contributions(supabase_client.supabase.table('contributions').select('user_id, amount')
+                          .eq('user_id', user_id).eq('status', 'completed').execute().data or [])
+    limit = percent_of_cents(agg.contributed.get(user_id), DEFAULT_BORROW_LIMIT_PERCENT if percent is None else percent)
+    return cents_to_decimal(limit)
+
+def calculate_loan_balance(user_id: str) -> Decimal:
+    """Live outstanding balance: remaining_balance summed over the user's approved loans."""
+    agg = FundAggregator([user_id])
+    agg.add_loans(supabase_client.supabase.table('loans').select('user_id, remaining_balance')
+                  .eq('user_id', user_id).eq('status', 'approved').execute().data or [])
+    return cents_to_decimal(agg.loan_balance.get(user_id))
+
+# Event-driven recomputes are coalesced per user and flushed in batches
+totals_queue = TotalsQueue.from_env(recalculate_users_totals)
+
 def recalculate_all_user_totals():
     """
     Recalculate totals for all users in the system.
@@ -49,36 +107,33 @@ def recalculate_all_user_totals():
     """
     try:
         # Get all users
-        users_res = supabase.table('profiles').select('id').execute()
-        
         results = []
-        for user in users_res.data:
-            result = recalculate_user_totals(user['id'])
-            results.append(result)
-            
+        for chunk in batch.iter_member_chunks(supabase_client.supabase):
+            results.extend(recalculate_users_totals([user['id'] for user in chunk]))
         return results
         
     except Exception as e:
-        print(f"Error recalculating all user totals: {e}")
+        log.exception("Recalculating all user totals failed", extra={'event': 'recalculate_totals_failed'})
         raise e
 
 def update_user_totals_after_contribution_change(user_id: str):
     """
     Update user totals after a contribution is added, modified, or deleted.
-    This should be called whenever contribution data changes.
+    This should be called whenever contribution data changes. The recompute is
+    queued (see totals_queue.py); readers call totals_queue.flush_user first.
     """
-    return recalculate_user_totals(user_id)
+    totals_queue.enqueue(user_id)
 
 def update_user_totals_after_loan_change(user_id: str):
     """
     Update user totals after a loan is added, modified, or deleted.
     This should be called whenever loan data changes.
     """
-    return recalculate_user_totals(user_id)
+    totals_queue.enqueue(user_id)
 
 def update_user_totals_after_payment(user_id: str, loan_id: str = None):
     """
     Update user totals after a loan payment.
     This should be called whenever a loan payment is made.
     """
-    return recalculate_user_totals(user_id)
+    totals_queue.enqueue(user_id)
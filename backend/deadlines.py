@@ -0,0 +1,221 @@
+"""
+Per-request deadlines, propagated to every data-layer call.
+
+:class:`DeadlineMiddleware` gives each request a deadline when it arrives:
+the first matching entry of ROUTE_DEADLINES, else REQUEST_DEADLINE_MS. The
+deadline lives in a context variable, so it follows the request into the
+threadpool that runs the sync route handlers. The same deadline is
+cancelled early when the client disconnects.
+
+The data layer consults it on every call:
+  * ``data_layer.TracedQuery.execute`` raises :class:`DeadlineExceeded`
+    instead of issuing a query once the deadline has passed or the request
+    was cancelled, so the rest of a handler's round trips are skipped.
+  * The direct Postgres backend (pg_backend.py) bounds each statement by
+    the time left and cancels it on the server when the deadline passes or
+    the client goes away.
+  * Over PostgREST an HTTP call already in flight cannot be interrupted; it
+    is bounded by the client's own timeout and the next call is refused.
+Only reads are cut short. Once a request issues its first write (a table
+insert/update/upsert/delete or an rpc() call) it is committed: the deadline
+no longer refuses or cancels its statements, so a handler that writes in
+several steps (a loan payment and the balance it reduces) runs to the end.
+The time a request spends queued for admission (admission.py) counts
+against its deadline.
+
+``DeadlineExceeded`` is answered with 504. Background jobs and scripts run
+without a deadline.
+
+Configuration (environment):
+  REQUEST_DEADLINE_MS   default deadline per request (default 10000; 0 = none)
+  ROUTE_DEADLINES       per-route overrides, ';'-separated "METHOD path-regex=ms",
+                        e.g. "GET /users=30000;POST /loans/request=3000"
+"""
+
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+
+from starlette.responses import JSONResponse
+
+# (method, path regex, milliseconds); the first match wins
+ROUTE_DEADLINES = [
+    ('GET', r'/users', 30000),
+    ('POST', r'/batch', 30000),
+    ('GET', r'/statements/archive', 60000),
+    ('GET', r'/forecast', 30000),
+    ('POST', r'/forecast/scenario', 30000),
+    ('POST', r'/loans/simulate', 30000),
+    ('POST', r'/admin/recalculate-user-totals/[^/]+', 30000),
+    ('POST', r'/admin/archive-closed-loans', 120000),
+]
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time, or its client went away, before the work was done."""
+
+class Deadline:
+    __slots__ = ('expires_at', 'budget', 'reason', 'committed', '_callbacks', '_lock')
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.reason = None      # set when cancelled before expiry
+        self.committed = False  # set by the request's first write
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.reason is not None or time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.committed:
+            return
+        if self.reason is not None:
+            raise DeadlineExceeded(self.reason)
+        if time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f"deadline of {self.budget:g}s exceeded")
+
+    def cancel(self, reason: str):
+        """Stop the request's remaining work (e.g. the client disconnected)."""
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call ``callback()`` if the deadline is cancelled while it is registered."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+_current = contextvars.ContextVar('request_deadline', default=None)
+
+def current() -> Deadline | None:
+    return _current.get()
+
+def check():
+    """Raise DeadlineExceeded if the current request is out of time; no-op outside requests."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+def commit():
+    """
+    The current request is about to write: check its deadline one last time,
+    then let the rest of its statements run (no-op outside requests).
+    """
+    deadline = _current.get()
+    if deadline is not None and not deadline.committed:
+        deadline.check()
+        deadline.committed = True
+
+def _parse_routes(text: str) -> list:
+    routes = []
+    for entry in filter(None, (part.strip() for part in text.split(';'))):
+        route, _, ms = entry.rpartition('=')
+        method, _, pattern = route.strip().partition(' ')
+        routes.append((method.upper(), pattern.strip(), int(ms)))
+    return routes
+
+class DeadlinePolicy:
+    def __init__(self, default_ms: float = 10000.0, routes=ROUTE_DEADLINES):
+        self.default_ms = default_ms
+        self.routes = [(method, re.compile(pattern + '/?'), ms) for method, pattern, ms in routes]
+        self.stats = {'exceeded': 0, 'disconnected': 0}
+
+    @classmethod
+    def from_env(cls) -> 'DeadlinePolicy':
+        return cls(float(os.getenv('REQUEST_DEADLINE_MS', '10000')),
+                   _parse_routes(os.getenv('ROUTE_DEADLINES', '')) + ROUTE_DEADLINES)
+
+    def budget_ms(self, method: str, path: str) -> float:
+        for route_method, pattern, ms in self.routes:
+            if route_method == method and pattern.fullmatch(path):
+                return ms
+        return self.default_ms
+
+policy = DeadlinePolicy.from_env()
+
+def deadline_response(exc: DeadlineExceeded) -> JSONResponse:
+    return JSONResponse({'detail': f"Request timed out: {exc}"}, status_code=504)
+
+async def handle_deadline_exceeded(request, exc: DeadlineExceeded) -> JSONResponse:
+    """FastAPI exception handler: DeadlineExceeded from a route or dependency becomes a 504."""
+    policy.stats['exceeded'] += 1
+    return deadline_response(exc)
+
+class DeadlineMiddleware:
+    """ASGI middleware: set the request deadline and cancel it when the client disconnects."""
+
+    def __init__(self, app, policy: DeadlinePolicy = policy):
+        self.app = app
+        self.policy = policy
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        budget_ms = self.policy.budget_ms(scope['method'], scope['path'])
+        if budget_ms <= 0:
+            await self.app(scope, receive, send)
+            return
+        deadline = Deadline(budget_ms / 1000.0)
+        token = _current.set(deadline)
+        # One reader owns the receive channel, so a disconnect is seen even
+        # while a sync handler is busy and never reads it
+        messages = asyncio.Queue()
+        response_started = False
+        response_done = False
+
+        async def pump():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message['type'] == 'http.disconnect':
+                    if deadline.reason is None and not response_done:
+                        self.policy.stats['disconnected'] += 1
+                        deadline.cancel('client disconnected')
+                    return
+
+        async def receive_from_pump():
+            message = await messages.get()
+            if message['type'] == 'http.disconnect':
+                messages.put_nowait(message)
+            return message
+
+        async def send_tracking(message):
+            nonlocal response_started, response_done
+            if message['type'] == 'http.response.start':
+                response_started = True
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                response_done = True
+            await send(message)
+
+        reader = asyncio.create_task(pump())
+        try:
+            await self.app(scope, receive_from_pump, send_tracking)
+        except DeadlineExceeded as exc:
+            # Raised below the app's exception handlers, e.g. in a middleware
+            self.policy.stats['exceeded'] += 1
+            if not response_started:
+                await deadline_response(exc)(scope, receive_from_pump, send)
+        finally:
+            response_done = True
+            reader.cancel()
+            _current.reset(token)
@@ -1,8 +1,18 @@
 from fastapi import Header, HTTPException, Depends
+import contextlib
+import contextvars
+import logging
 import os
 import re
 
+from auth import AuthError, family_from_claims, operator_from_claims, role_from_claims, verify_token
+import logs
+import tenancy
+
+log = logging.getLogger(__name__)
+
 MOCK_MODE = os.getenv("UVICORN_MOCK_AUTH") == "1"
+FAMILY_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
 
 def is_valid_uuid(uuid_string):
     """Check if a string is a valid UUID format"""
@@ -12,8 +22,13 @@ def is_valid_uuid(uuid_string):
     )
     return bool(uuid_pattern.match(uuid_string or ''))
 
+def _family(user_id: str, claimed: str | None) -> str:
+    """The caller's family: from the token or header, else their profile (cached), else the default family."""
+    return claimed or tenancy.directory.family_of(user_id) or tenancy.DEFAULT_FAMILY_ID
+
 class UserContext:
-    def __init__(self, id: str, role: str, email: str | None = None):
+    def __init__(self, id: str, role: str, email: str | None = None, family_id: str | None = None,
+                 operator: bool = False):
         self.id = id
         # Normalize role values - map 'user' to 'member' for consistency
         if role == 'user':
@@ -21,31 +36,80 @@ class UserContext:
         else:
             self.role = role
         self.email = email or "mock@example.com"
+        # Tenant the caller acts in (see tenancy.py)
+        self.family_id = family_id
+        # Deployment operator: may run maintenance that spans every family (see auth.py)
+        self.operator = operator
+
+# Caller already authenticated by an enclosing request (the sub-requests of a POST /batch)
+_shared_user = contextvars.ContextVar('shared_user', default=None)
+
+@contextlib.contextmanager
+def shared_user(user: UserContext):
+    """Requests served in the current context act as ``user`` without authenticating again."""
+    token = _shared_user.set(user)
+    try:
+        yield user
+    finally:
+        _shared_user.reset(token)
+
+def _bound(user: UserContext) -> UserContext:
+    """Attribute the request's log records to the caller (see logs.py)."""
+    logs.bind(user_id=user.id, family_id=user.family_id)
+    return user
 
-def get_current_user(x_user_id: str | None = Header(default=None), x_user_role: str | None = Header(default=None)) -> UserContext:
-    """Phase 1 mock auth or header-injected context."""
+def get_current_user(authorization: str | None = Header(default=None), x_user_id: str | None = Header(default=None),
+                     x_user_role: str | None = Header(default=None),
+                     x_family_id: str | None = Header(default=None),
+                     x_operator: str | None = Header(default=None)) -> UserContext:
+    """Mock auth from X-User-* / X-Family-Id / X-Operator headers in development, otherwise a verified Supabase bearer token (see auth.py)."""
+    shared = _shared_user.get()
+    if shared is not None:
+        return shared
     if MOCK_MODE:
         # Default admin for rapid development (using real UUID from sample data)
         user_id = x_user_id or "5e98e9eb-375b-49f6-82bc-904df30c4021"
         
         # Validate UUID format, fallback to default if invalid
         if not is_valid_uuid(user_id):
-            print(f"Warning: Invalid UUID format received: {user_id}, falling back to default admin")
+            log.warning("Invalid UUID format received, falling back to default admin",
+                        extra={'event': 'invalid_user_id', 'received': user_id})
             user_id = "5e98e9eb-375b-49f6-82bc-904df30c4021"
             
-        return UserContext(id=user_id, role=x_user_role or "admin")
-    # Future: validate JWT here
-    if not x_user_id:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    
+        # Family ids need not be random (version 4) UUIDs, e.g. the default family
+        if x_family_id is not None and not FAMILY_ID_PATTERN.match(x_family_id):
+            x_family_id = None
+        return _bound(UserContext(id=user_id, role=x_user_role or "admin", family_id=_family(user_id, x_family_id),
+                                  operator=x_operator == "1"))
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(status_code=401, detail="Unauthorized", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = verify_token(token.strip())
+    except AuthError as exc:
+        raise HTTPException(status_code=401, detail=str(exc), headers={"WWW-Authenticate": "Bearer"})
+
     # Validate UUID format in production mode
-    if not is_valid_uuid(x_user_id):
+    if not is_valid_uuid(claims['sub']):
         raise HTTPException(status_code=400, detail="Invalid user ID format")
-        
-    return UserContext(id=x_user_id, role=x_user_role or "member")
+
+    return _bound(UserContext(id=claims['sub'], role=role_from_claims(claims), email=claims.get('email'),
+                              family_id=_family(claims['sub'], family_from_claims(claims)),
+                              operator=operator_from_claims(claims)))
 
 def require_admin(user: UserContext = Depends(get_current_user)) -> UserContext:
     # Check for both 'admin' role and handle any role inconsistencies
     if user.role not in ["admin"]:
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return user
+
+def require_operator(user: UserContext = Depends(get_current_user)) -> UserContext:
+    """Deployment-wide maintenance and diagnostics; a family admin is not enough."""
+    if not user.operator:
+        raise HTTPException(status_code=403, detail="Operator privileges required")
+    return user
+
+def require_same_family(user: UserContext, member_id: str):
+    """404 unless ``member_id`` is in the caller's family (other families' members are not disclosed)."""
+    if not tenancy.in_family(member_id, user.family_id):
+        raise HTTPException(status_code=404, detail="User not found")
@@ -0,0 +1,84 @@
+"""
+Fast JSON responses for row- and money-heavy endpoints.
+
+FastAPI's default path for a handler returning plain dicts walks the whole
+payload in Python with ``jsonable_encoder`` and then runs ``json.dumps`` over
+the copy. For the list endpoints (thousands of contribution and loan rows)
+that walk is most of the request's CPU time. Handlers here return
+:class:`FastJSONResponse` directly instead: rows are encoded in one pass by
+orjson (a compiled encoder, pinned in requirements.txt). The stdlib C
+encoder is only a fallback for environments installed without it.
+
+Money keeps the two representations the API already had, so no client
+changes: raw rows write amounts as JSON numbers (Decimal values from the
+direct Postgres backend exactly as ``jsonable_encoder`` did: an int when
+there is no fractional part, else a float), so a row looks the same
+whether it came from PostgREST or Postgres; typed responses
+(``response_model``) keep pydantic's representation, a decimal string.
+Moving either side to the other's format is an API change.
+
+Endpoints with a ``response_model`` can use :func:`typed_response`: one
+pydantic ``TypeAdapter`` validates the whole payload (e.g. every week of a
+loan schedule) and writes JSON straight from Rust, skipping FastAPI's
+validate / dump-to-Python / ``json.dumps`` round. The model stays on the
+route for the OpenAPI schema.
+
+``bench_json.py`` measures both paths against the defaults.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from functools import lru_cache
+from uuid import UUID
+
+from pydantic import BaseModel, TypeAdapter
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib encoder below
+    orjson = None
+
+def _default(value):
+    """Types neither encoder handles itself."""
+    if isinstance(value, Decimal):
+        # Same as fastapi.encoders.decimal_encoder
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(content) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'), default=_default)
+
+    def dumps(content) -> bytes:
+        return _encoder.encode(content).encode('utf-8')
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with :func:`dumps`; return it from a handler to skip ``jsonable_encoder``."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+@lru_cache(maxsize=None)
+def adapter(tp) -> TypeAdapter:
+    """One TypeAdapter per response type; building the validator is the expensive part."""
+    return TypeAdapter(tp)
+
+def typed_response(tp, content, status_code: int = 200) -> Response:
+    """Validate ``content`` as ``tp`` (e.g. ``list[ContributionOut]``) and serialize it in one pass."""
+    type_adapter = adapter(tp)
+    body = type_adapter.dump_json(type_adapter.validate_python(content, from_attributes=True))
+    return Response(body, status_code=status_code, media_type='application/json')
@@ -0,0 +1,148 @@
+"""
+Liquidity forecast: a family fund's projected weekly cash position.
+
+Cash in each week is the members' expected contributions (the sum of
+``profiles.weekly_contribution``, scaled by a collection rate) plus scheduled
+repayments on every open loan (amortization.py). Cash out is the principal of
+any pending loans a scenario approves; they are disbursed in week 1 and repaid
+on their own schedule after that. The opening position is completed
+contributions minus principal lent out (approved and paid loans) plus
+repayments received. Archived loans are paid or rejected, so they net to
+zero and are left out.
+
+The inputs are cached separately in a :class:`data_cache.VersionedCache`:
+  members    weekly contribution total             (profiles)
+  loan book  open/pending loans and the repayment
+             totals for every open loan            (loans)
+  opening    current cash position                 (contributions, loans, loan_payments)
+A write to one table only recomputes the parts that read it, and only for
+the family written to (each family has its own cache namespace). Forecasts
+for any horizon up to MAX_FORECAST_WEEKS and any scenario are cheap
+arithmetic on top of those parts.
+"""
+
+from datetime import date, timedelta
+
+import amortization
+import supabase_client
+from aggregation import FundAggregator, to_cents
+from data_cache import DEFAULT_TTL, VersionedCache, table_versions
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python fallback below
+    np = None
+
+MAX_FORECAST_WEEKS = 260
+LOAN_COLUMNS = 'id, user_id, amount, status, duration_weeks, weekly_payment, remaining_balance, approved_at'
+
+_cache = VersionedCache(table_versions, ttl=DEFAULT_TTL)
+
+def _members(family_id: str) -> dict:
+    rows = supabase_client.supabase.table('profiles').select('id, weekly_contribution').eq('family_id', family_id).execute().data or []
+    weekly = [to_cents(r.get('weekly_contribution')) or 0 for r in rows]
+    total = int(np.asarray(weekly, dtype=np.int64).sum()) if np is not None and weekly else sum(weekly)
+    return {'ids': [r['id'] for r in rows], 'weekly_total': total, 'count': len(rows)}
+
+def _loan_book(today: date, family_id: str) -> dict:
+    rows = (supabase_client.supabase.table('loans').select(LOAN_COLUMNS).eq('family_id', family_id)
+            .in_('status', ['approved', 'pending']).execute().data or [])
+    open_loans, projection = amortization.project_open_loans(rows, today, weeks=MAX_FORECAST_WEEKS)
+    repayments = amortization.weekly_totals(projection) if open_loans else [0] * MAX_FORECAST_WEEKS
+    return {
+        'open_count': len(open_loans),
+        'outstanding': sum(to_cents(l.get('remaining_balance')) or 0 for l in open_loans),
+        'pending': {l['id']: l for l in rows if l.get('status') == 'pending'},
+        'repayments': repayments,
+    }
+
+def _opening(member_ids: list, family_id: str) -> int:
+    client = supabase_client.supabase
+    contributions = FundAggregator(member_ids)
+    contributions.add_contributions(client.table('contributions').select('user_id, amount').eq('family_id', family_id)
+                                    .eq('status', 'completed').csv().execute().data)
+    repaid = FundAggregator(member_ids)
+    repaid.add_contributions(client.table('loan_payments').select('user_id, amount').eq('family_id', family_id).csv().execute().data)
+    lent = FundAggregator(member_ids)
+    lent.add_contributions(client.table('loans').select('user_id, amount').eq('family_id', family_id)
+                           .in_('status', ['approved', 'paid']).csv().execute().data)
+    return sum(contributions.contributed.totals) + sum(repaid.contributed.totals) - sum(lent.contributed.totals)
+
+def members(family_id: str) -> dict:
+    return _cache.get_or_compute('members', ('profiles',), lambda: _members(family_id), family_id=family_id)
+
+def loan_book(today: date, family_id: str) -> dict:
+    return _cache.get_or_compute(('loan_book', today), ('loans',), lambda: _loan_book(today, family_id), family_id=family_id)
+
+def opening_cash(family_id: str) -> int:
+    ids = members(family_id)['ids']
+    return _cache.get_or_compute('opening', ('contributions', 'loans', 'loan_payments', 'profiles'),
+                                 lambda: _opening(ids, family_id), family_id=family_id)
+
+def _scenario_flows(loans: list, weeks: int) -> tuple:
+    """(disbursed principal, repayments per week) if ``loans`` were approved today."""
+    if not loans:
+        return 0, [0] * weeks
+    amounts = [to_cents(l.get('amount')) or 0 for l in loans]
+    projection = amortization.project(amounts, [amortization.weekly_payment_cents(l) for l in loans], weeks=weeks)
+    return sum(amounts), amortization.weekly_totals(projection)
+
+DEFAULT_FORECAST_WEEKS = 26
+
+def forecast(family_id: str, weeks: int, today: date, collection_rate: float = 1.0, opening: int | None = None,
+             approve: list | None = None) -> dict:
+    """
+    A family's weekly cash position for ``weeks`` weeks from ``today`` (all money in cents).
+
+    ``approve`` is a list of pending loan ids to treat as approved today.
+    Raises KeyError with the first id that is not a pending loan.
+    """
+    weeks = max(1, min(weeks, MAX_FORECAST_WEEKS))
+    member_info = members(family_id)
+    book = loan_book(today, family_id)
+    start = opening_cash(family_id) if opening is None else opening
+
+    approved = []
+    for loan_id in approve or []:
+        if loan_id not in book['pending']:
+            raise KeyError(loan_id)
+        approved.append(book['pending'][loan_id])
+    disbursed, new_repayments = _scenario_flows(approved, weeks)
+
+    contributions_in = round(member_info['weekly_total'] * collection_rate)
+    rows = []
+    cash = start
+    low_cash, low_week, shortfall_week = start, 0, None
+    for t in range(weeks):
+        repayments_in = book['repayments'][t] + new_repayments[t]
+        out = disbursed if t == 0 else 0
+        net = contributions_in + repayments_in - out
+        cash += net
+        rows.append({
+            'week': t + 1,
+            'week_ending': today + timedelta(weeks=t + 1),
+            'contributions_in': contributions_in,
+            'repayments_in': repayments_in,
+            'disbursements_out': out,
+            'net': net,
+            'cash': cash,
+        })
+        if cash < low_cash:
+            low_cash, low_week = cash, t + 1
+        if cash < 0 and shortfall_week is None:
+            shortfall_week = t + 1
+    return {
+        'as_of': today,
+        'weeks': weeks,
+        'collection_rate': collection_rate,
+        'members': member_info['count'],
+        'open_loans': book['open_count'],
+        'outstanding_loans': book['outstanding'],
+        'approved_loan_ids': [l['id'] for l in approved],
+        'opening_cash': start,
+        'closing_cash': cash,
+        'min_cash': low_cash,
+        'min_cash_week': low_week,
+        'first_shortfall_week': shortfall_week,
+        'schedule': rows,
+    }
@@ -0,0 +1,288 @@
+"""
+Loan interest accrual.
+
+Interest is optional and set per loan (supabase/migrations/006_loan_interest.sql):
+``interest_rate`` is an annual percentage (0, the default, means interest-free)
+and ``interest_compounding`` says how that rate compounds within an accrual
+period:
+  none     pro rata: balance × rate × days / 365
+  daily    balance × ((1 + rate / 365) ** days - 1)
+  weekly   balance × ((1 + rate × 7 / 365) ** (days / 7) - 1)
+Accrued interest is added to ``remaining_balance``, so later periods charge
+interest on it.
+
+The batch runs daily or weekly (INTEREST_ACCRUAL_FREQUENCY). A daily period
+is one day, keyed by its ISO date. A weekly period is an ISO week, keyed
+'YYYY-Www'. Each open loan is charged for every whole period after
+``interest_accrued_through`` (or after approval) up to ``as_of``. A loan's
+first period is prorated. All loans are computed together as a loans ×
+periods matrix, one column at a time, with NumPy when it is installed.
+
+Entries are written through ``apply_interest_accruals``. The ledger is
+unique on (loan_id, period_key), and one call inserts a loan's entries and
+moves its balance in a single transaction. Re-running a crashed or repeated
+batch therefore charges nothing twice. A loan whose balance changed after
+the batch read it (e.g. a payment) is skipped and picked up by the next run.
+Changing a loan's rate or compounding (PUT /loans/{id}/interest) first
+charges the old terms up to yesterday (:func:`settle_loan`).
+
+Usage:
+    plan = plan_accruals(loans, as_of, 'daily')
+    plan.entries          # one dict per (loan, period), money in cents
+"""
+
+import math
+import os
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+
+import batch
+import supabase_client
+from aggregation import cents_to_decimal, to_cents
+from amortization import parse_date
+from data_cache import table_versions
+from db_utils import recalculate_users_totals, totals_queue
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python fallback below
+    np = None
+
+FREQUENCIES = ('daily', 'weekly')
+COMPOUNDING = ('none', 'daily', 'weekly')
+DAYS_PER_YEAR = 365
+# Longest catch-up charged in one run; older gaps are picked up by the next run
+MAX_CATCH_UP_PERIODS = 400
+# Loans per apply_interest_accruals call
+DEFAULT_APPLY_BATCH = 200
+
+LOAN_COLUMNS = 'id, user_id, remaining_balance, interest_rate, interest_compounding, interest_accrued_through, approved_at'
+
+def default_frequency() -> str:
+    frequency = os.getenv('INTEREST_ACCRUAL_FREQUENCY', 'daily')
+    return frequency if frequency in FREQUENCIES else 'daily'
+
+def accrual_start(loan: dict) -> date | None:
+    """First day not yet charged: the day after accrued_through, else the day after approval."""
+    through = parse_date(loan.get('interest_accrued_through'))
+    if through is None:
+        through = parse_date(loan.get('approved_at'))
+    return through + timedelta(days=1) if through else None
+
+def periods(first: date, as_of: date, frequency: str) -> list:
+    """
+    (period_key, start, end) for every whole period ending on or before
+    ``as_of`` that contains a day from ``first`` onwards. ``start`` is clipped
+    to ``first``, so the first period may be partial.
+    """
+    out = []
+    if frequency == 'daily':
+        day = first
+        while day <= as_of and len(out) < MAX_CATCH_UP_PERIODS:
+            out.append((day.isoformat(), day, day))
+            day += timedelta(days=1)
+        return out
+    if frequency != 'weekly':
+        raise ValueError(f"Unknown accrual frequency: {frequency}")
+    monday = first - timedelta(days=first.weekday())
+    while monday + timedelta(days=6) <= as_of and len(out) < MAX_CATCH_UP_PERIODS:
+        year, week, _ = monday.isocalendar()
+        out.append((f"{year}-W{week:02d}", max(monday, first), monday + timedelta(days=6)))
+        monday += timedelta(weeks=1)
+    return out
+
+def _factor(rate: float, compounding: str, days: int) -> float:
+    if days <= 0 or rate <= 0:
+        return 0.0
+    if compounding == 'daily':
+        return (1 + rate / DAYS_PER_YEAR) ** days - 1
+    if compounding == 'weekly':
+        return (1 + rate * 7 / DAYS_PER_YEAR) ** (days / 7) - 1
+    return rate * days / DAYS_PER_YEAR
+
+def _accrue_numpy(balances: list, rates: list, compounding: list, days: list) -> list:
+    b = np.asarray(balances, dtype=np.float64)
+    r = np.asarray(rates, dtype=np.float64)[:, None]
+    d = np.asarray(days, dtype=np.float64)
+    code = np.asarray([COMPOUNDING.index(c) for c in compounding])[:, None]
+    with np.errstate(invalid='ignore'):
+        factor = np.where(code == 1, (1 + r / DAYS_PER_YEAR) ** d - 1,
+                 np.where(code == 2, (1 + r * 7 / DAYS_PER_YEAR) ** (d / 7) - 1,
+                          r * d / DAYS_PER_YEAR))
+    factor[(d <= 0) | (r <= 0)] = 0.0
+    interest = np.zeros(d.shape, dtype=np.int64)
+    for p in range(d.shape[1]):
+        # Each period compounds on the balance after the previous one
+        interest[:, p] = np.floor(b * factor[:, p] + 0.5).astype(np.int64)
+        b += interest[:, p]
+    return interest.tolist()
+
+def _accrue_python(balances: list, rates: list, compounding: list, days: list) -> list:
+    out = []
+    for balance, rate, mode, row in zip(balances, rates, compounding, days):
+        charged = []
+        for n in row:
+            cents = math.floor(balance * _factor(rate, mode, n) + 0.5)
+            charged.append(cents)
+            balance += cents
+        out.append(charged)
+    return out
+
+def accrue(balances: list, rates: list, compounding: list, days: list) -> list:
+    """
+    Interest in cents per loan and period. ``days`` is a loans × periods
+    matrix of days charged (0 pads short rows), ``rates`` are fractions.
+    """
+    if not balances:
+        return []
+    if np is not None:
+        return _accrue_numpy(balances, rates, compounding, days)
+    return _accrue_python(balances, rates, compounding, days)
+
+class AccrualPlan:
+    __slots__ = ('entries', 'loans', 'skipped')
+
+    def __init__(self):
+        self.entries = []
+        self.loans = []
+        self.skipped = Counter()
+
+def plan_accruals(loans: list, as_of: date, frequency: str) -> AccrualPlan:
+    """Ledger entries for every open loan with a rate, for all periods due up to ``as_of``."""
+    plan = AccrualPlan()
+    rows = []
+    for loan in loans:
+        rate = Decimal(str(loan.get('interest_rate') or 0))
+        start = accrual_start(loan)
+        if loan.get('status', 'approved') != 'approved' or rate <= 0:
+            plan.skipped['no interest'] += 1
+            continue
+        if start is None:
+            plan.skipped['no start date'] += 1
+            continue
+        due = periods(start, as_of, frequency)
+        if not due:
+            plan.skipped['up to date'] += 1
+            continue
+        mode = loan.get('interest_compounding') or 'none'
+        rows.append((loan, rate, mode if mode in COMPOUNDING else 'none', due))
+
+    width = max((len(due) for *_, due in rows), default=0)
+    balances = [to_cents(loan.get('remaining_balance')) or 0 for loan, *_ in rows]
+    interest = accrue(
+        balances,
+        [float(rate) / 100 for _, rate, _, _ in rows],
+        [mode for _, _, mode, _ in rows],
+        [[(end - start).days + 1 for _, start, end in due] + [0] * (width - len(due)) for *_, due in rows],
+    )
+
+    for (loan, rate, mode, due), base, charged in zip(rows, balances, interest):
+        balance = base
+        for (key, start, end), cents in zip(due, charged):
+            plan.entries.append({
+                'loan_id': loan['id'],
+                'user_id': loan['user_id'],
+                'period_key': key,
+                'period_start': start,
+                'period_end': end,
+                'rate': rate,
+                'compounding': mode,
+                'base_balance': base,
+                'balance_before': balance,
+                'amount': cents,
+                'balance_after': balance + cents,
+            })
+            balance += cents
+        plan.loans.append(loan['id'])
+    return plan
+
+def _rpc_entry(entry: dict) -> dict:
+    out = dict(entry)
+    for key in ('base_balance', 'balance_before', 'amount', 'balance_after'):
+        out[key] = float(cents_to_decimal(entry[key]))
+    out['rate'] = float(entry['rate'])
+    out['period_start'] = entry['period_start'].isoformat()
+    out['period_end'] = entry['period_end'].isoformat()
+    return out
+
+def _sample_entry(entry: dict) -> dict:
+    out = _rpc_entry(entry)
+    out.pop('base_balance')
+    return out
+
+def settle_loan(loan: dict, through: date) -> int:
+    """
+    Charge ``loan`` at its current rate for every day not yet charged up to
+    ``through``; used before its rate or compounding changes, so the old
+    terms cover the time they were in force. Returns the cents charged.
+    """
+    plan = plan_accruals([loan], through, 'daily')
+    if not plan.entries:
+        return 0
+    rows = supabase_client.supabase.rpc('apply_interest_accruals',
+                                        {'p_entries': [_rpc_entry(e) for e in plan.entries]}).execute().data or []
+    # RPC writes bypass the data-layer observer
+    table_versions.bump('loans', 'loan_interest_accruals')
+    recalculate_users_totals([loan['user_id']])
+    return sum(to_cents(row.get('amount')) or 0 for row in rows if row.get('applied'))
+
+def accrue_interest(ctx, as_of: date | None = None, frequency: str | None = None, dry_run: bool = False,
+                    batch_size: int = DEFAULT_APPLY_BATCH, sample: int = 50) -> dict:
+    """
+    Job body (see jobs.py): charge interest on every open interest-bearing
+    loan for the periods due up to ``as_of`` (default yesterday, the last
+    complete day), then refresh the totals of affected members. With
+    ``dry_run`` nothing is written and the would-be entries are returned.
+    """
+    as_of = as_of or date.today() - timedelta(days=1)
+    frequency = frequency or default_frequency()
+    client = supabase_client.supabase
+    ctx.set_message('loading open loans')
+    loans = []
+    for page in batch.iter_pages(client, 'loans', LOAN_COLUMNS, filters=[('eq', 'status', 'approved'), ('gt', 'interest_rate', 0)]):
+        loans.extend(page)
+    plan = plan_accruals(loans, as_of, frequency)
+
+    results = Counter()
+    charged = 0
+    members = []
+    if not dry_run and plan.entries:
+        ctx.set_message('applying accruals')
+        ctx.set_total(len(plan.loans))
+        by_loan = {}
+        for entry in plan.entries:
+            by_loan.setdefault(entry['loan_id'], []).append(entry)
+        # A loan's entries must share one call: its balance check and update are per call
+        for start in range(0, len(plan.loans), batch_size):
+            chunk = plan.loans[start:start + batch_size]
+            payload = [_rpc_entry(e) for loan_id in chunk for e in by_loan[loan_id]]
+            rows = client.rpc('apply_interest_accruals', {'p_entries': payload}).execute().data or []
+            for row in rows:
+                results[row['reason']] += 1
+                if row.get('applied'):
+                    charged += to_cents(row.get('amount')) or 0
+            members.extend(e['user_id'] for loan_id in chunk for e in by_loan[loan_id][:1])
+            ctx.advance(len(chunk))
+        # RPC writes bypass the data-layer observer
+        table_versions.bump('loans', 'loan_interest_accruals')
+        members = list(dict.fromkeys(members))
+        ctx.set_message('refreshing member totals')
+        for start in range(0, len(members), totals_queue.batch_size):
+            recalculate_users_totals(members[start:start + totals_queue.batch_size])
+    else:
+        charged = sum(e['amount'] for e in plan.entries)
+
+    return {
+        'as_of': as_of.isoformat(),
+        'frequency': frequency,
+        'dry_run': dry_run,
+        'loans_considered': len(loans),
+        'loans_accrued': len(plan.loans),
+        'loans_skipped': dict(plan.skipped),
+        'entries': len(plan.entries),
+        'results': dict(results),
+        'members_affected': len(members),
+        'interest_charged': str(cents_to_decimal(charged)),
+        'sample': [_sample_entry(e) for e in plan.entries[:sample]],
+    }
@@ -0,0 +1,193 @@
+"""
+Background job runner for long-running admin work.
+
+Endpoints that touch every member (recalculations, limit updates) submit a
+job here and return its id straight away; progress and results are polled
+through ``GET /admin/jobs/{id}``. Jobs run on a bounded thread pool, can be
+cancelled cooperatively, and a submission whose key matches a job that is
+still queued or running returns that job instead of starting another. A job
+submitted for one family carries a ``family_id`` param; lookups made on behalf
+of a family admin only see that family's jobs.
+
+A job function receives a :class:`JobContext` as its first argument and
+should call ``ctx.advance()`` as it goes; ``advance``/``check_cancelled``
+raise :class:`JobCancelled` once a cancel has been requested.
+
+Configuration (environment):
+  JOB_WORKERS   jobs run concurrently (default 2)
+  JOB_HISTORY   finished jobs kept for polling (default 200)
+"""
+
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation has been requested."""
+
+class Job:
+    def __init__(self, kind: str, key: str | None, params: dict):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key
+        self.params = params
+        # Family the job works on (its ``family_id`` param); None for deployment-wide maintenance
+        self.family_id = params.get('family_id')
+        self.status = QUEUED
+        self.done = 0
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    def as_dict(self, include_result: bool = True) -> dict:
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'key': self.key,
+            'params': self.params,
+            'status': self.status,
+            'progress': {
+                'done': self.done,
+                'total': self.total,
+                'percent': round(100.0 * self.done / self.total, 1) if self.total else None,
+            },
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cancel_requested': self.cancel_requested.is_set(),
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+class JobContext:
+    """Handle a running job uses to report progress and notice cancellation."""
+
+    def __init__(self, job: Job):
+        self._job = job
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job.cancel_requested.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def set_total(self, total: int):
+        self._job.total = total
+
+    def set_message(self, message: str):
+        self._job.message = message
+
+    def advance(self, n: int = 1):
+        self._job.done += n
+        self.check_cancelled()
+
+class JobRunner:
+    def __init__(self, max_workers: int = 2, history: int = 200):
+        self._pool = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._active_keys = {}
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn, *args, key: str | None = None, params: dict | None = None, **kwargs) -> tuple[Job, bool]:
+        """
+        Queue ``fn(ctx, *args, **kwargs)``. Returns ``(job, created)``; when a
+        job with the same ``key`` is still queued or running, that job is
+        returned with ``created=False``.
+        """
+        with self._lock:
+            if key is not None and key in self._active_keys:
+                return self._jobs[self._active_keys[key]], False
+            job = Job(kind, key, params or {})
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_keys[key] = job.id
+            self._trim()
+            job.future = self._pool.submit(self._run, job, fn, args, kwargs)
+            return job, True
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancel_requested.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = _now()
+        try:
+            job.result = fn(JobContext(job), *args, **kwargs)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            log.exception("Job %s failed", job.kind, extra={'event': 'job_failed', 'job_id': job.id, 'kind': job.kind})
+            self._finish(job, FAILED)
+        else:
+            self._finish(job, SUCCEEDED)
+
+    def _finish(self, job: Job, status: str):
+        with self._lock:
+            job.status = status
+            job.finished_at = _now()
+            if job.key is not None and self._active_keys.get(job.key) == job.id:
+                del self._active_keys[job.key]
+
+    def _trim(self):
+        """Drop the oldest finished jobs beyond the history limit."""
+        finished = [jid for jid, j in self._jobs.items() if j.status not in ACTIVE_STATES]
+        for jid in finished[:max(len(finished) - self._history, 0)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status: str | None = None, kind: str | None = None, limit: int = 50,
+             families: set | None = None) -> list:
+        """Newest first; ``families`` limits the result to jobs whose ``family_id`` is in the set."""
+        with self._lock:
+            snapshot = list(self._jobs.values())
+        jobs = [j for j in reversed(snapshot)
+                if (status is None or j.status == status) and (kind is None or j.kind == kind)
+                and (families is None or j.family_id in families)]
+        return jobs[:limit]
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Request cancellation. Queued jobs never start; running jobs stop at their next checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.status not in ACTIVE_STATES:
+            return job
+        job.cancel_requested.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        return job
+
+job_runner = JobRunner(
+    max_workers=int(os.getenv('JOB_WORKERS', '2')),
+    history=int(os.getenv('JOB_HISTORY', '200')),
+)
@@ -0,0 +1,158 @@
+"""
+Point-in-time member positions from the append-only ledger.
+
+``ledger_events`` and ``member_snapshots`` are defined in
+supabase/migrations/007_member_ledger.sql. Triggers on contributions, loans,
+loan_payments, loan_interest_accruals and users append one event per change.
+A member's position at time T is then:
+  * the latest snapshot with as_of <= T (all events with occurred_at < as_of)
+  * plus a replay of the events with occurred_at < T that the snapshot does
+    not include, i.e. occurred_at >= snapshot.as_of, or recorded after the
+    snapshot was taken (id > last_event_id).
+With weekly snapshots a replay is at most a week of events per member.
+Without a snapshot the member's whole history is replayed.
+
+Positions are in integer cents (see aggregation.py). The borrowing limit
+uses the last ``limit_changed`` percent before T, or the member's current
+percent if none was recorded.
+
+Usage:
+    positions = positions_as_of([user_id], ledger_cutoff(as_of_date))
+    positions[user_id].available_credit()
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+import batch
+import supabase_client
+from aggregation import cents_to_decimal, percent_of_cents, to_cents
+from data_cache import table_versions
+
+EVENT_COLUMNS = 'id, user_id, event_type, occurred_at, contributed_delta, loan_delta, limit_percent'
+SNAPSHOT_COLUMNS = 'user_id, as_of, last_event_id, total_contributed, loan_balance, limit_percent, event_count'
+DEFAULT_LIMIT_PERCENT = Decimal('75.0')
+
+def ledger_cutoff(as_of: date) -> datetime:
+    """Positions "on" a date include that whole day (UTC): events before the next midnight."""
+    return datetime.combine(as_of + timedelta(days=1), time.min, tzinfo=timezone.utc)
+
+def _parse_time(value) -> datetime:
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class MemberPosition:
+    __slots__ = ('user_id', 'as_of', 'total_contributed', 'loan_balance', 'limit_percent', 'events', 'snapshot_as_of')
+
+    def __init__(self, user_id: str, as_of: datetime):
+        self.user_id = user_id
+        self.as_of = as_of
+        self.total_contributed = 0
+        self.loan_balance = 0
+        self.limit_percent = None
+        self.events = 0
+        self.snapshot_as_of = None
+
+    def load_snapshot(self, snapshot: dict):
+        self.total_contributed = to_cents(snapshot.get('total_contributed')) or 0
+        self.loan_balance = to_cents(snapshot.get('loan_balance')) or 0
+        if snapshot.get('limit_percent') is not None:
+            self.limit_percent = Decimal(str(snapshot['limit_percent']))
+        self.events = int(snapshot.get('event_count') or 0)
+        self.snapshot_as_of = _parse_time(snapshot['as_of'])
+
+    def apply(self, event: dict):
+        self.total_contributed += to_cents(event.get('contributed_delta')) or 0
+        self.loan_balance += to_cents(event.get('loan_delta')) or 0
+        if event.get('limit_percent') is not None:
+            self.limit_percent = Decimal(str(event['limit_percent']))
+        self.events += 1
+
+    def borrowing_limit(self, default_percent: Decimal | None = None) -> int:
+        percent = self.limit_percent if self.limit_percent is not None else (default_percent or DEFAULT_LIMIT_PERCENT)
+        return percent_of_cents(self.total_contributed, percent)
+
+    def available_credit(self, default_percent: Decimal | None = None) -> int:
+        return max(self.borrowing_limit(default_percent) - self.loan_balance, 0)
+
+def _latest_snapshots(user_ids: list, cutoff: datetime) -> dict:
+    """Latest snapshot per member taken for a time at or before ``cutoff``."""
+    latest = {}
+    for start in range(0, len(user_ids), batch.DEFAULT_CHUNK_SIZE):
+        chunk = user_ids[start:start + batch.DEFAULT_CHUNK_SIZE]
+        rows = (supabase_client.supabase.table('member_snapshots').select(SNAPSHOT_COLUMNS)
+                .in_('user_id', chunk).lte('as_of', cutoff.isoformat()).order('as_of', desc=True)
+                .execute().data or [])
+        for row in rows:
+            latest.setdefault(row['user_id'], row)
+    return latest
+
+def _events(user_ids: list, cutoff: datetime, since: datetime | None, after_id: int | None, page_size: int = batch.DEFAULT_PAGE_SIZE):
+    """Events before ``cutoff`` that occurred at/after ``since`` or were recorded after event ``after_id``."""
+    last = None
+    while True:
+        query = (supabase_client.supabase.table('ledger_events').select(EVENT_COLUMNS)
+                 .in_('user_id', user_ids).lt('occurred_at', cutoff.isoformat()))
+        if since is not None:
+            # Timestamps hold reserved characters (':') and must be quoted in or=(...)
+            query = query.or_(f'occurred_at.gte."{since.isoformat()}",id.gt.{after_id}')
+        if last is not None:
+            query = query.gt('id', last)
+        rows = query.order('id').limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]['id']
+
+def positions_as_of(user_ids, cutoff: datetime) -> dict:
+    """MemberPosition per user for all events that occurred before ``cutoff``."""
+    user_ids = list(dict.fromkeys(user_ids))
+    positions = {uid: MemberPosition(uid, cutoff) for uid in user_ids}
+    if not user_ids:
+        return positions
+    snapshots = _latest_snapshots(user_ids, cutoff)
+    for uid, snapshot in snapshots.items():
+        positions[uid].load_snapshot(snapshot)
+    last_ids = {uid: int(s['last_event_id']) for uid, s in snapshots.items()}
+
+    for start in range(0, len(user_ids), batch.DEFAULT_CHUNK_SIZE):
+        chunk = user_ids[start:start + batch.DEFAULT_CHUNK_SIZE]
+        # One event query per chunk, bounded by the oldest snapshot in it
+        if all(uid in snapshots for uid in chunk):
+            since = min(positions[uid].snapshot_as_of for uid in chunk)
+            after_id = min(last_ids[uid] for uid in chunk)
+        else:
+            since = after_id = None
+        for event in _events(chunk, cutoff, since, after_id):
+            position = positions[event['user_id']]
+            snap_as_of = position.snapshot_as_of
+            if snap_as_of is not None and _parse_time(event['occurred_at']) < snap_as_of and int(event['id']) <= last_ids[position.user_id]:
+                continue  # already counted in the snapshot
+            position.apply(event)
+    return positions
+
+def position_as_of(user_id: str, as_of: date) -> MemberPosition:
+    return positions_as_of([user_id], ledger_cutoff(as_of))[user_id]
+
+def snapshot_members(ctx, as_of: datetime | None = None) -> dict:
+    """Job body (see jobs.py): snapshot every member's ledger totals as of ``as_of`` (default today 00:00 UTC)."""
+    as_of = as_of or datetime.combine(datetime.now(timezone.utc).date(), time.min, tzinfo=timezone.utc)
+    ctx.set_message('writing snapshots')
+    res = supabase_client.supabase.rpc('snapshot_member_ledgers', {'p_as_of': as_of.isoformat()}).execute()
+    # RPC writes bypass the data-layer observer
+    table_versions.bump('member_snapshots')
+    return {'as_of': as_of.isoformat(), 'members': res.data or 0}
+
+def record_adjustment(user_id: str, contributed_delta: Decimal, loan_delta: Decimal, occurred_at: datetime | None, note: str | None,
+                      family_id: str | None = None) -> dict:
+    row = {
+        'user_id': user_id,
+        'family_id': family_id,
+        'event_type': 'adjustment',
+        'occurred_at': (occurred_at or datetime.now(timezone.utc)).isoformat(),
+        'contributed_delta': float(cents_to_decimal(to_cents(contributed_delta))),
+        'loan_delta': float(cents_to_decimal(to_cents(loan_delta))),
+        'source_table': 'manual',
+        'note': note,
+    }
+    return supabase_client.supabase.table('ledger_events').insert(row).execute().data[0]
@@ -0,0 +1,176 @@
+"""
+Application lifecycle: startup warm-up, readiness and cold-start timings.
+
+``main.create_app()`` builds the app and nothing connects at import: the
+storage client is created on first use (see supabase_client.py), so a new
+worker imports and starts serving quickly. The app's :func:`lifespan` then
+
+  startup    runs the warm-up steps on a background thread, so the server
+             accepts connections at once:
+               storage   create the client and run one trivial query (opens
+                         the Postgres pool or the PostgREST connection)
+               auth      fetch the JWKS signing keys (skipped in mock auth)
+               caches    with STARTUP_PREWARM_CACHES=1, compute each family's
+                         default cash-flow forecast (the costliest cached read)
+  shutdown   flushes the totals queue, stops the key refresh and closes the
+             Postgres pools.
+
+A request that arrives before warm-up is done is still served; it builds
+what it needs itself. ``GET /ready`` answers 200 once warm-up has finished
+with every required step (storage) succeeded, else 503, and reports each
+step's state and duration and the cold-start timeline: milliseconds from
+the start of main.py's import to the end of the import, app construction,
+startup, warm-up and the first response. ``GET /health`` remains a
+liveness check without dependencies. ``bench_startup.py`` measures the
+same timeline in fresh interpreters.
+
+Configuration (environment):
+  STARTUP_WARMUP           1 (default) warm dependencies at startup; 0 = fully lazy, ready at once
+  STARTUP_PREWARM_CACHES   1 = also pre-compute cached forecasts (default 0)
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import auth
+import dependencies
+import supabase_client
+
+log = logging.getLogger(__name__)
+
+PENDING, RUNNING, READY, FAILED, SKIPPED = 'pending', 'running', 'ready', 'failed', 'skipped'
+
+class Timeline:
+    """Milliseconds from ``origin`` (main.py starting to import) to each named point, first time only."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = round((time.perf_counter() - self.origin) * 1000, 1)
+
+    def info(self) -> dict:
+        return dict(self.marks)
+
+timeline = Timeline()
+
+def _storage():
+    supabase_client.get_client().table('profiles').select('id').limit(1).execute()
+
+def _auth():
+    auth.jwks_cache.prefetch()
+    if auth.jwks_cache.stats['fetch_errors'] and not auth.jwks_cache.stats['fetches']:
+        raise RuntimeError(f"could not fetch {auth.jwks_cache.url}")
+
+def _caches():
+    import forecast   # imported here: only needed when pre-warming
+    rows = supabase_client.get_client().table('profiles').select('family_id').execute().data or []
+    today = datetime.utcnow().date()
+    for family_id in sorted({row['family_id'] for row in rows if row.get('family_id')}):
+        forecast.forecast(family_id, forecast.DEFAULT_FORECAST_WEEKS, today)
+
+class Readiness:
+    def __init__(self, warmup: bool = True, prewarm_caches: bool = False):
+        # (name, function, required for readiness)
+        self.steps = [
+            ('storage', _storage, True),
+            ('auth', _auth, False),
+            ('caches', _caches, False),
+        ]
+        self.enabled = {
+            'storage': warmup,
+            'auth': warmup and not dependencies.MOCK_MODE and auth.jwks_cache.url is not None,
+            'caches': warmup and prewarm_caches,
+        }
+        self.state = {name: {'state': PENDING if self.enabled[name] else SKIPPED} for name, _, _ in self.steps}
+        self.done = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls) -> 'Readiness':
+        return cls(warmup=os.getenv('STARTUP_WARMUP', '1') == '1',
+                   prewarm_caches=os.getenv('STARTUP_PREWARM_CACHES', '0') == '1')
+
+    def start(self):
+        """Run the warm-up steps on a background thread (once)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='warm-up', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for name, step, required in self.steps:
+            if not self.enabled[name]:
+                continue
+            if name == 'caches' and self.state['storage']['state'] == FAILED:
+                self.state[name] = {'state': SKIPPED, 'error': 'storage unavailable'}
+                continue
+            started = time.perf_counter()
+            self.state[name] = {'state': RUNNING}
+            try:
+                step()
+            except Exception as e:
+                self.state[name] = {'state': FAILED, 'error': str(e) or type(e).__name__}
+                log.warning("Warm-up step %s failed: %s", name, e, extra={'event': 'warmup_failed', 'step': name})
+            else:
+                self.state[name] = {'state': READY}
+            self.state[name]['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        timeline.mark('warm')
+        self.done.set()
+
+    def ready(self) -> bool:
+        if self._thread is not None and not self.done.is_set():
+            return False
+        return all(self.state[name]['state'] != FAILED for name, _, required in self.steps if required)
+
+    def report(self) -> dict:
+        return {
+            'status': 'ready' if self.ready() else ('failed' if self.done.is_set() else 'starting'),
+            'ready': self.ready(),
+            'storage_client': 'initialized' if supabase_client.initialized() else 'lazy',
+            'steps': {name: dict(self.state[name]) for name, _, _ in self.steps},
+            'timeline_ms': timeline.info(),
+        }
+
+readiness = Readiness.from_env()
+
+def shutdown():
+    """Release what the app holds; each step runs even if an earlier one fails."""
+    from db_utils import totals_queue
+    # Pending totals are written before the pools close
+    for step in (totals_queue.drain, auth.jwks_cache.stop, supabase_client.close):
+        try:
+            step()
+        except Exception as e:
+            log.exception("Shutdown step %s failed", step.__qualname__, extra={'event': 'shutdown_failed'})
+
+@asynccontextmanager
+async def lifespan(app):
+    """FastAPI lifespan: warm up in the background on startup, release resources on shutdown."""
+    timeline.mark('startup')
+    readiness.start()
+    yield
+    shutdown()
+
+class FirstResponseMiddleware:
+    """ASGI middleware: record when the first HTTP response has been sent."""
+
+    def __init__(self, app):
+        self.app = app
+        self.seen = False
+
+    async def __call__(self, scope, receive, send):
+        if self.seen or scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.seen = True
+            timeline.mark('first_response')
@@ -0,0 +1,259 @@
+"""
+Structured, non-blocking logging.
+
+Modules log through the standard library (``logging.getLogger(__name__)``)
+and pass structured fields as ``extra``, e.g.
+``log.warning("Totals flush failed", extra={'event': 'totals_flush_failed', 'users': 12})``.
+:func:`configure` (called by ``main.create_app``) routes every record through a
+:class:`QueueHandler` on the root logger. The handler only stamps the
+request context on the record and puts it on a bounded queue; a listener
+thread formats it and writes it to stdout. A request thread never waits
+on I/O. When the queue is full a record is dropped and counted rather than
+blocking the request.
+
+Each record is one JSON object per line with ``ts``, ``level``, ``logger``,
+``msg``, the ``event`` name and extra fields. Records emitted while a request
+is being served also carry the request context: ``request_id``,
+``method``, ``path``, ``route`` (the route template), ``user_id`` and
+``family_id`` once authenticated, and ``elapsed_ms`` since the request
+arrived. :class:`RequestLogMiddleware` sets up that context, answers with an
+``X-Request-Id`` header (the client's, if it sent one) and logs one
+``request`` event per request with the status and ``duration_ms``.
+Requests slower than LOG_SLOW_REQUEST_MS are logged as ``slow_request``
+(warning), and 5xx answers are logged at error level.
+
+Sampling: LOG_SAMPLE keeps only a share of the records of high-volume
+events, e.g. ``request=0.05`` logs one request in twenty. Records at error
+level or above are never sampled out. Queue, drop and sampling counts are
+reported by ``GET /admin/logging``.
+
+Configuration (environment):
+  LOG_LEVEL             root level (default INFO)
+  LOG_FORMAT            'json' (default) or 'text' for development
+  LOG_SAMPLE            ';'-separated "event=rate", e.g. "request=0.1;invalid_user_id=0.01"
+  LOG_SLOW_REQUEST_MS   requests at least this slow are logged as slow_request (default 1000)
+  LOG_QUEUE_SIZE        records buffered for the writer thread (default 10000)
+"""
+
+import atexit
+import contextvars
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import fast_json
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+CONTEXT_FIELDS = ('request_id', 'method', 'path', 'route', 'user_id', 'family_id')
+# Attributes every LogRecord has; anything else on a record came from ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'event'}
+
+_context = contextvars.ContextVar('log_context', default=None)
+
+def bind(**fields):
+    """Add fields (e.g. user_id) to the current request's log context; no-op outside requests."""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+def current_request_id() -> str | None:
+    context = _context.get()
+    return context.get('request_id') if context is not None else None
+
+def _parse_rates(text: str) -> dict:
+    rates = {}
+    for entry in filter(None, (part.strip() for part in text.split(';'))):
+        event, _, rate = entry.partition('=')
+        rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+class ContextFilter(logging.Filter):
+    """
+    Runs in the thread that logs: applies sampling, then stamps the request
+    context on the record. Returning False drops the record before it is queued.
+    """
+
+    def __init__(self, rates: dict | None = None):
+        super().__init__()
+        self.rates = rates or {}
+        self.sampled_out = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event) if event is not None else None
+        if rate is not None and record.levelno < logging.ERROR and random.random() >= rate:
+            self.sampled_out[event] = self.sampled_out.get(event, 0) + 1
+            return False
+        context = _context.get()
+        if context is not None:
+            for key in CONTEXT_FIELDS:
+                if key in context and not hasattr(record, key):
+                    setattr(record, key, context[key])
+            record.elapsed_ms = round((time.perf_counter() - context['_started']) * 1000, 1)
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments here; the traceback and JSON are rendered by the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; runs on the listener thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            entry['event'] = event
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return fast_json.dumps(entry).decode('utf-8')
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line records for development: message followed by key=value fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = ' '.join(f"{key}={value}" for key, value in vars(record).items()
+                          if key not in _RECORD_ATTRIBUTES and not key.startswith('_'))
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line = f"{line}  {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+class _Pipeline:
+    def __init__(self, handler: DroppingQueueHandler, context_filter: ContextFilter, listener):
+        self.handler = handler
+        self.filter = context_filter
+        self.listener = listener
+
+_pipeline = None
+_lock = threading.Lock()
+
+def configure():
+    """Install the queue handler on the root logger and start the writer thread (once)."""
+    global _pipeline
+    with _lock:
+        if _pipeline is not None:
+            return
+        log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        handler = DroppingQueueHandler(log_queue)
+        context_filter = ContextFilter(_parse_rates(os.getenv('LOG_SAMPLE', '')))
+        handler.addFilter(context_filter)
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(TextFormatter() if os.getenv('LOG_FORMAT', 'json') == 'text' else JsonFormatter())
+        listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+        root = logging.getLogger()
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        root.addHandler(handler)
+        # uvicorn's access log would duplicate the request events, and httpx
+        # (under supabase-py) logs every PostgREST call at info
+        logging.getLogger('uvicorn.access').disabled = True
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        listener.start()
+        _pipeline = _Pipeline(handler, context_filter, listener)
+        atexit.register(shutdown)
+
+def shutdown():
+    """Write out what is queued and stop the writer thread."""
+    global _pipeline
+    with _lock:
+        pipeline, _pipeline = _pipeline, None
+    if pipeline is None:
+        return
+    logging.getLogger().removeHandler(pipeline.handler)
+    pipeline.listener.stop()
+
+def stats() -> dict:
+    pipeline = _pipeline
+    if pipeline is None:
+        return {'configured': False}
+    return {
+        'configured': True,
+        'queue_depth': pipeline.handler.queue.qsize(),
+        'queue_size': pipeline.handler.queue.maxsize,
+        'dropped': pipeline.handler.dropped,
+        'sample_rates': pipeline.filter.rates,
+        'sampled_out': dict(pipeline.filter.sampled_out),
+    }
+
+access_log = logging.getLogger('access')
+
+class RequestLogMiddleware:
+    """ASGI middleware: request context and id for every log record, plus one ``request`` event per request."""
+
+    def __init__(self, app, slow_ms: float | None = None):
+        self.app = app
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.getenv('LOG_SLOW_REQUEST_MS', '1000'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope['headers']:
+            if name == b'x-request-id':
+                request_id = value.decode('latin-1')[:128]
+                break
+        context = {'request_id': request_id or uuid.uuid4().hex, 'method': scope['method'], 'path': scope['path'],
+                   '_started': time.perf_counter()}
+        token = _context.set(context)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = [*message.get('headers', []), (b'x-request-id', context['request_id'].encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get('route')
+            if route is not None:
+                context['route'] = getattr(route, 'path', None)
+            duration_ms = round((time.perf_counter() - context['_started']) * 1000, 1)
+            if status >= 500:
+                level, event = logging.ERROR, 'request'
+            elif duration_ms >= self.slow_ms:
+                level, event = logging.WARNING, 'slow_request'
+            else:
+                level, event = logging.INFO, 'request'
+            access_log.log(level, "%s %s %s", scope['method'], scope['path'], status,
+                           extra={'event': event, 'status': status, 'duration_ms': duration_ms})
+            _context.reset(token)
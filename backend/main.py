@@ -1,5 +1,9 @@
+import time
+
+_import_started = time.perf_counter()
+
 try:
-    from fastapi import FastAPI, Depends, HTTPException
+    from fastapi import FastAPI, Depends, HTTPException, Request
     import uvicorn
     from fastapi.middleware.cors import CORSMiddleware
     from pydantic import BaseModel
@@ -17,47 +21,130 @@ except ImportError as e:
     print("Make sure you have installed the supabase Python package with 'pip install supabase'")
     exit(1)
 
-app = FastAPI(title="Family Holdings Backend API")
-
-# Configure CORS for the frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5273"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/")
-async def root():
-    return {"message": "Welcome to the Family Holdings API"}
-
-@app.get("/health")
-async def health_check():
-    return {"status": "ok"}
-
-@app.get("/api/database/test-connection")
-async def test_db_connection():
-    """Test the Supabase database connection."""
-    result = supabase_client.test_connection()
-    if not result["success"]:
-        return {"status": "error", "message": result["message"]}
-    return {"status": "ok", "message": result["message"], "data": result.get("data")}
-
-from routers import users as users_router
-from routers import contributions as contributions_router
-from routers import stats as stats_router
-from routers import loans as loans_router
-from routers import admin as admin_router
-
-app.include_router(users_router.router)
-app.include_router(contributions_router.router)
-app.include_router(stats_router.router)
-app.include_router(loans_router.router)
-app.include_router(admin_router.router)
-
-# Placeholder: loans & stats routers to follow
+import admission
+import auth
+import deadlines
+import dependencies
+import fast_json
+import lifecycle
+import logs
+import read_routing
+
+lifecycle.timeline.origin = _import_started
+
+def _request_user_id(request: Request) -> str | None:
+    """Best-effort member id for read routing; authorization itself happens in dependencies.py."""
+    if dependencies.MOCK_MODE:
+        return request.headers.get("x-user-id")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return auth.verify_token(token.strip())["sub"]
+    except auth.AuthError:
+        return None
+
+async def read_session(request: Request, call_next):
+    """Read-your-writes routing state for the request (see read_routing.py)."""
+    if not supabase_client.replica_configured():
+        return await call_next(request)
+    reset = read_routing.begin_request(request.method, _request_user_id(request),
+                                       request.headers.get(read_routing.SESSION_HEADER))
+    try:
+        response = await call_next(request)
+    finally:
+        token = read_routing.end_request(reset)
+    if token:
+        response.headers[read_routing.SESSION_HEADER] = token
+    return response
+
+def create_app() -> FastAPI:
+    """
+    Build the API. Routers are imported here, and storage clients are created
+    on first use or by the startup warm-up (see lifecycle.py).
+    ``uvicorn --factory main:create_app`` calls this directly; ``main:app``
+    builds one app on first access.
+    """
+    # Before the routers, so records from their imports go through the queue too (see logs.py)
+    logs.configure()
+    from routers import users as users_router
+    from routers import contributions as contributions_router
+    from routers import stats as stats_router
+    from routers import loans as loans_router
+    from routers import admin as admin_router
+    from routers import forecast as forecast_router
+    from routers import statements as statements_router
+    from routers import batch as batch_router
+
+    # Responses are written by orjson when it is installed (see fast_json.py)
+    app = FastAPI(title="Family Holdings Backend API", default_response_class=fast_json.FastJSONResponse,
+                  lifespan=lifecycle.lifespan)
+
+    # Priority classes and load shedding (see admission.py); inside CORS so 503s carry CORS headers
+    app.add_middleware(admission.AdmissionMiddleware)
+    # Request deadlines (see deadlines.py); outside admission so queueing time counts
+    app.add_middleware(deadlines.DeadlineMiddleware)
+    app.add_exception_handler(deadlines.DeadlineExceeded, deadlines.handle_deadline_exceeded)
+
+    # Configure CORS for the frontend
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5273"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[read_routing.SESSION_HEADER, "Retry-After", logs.REQUEST_ID_HEADER],
+    )
+    app.middleware("http")(read_session)
+    app.add_middleware(lifecycle.FirstResponseMiddleware)
+    # Outermost, so every record of the request carries its id and caller (see logs.py)
+    app.add_middleware(logs.RequestLogMiddleware)
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to the Family Holdings API"}
+
+    @app.get("/health")
+    async def health_check():
+        """Liveness: the process is serving; no dependency is touched."""
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def readiness_check():
+        """Readiness: 200 once startup warm-up succeeded, else 503; with the cold-start timeline."""
+        report = lifecycle.readiness.report()
+        return fast_json.FastJSONResponse(report, status_code=200 if report["ready"] else 503)
+
+    @app.get("/api/database/test-connection")
+    def test_db_connection():
+        """Test the Supabase database connection."""
+        result = supabase_client.test_connection()
+        if not result["success"]:
+            return {"status": "error", "message": result["message"]}
+        return {"status": "ok", "message": result["message"], "data": result.get("data")}
+
+    app.include_router(users_router.router)
+    app.include_router(contributions_router.router)
+    app.include_router(stats_router.router)
+    app.include_router(loans_router.router)
+    app.include_router(admin_router.router)
+    app.include_router(forecast_router.router)
+    app.include_router(statements_router.router)
+    app.include_router(batch_router.router)
+
+    lifecycle.timeline.mark("app_created")
+    return app
+
+lifecycle.timeline.mark("imported")
+
+def __getattr__(name: str):
+    # Module attribute hook (PEP 562): ``uvicorn main:app`` builds the app on first access
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     # Run the server on port 8000
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(create_app(), host="0.0.0.0", port=8000)
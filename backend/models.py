@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Literal, Optional
+from typing import Any, Literal, Optional
 from datetime import date, datetime
 from decimal import Decimal
 
@@ -23,6 +23,10 @@ class UserOut(BaseModel):
     total_contributed: Optional[Decimal] = None
     borrow_limit_percent: Optional[Decimal] = None
     current_loan_balance: Optional[Decimal] = None
+    borrowing_limit: Optional[Decimal] = None
+    available_credit: Optional[Decimal] = None
+    as_of: Optional[date] = None
+    family_id: Optional[str] = None
 
 class ContributionCreate(BaseModel):
     user_id: str
@@ -49,6 +53,7 @@ class ContributionOut(BaseModel):
     due_date: date
     paid_at: datetime | None = None
     method: str | None = None
+    late_fee: Decimal | None = None
 
 class StatsMeOut(BaseModel):
     weekly_contribution: Optional[Decimal]
@@ -58,6 +63,8 @@ class StatsMeOut(BaseModel):
     deficiency: Decimal
     current_loan_balance: Optional[Decimal]
     borrowing_limit: Optional[Decimal]
+    available_credit: Optional[Decimal] = None
+    as_of: Optional[date] = None
 
 class LoanRequest(BaseModel):
     amount: Decimal = Field(..., gt=0)
@@ -73,3 +80,174 @@ class LoanActionResponse(BaseModel):
 
 class LoanPayment(BaseModel):
     amount: Decimal = Field(..., gt=0)
+
+class MemberImport(BaseModel):
+    id: str | None = None
+    email: EmailStr | None = None
+    full_name: str | None = None
+    weekly_contribution: Optional[Decimal] = Field(default=None, ge=0)
+    role: Literal['admin', 'member'] | None = None
+    borrow_limit_percent: Optional[Decimal] = Field(default=None, ge=0, le=100)
+
+class ContributionImport(ContributionCreate):
+    user_id: str | None = None
+    email: str | None = None
+    member: str | None = Field(default=None, description="Member's full name, when no id or email is given")
+    period_week: int = Field(..., ge=1, le=53)
+    status: Literal['pending', 'completed', 'late', 'missed'] = 'pending'
+    paid_at: datetime | date | None = None
+    method: str | None = None
+    late_fee: Decimal = Field(default=Decimal('0'), ge=0)
+
+class LoanImport(LoanRequest):
+    id: str | None = None
+    ref: str | None = Field(default=None, description="Id of the loan in the source system; payments may refer to it")
+    user_id: str | None = None
+    email: str | None = None
+    member: str | None = None
+    status: Literal['pending', 'approved', 'rejected', 'paid'] = 'approved'
+    weekly_payment: Decimal | None = Field(default=None, ge=0)
+    remaining_balance: Decimal | None = Field(default=None, ge=0)
+    created_at: datetime | date | None = None
+    approved_at: datetime | date | None = None
+    rejected_at: datetime | date | None = None
+
+class LoanPaymentImport(LoanPayment):
+    id: str | None = None
+    ref: str | None = None
+    loan_id: str | None = None
+    loan_ref: str | None = None
+    user_id: str | None = None
+    payment_date: datetime | date
+
+class LedgerAdjustment(BaseModel):
+    user_id: str
+    contributed_delta: Decimal = Decimal('0')
+    loan_delta: Decimal = Decimal('0')
+    occurred_at: datetime | None = None
+    note: str | None = Field(default=None, max_length=500)
+
+class LoanInterestSettings(BaseModel):
+    interest_rate: Decimal = Field(..., ge=0, le=100, description="Annual interest rate in percent (0 = interest-free)")
+    interest_compounding: Literal['none', 'daily', 'weekly'] = 'none'
+
+class LoanScheduleWeek(BaseModel):
+    week: int
+    due_date: date
+    scheduled_payment: Decimal
+    scheduled_balance: Decimal
+    payment: Decimal
+    balance: Decimal
+    arrears: Decimal
+    status: Literal['paid', 'partial', 'missed', 'upcoming', 'projected']
+
+class LoanScheduleOut(BaseModel):
+    loan_id: str
+    status: str
+    as_of: date
+    start_date: date
+    amount: Decimal
+    weekly_payment: Decimal
+    duration_weeks: int
+    paid_to_date: Decimal
+    remaining_balance: Decimal
+    arrears: Decimal
+    weeks_elapsed: int
+    weeks_remaining: int | None = None
+    payoff_date: date | None = None
+    on_track: bool
+    schedule: list[LoanScheduleWeek]
+
+class LoanScenario(BaseModel):
+    name: str | None = None
+    extra_weekly: Decimal = Field(default=Decimal('0'), ge=0, description="Paid on top of every regular instalment")
+    lump_sum: Decimal = Field(default=Decimal('0'), ge=0, description="One-off extra payment in the coming week")
+    skip_weeks: list[int] = Field(default_factory=list, description="Upcoming weeks (1 = next unpaid week) with no payment")
+
+class LoanSimulationRequest(BaseModel):
+    scenarios: list[LoanScenario] = Field(..., min_length=1, max_length=50)
+    include_balances: bool = False
+
+class LoanScenarioResult(BaseModel):
+    name: str | None = None
+    weeks_to_payoff: int | None = None
+    payoff_date: date | None = None
+    total_paid: Decimal
+    weeks_saved: int | None = None
+    balances: list[Decimal] | None = None
+
+class LoanSimulationOut(BaseModel):
+    loan_id: str
+    as_of: date
+    remaining_balance: Decimal
+    baseline: LoanScenarioResult
+    scenarios: list[LoanScenarioResult]
+
+class FundLoanProjection(BaseModel):
+    loan_id: str
+    user_id: str
+    remaining_balance: Decimal
+    weeks_to_payoff: int | None = None
+    payoff_date: date | None = None
+
+class FundSimulationOut(BaseModel):
+    as_of: date
+    scenario: LoanScenario
+    open_loans: int
+    total_outstanding: Decimal
+    weekly_repayments: list[Decimal]
+    loans: list[FundLoanProjection]
+
+class ForecastWeek(BaseModel):
+    week: int
+    week_ending: date
+    contributions_in: Decimal
+    repayments_in: Decimal
+    disbursements_out: Decimal
+    net: Decimal
+    cash: Decimal
+
+class ForecastOut(BaseModel):
+    as_of: date
+    weeks: int
+    collection_rate: float
+    members: int
+    open_loans: int
+    outstanding_loans: Decimal
+    approved_loan_ids: list[str]
+    opening_cash: Decimal
+    closing_cash: Decimal
+    min_cash: Decimal
+    min_cash_week: int
+    first_shortfall_week: int | None = None
+    schedule: list[ForecastWeek]
+
+class ForecastScenarioRequest(BaseModel):
+    loan_ids: list[str] = Field(..., min_length=1, description="Pending loans to treat as approved today")
+    weeks: int = Field(default=26, ge=1, le=260)
+    collection_rate: float = Field(default=1.0, ge=0, le=1)
+    opening_balance: Decimal | None = None
+
+class ForecastScenarioOut(BaseModel):
+    baseline: ForecastOut
+    scenario: ForecastOut
+    closing_cash_change: Decimal
+    min_cash_change: Decimal
+
+class BatchSubRequest(BaseModel):
+    id: str | None = Field(default=None, max_length=64, description="Echoed in the sub-response; defaults to the position in the batch")
+    method: Literal['GET'] = 'GET'
+    path: str = Field(..., pattern=r'^/', max_length=2048, description="Route path with optional query string, e.g. /loans/{id}/payments")
+
+class BatchRequest(BaseModel):
+    requests: list[BatchSubRequest] = Field(..., min_length=1)
+
+class BatchSubResponse(BaseModel):
+    id: str
+    status: int
+    content_type: str | None = Field(default=None, description="Set when the body is not JSON")
+    encoding: Literal['base64'] | None = Field(default=None, description="Set when a binary body is base64-encoded")
+    body: Any = None
+
+class BatchOut(BaseModel):
+    responses: list[BatchSubResponse]
@@ -0,0 +1,528 @@
+"""
+Direct Postgres storage backend (DATA_BACKEND=postgres).
+
+:class:`PostgresClient` implements the part of the supabase-py query builder
+the app uses: ``table()`` with select / insert / update / upsert / delete,
+the filters, ``or_``, order / limit / range, ``.csv()``, and ``rpc()``.
+Negation goes through ``filter(column, 'not.<op>', value)`` or ``not.`` in
+``or_``; operators it does not support raise APIError PGRST100.
+Routers, db_utils and the data-layer wrappers (data_layer.py) therefore run
+unchanged on either backend. Queries skip HTTP and PostgREST and go to
+Postgres over an asyncpg pool:
+  * SQL text depends only on a query's shape and values are always bind
+    parameters, so asyncpg's per-connection statement cache prepares each
+    shape once and reuses it.
+  * Results are decoded from the binary protocol. numeric columns arrive as
+    Decimal. uuid, date and timestamp values are turned into the strings
+    PostgREST returns, so call sites see the same row dicts.
+  * Filter values are sent as text and cast server-side to the column's type
+    (read once per table from the catalog), so callers keep passing ISO
+    strings and string ids. Written rows go through
+    jsonb_populate_recordset, as in PostgREST.
+Database errors are raised as postgrest's APIError with the SQLSTATE code, so
+existing error handling applies to both backends.
+
+The pool lives on a private event-loop thread; the sync routes wait on it.
+Inside a request each statement up to its first write is bounded by the
+request's deadline (see deadlines.py) and cancelled on the server when it
+passes or the client disconnects.
+
+Configuration (environment):
+  DATA_BACKEND              'postgrest' (default) or 'postgres'
+  DATABASE_URL              postgres:// connection string (Supabase: direct or session-pooler URL)
+  PG_POOL_MIN / PG_POOL_MAX pool size (default 2 / 10)
+  PG_STATEMENT_CACHE_SIZE   prepared statements kept per connection (default 256; 0 behind a
+                            transaction-mode pooler such as PgBouncer or Supavisor port 6543)
+  PG_COMMAND_TIMEOUT        seconds per statement (default 30)
+"""
+
+import asyncio
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime, time
+
+from postgrest.exceptions import APIError
+
+import deadlines
+
+try:
+    import asyncpg
+except ImportError:  # only needed with DATA_BACKEND=postgres
+    asyncpg = None
+
+COMPARISONS = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+COLUMNS_SQL = """
+SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+FROM pg_attribute a
+WHERE a.attrelid = to_regclass($1) AND a.attnum > 0 AND NOT a.attisdropped
+"""
+
+FUNCTION_SQL = """
+SELECT p.proretset, t.typtype,
+       ARRAY(SELECT n FROM unnest(p.proargnames, COALESCE(p.proargmodes, array_fill('i'::"char", ARRAY[cardinality(p.proargnames)]))) u(n, m)
+             WHERE m IN ('i', 'b', 'v')),
+       ARRAY(SELECT format_type(x, NULL) FROM unnest(p.proargtypes) WITH ORDINALITY u(x, i) ORDER BY i)
+FROM pg_proc p JOIN pg_type t ON t.oid = p.prorettype
+WHERE p.oid = to_regproc($1)
+"""
+
+def _ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _text(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+def _json_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)  # Decimal, UUID
+
+# Values PostgREST would have sent as JSON strings
+_AS_STRING = {
+    uuid.UUID: str,
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    time: time.isoformat,
+}
+
+def _row(record) -> dict:
+    out = {}
+    for key, value in record.items():
+        convert = _AS_STRING.get(type(value))
+        out[key] = convert(value) if convert else value
+    return out
+
+def _csv_body(records, columns: list) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(columns)
+    for record in records:
+        writer.writerow('' if v is None else _text(v) for v in record.values())
+    return buf.getvalue()
+
+def _filter_error(message: str) -> APIError:
+    """A filter the backend cannot express, reported as PostgREST reports an unparsable filter."""
+    return APIError({'message': message, 'code': 'PGRST100', 'details': None, 'hint': None})
+
+def _api_error(exc) -> APIError:
+    return APIError({
+        'message': getattr(exc, 'message', None) or str(exc),
+        'code': getattr(exc, 'sqlstate', None),
+        'details': getattr(exc, 'detail', None),
+        'hint': getattr(exc, 'hint', None),
+    })
+
+def _split_top_level(text: str) -> list:
+    """Split a PostgREST logic expression on commas outside quotes and parentheses."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ',':
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+def _parse_criteria(operator: str, criteria):
+    """PostgREST textual criteria (``in.(a,b)``, ``is.null``) to Python values."""
+    if operator == 'in' and isinstance(criteria, str):
+        return [_unquote(v) for v in _split_top_level(criteria.strip().lstrip('(').rstrip(')'))]
+    if isinstance(criteria, str):
+        return _unquote(criteria)
+    return criteria
+
+class _LoopThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='pg-backend', daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+class PgResponse:
+    __slots__ = ('data', 'count')
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+class PostgresClient:
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10, statement_cache_size: int = 256,
+                 command_timeout: float = 30.0):
+        if asyncpg is None:
+            raise RuntimeError("DATA_BACKEND=postgres needs asyncpg (pip install asyncpg)")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self._loop = _LoopThread()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._columns = {}
+        self._functions = {}
+
+    @classmethod
+    def from_env(cls) -> 'PostgresClient':
+        dsn = os.getenv('DATABASE_URL')
+        if not dsn:
+            raise RuntimeError("DATA_BACKEND=postgres needs DATABASE_URL")
+        return cls(
+            dsn,
+            min_size=int(os.getenv('PG_POOL_MIN', '2')),
+            max_size=int(os.getenv('PG_POOL_MAX', '10')),
+            statement_cache_size=int(os.getenv('PG_STATEMENT_CACHE_SIZE', '256')),
+            command_timeout=float(os.getenv('PG_COMMAND_TIMEOUT', '30')),
+        )
+
+    @staticmethod
+    async def _init_connection(conn):
+        for name in ('json', 'jsonb'):
+            await conn.set_type_codec(name, encoder=lambda v: json.dumps(v, default=_json_default),
+                                      decoder=json.loads, schema='pg_catalog')
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = self._loop.run(asyncpg.create_pool(
+                        self.dsn, min_size=self.min_size, max_size=self.max_size,
+                        statement_cache_size=self.statement_cache_size,
+                        command_timeout=self.command_timeout, init=self._init_connection))
+        return self._pool
+
+    def run(self, coro):
+        self._get_pool()
+        deadline = deadlines.current()
+        if deadline is None or deadline.committed:
+            return self._loop.run(coro)
+        deadline.check()
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, deadline.remaining()), self._loop.loop)
+        # Cancelling the task makes asyncpg cancel the statement on the server
+        deadline.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except (TimeoutError, concurrent.futures.CancelledError, asyncio.CancelledError):
+            if not deadline.expired():
+                raise
+            deadline.check()
+            raise
+        finally:
+            deadline.discard(future.cancel)
+
+    async def fetch(self, sql: str, args: list):
+        try:
+            return await self._pool.fetch(sql, *args)
+        except asyncpg.PostgresError as exc:
+            raise _api_error(exc) from exc
+
+    async def columns(self, table: str) -> dict:
+        """Column name -> SQL type of ``table``, read from the catalog once."""
+        types = self._columns.get(table)
+        if types is None:
+            rows = await self.fetch(COLUMNS_SQL, [_ident(table)])
+            if not rows:
+                raise APIError({'message': f'relation "{table}" does not exist', 'code': '42P01', 'details': None, 'hint': None})
+            types = self._columns[table] = {r[0]: r[1] for r in rows}
+        return types
+
+    async def function(self, name: str) -> tuple:
+        """(returns a set or row, {argument: SQL type}) for a function, read from the catalog once."""
+        info = self._functions.get(name)
+        if info is None:
+            rows = await self.fetch(FUNCTION_SQL, [_ident(name)])
+            if not rows:
+                raise APIError({'message': f"function {name} does not exist", 'code': '42883', 'details': None, 'hint': None})
+            retset, typtype, names, types = rows[0]
+            info = self._functions[name] = (retset or typtype == 'c', dict(zip(names or [], types)))
+        return info
+
+    def table(self, name: str) -> 'PgQuery':
+        return PgQuery(self, name)
+
+    def from_(self, name: str) -> 'PgQuery':
+        return self.table(name)
+
+    def rpc(self, name: str, params: dict | None = None) -> 'PgRpc':
+        return PgRpc(self, name, params or {})
+
+    def close(self):
+        if self._pool is not None:
+            self._loop.run(self._pool.close())
+            self._pool = None
+
+class PgQuery:
+    """One statement being built; mirrors the supabase-py request builder."""
+
+    def __init__(self, client: PostgresClient, table: str):
+        self._client = client
+        self._table = table
+        self._op = 'select'
+        self._columns = '*'
+        self._count = None
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._filters = []      # (column, operator, value, negated) or ('or', [conditions])
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._csv = False
+
+    # Statement kind
+
+    def select(self, *columns, count=None):
+        self._op = 'select'
+        self._columns = ','.join(columns) if columns else '*'
+        self._count = count
+        return self
+
+    def insert(self, json, *, count=None, returning=None, upsert=False, **kwargs):
+        self._op = 'upsert' if upsert else 'insert'
+        self._payload = json
+        return self
+
+    def upsert(self, json, *, count=None, returning=None, ignore_duplicates=False, on_conflict='', **kwargs):
+        self._op = 'upsert'
+        self._payload = json
+        self._ignore_duplicates = ignore_duplicates
+        self._on_conflict = on_conflict or None
+        return self
+
+    def update(self, json, *, count=None, returning=None, **kwargs):
+        self._op = 'update'
+        self._payload = json
+        return self
+
+    def delete(self, *, count=None, returning=None, **kwargs):
+        self._op = 'delete'
+        return self
+
+    # Filters
+
+    def _add(self, column, operator, value, negated=False):
+        self._filters.append((column, operator, value, negated))
+        return self
+
+    def eq(self, column, value):
+        return self._add(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._add(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._add(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._add(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._add(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._add(column, 'lte', value)
+
+    def like(self, column, pattern):
+        return self._add(column, 'like', pattern)
+
+    def ilike(self, column, pattern):
+        return self._add(column, 'ilike', pattern)
+
+    def is_(self, column, value):
+        return self._add(column, 'is', value)
+
+    def in_(self, column, values):
+        return self._add(column, 'in', list(values))
+
+    def match(self, query: dict):
+        for column, value in query.items():
+            self._add(column, 'eq', value)
+        return self
+
+    def filter(self, column, operator, criteria):
+        negated = operator.startswith('not.')
+        operator = operator[4:] if negated else operator
+        return self._add(column, operator, _parse_criteria(operator, criteria), negated)
+
+    def or_(self, filters: str, reference_table=None):
+        conditions = []
+        for part in _split_top_level(filters):
+            column, operator, criteria = part.split('.', 2)
+            negated = operator == 'not'
+            if negated:
+                operator, criteria = criteria.split('.', 1)
+            conditions.append((column, operator, _parse_criteria(operator, criteria), negated))
+        self._filters.append(('or', conditions))
+        return self
+
+    # Shaping
+
+    def order(self, column, *, desc=False, nullsfirst=None, foreign_table=None):
+        direction = ' DESC' if desc else ''
+        nulls = '' if nullsfirst is None else (' NULLS FIRST' if nullsfirst else ' NULLS LAST')
+        self._order.append(f"{_ident(column)}{direction}{nulls}")
+        return self
+
+    def limit(self, size, *, foreign_table=None):
+        self._limit = size
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def csv(self):
+        self._csv = True
+        return self
+
+    # SQL
+
+    def _condition(self, condition, types: dict, param) -> str:
+        column, operator, value, negated = condition
+        sql_type = types.get(column)
+        if sql_type is None:
+            raise APIError({'message': f'column {self._table}.{column} does not exist', 'code': '42703', 'details': None, 'hint': None})
+        col = _ident(column)
+        if operator == 'is':
+            text = _text(value).lower() if value is not None else 'null'
+            if text not in ('null', 'true', 'false', 'unknown'):
+                raise _filter_error(f"is expects null, true, false or unknown, got {value!r}")
+            sql = f"{col} IS {text.upper()}"
+        elif operator == 'in':
+            sql = f"{col} = ANY({param([_text(v) for v in value])}::text[]::{sql_type}[])"
+        elif operator in ('like', 'ilike'):
+            # PostgREST accepts * as the wildcard
+            sql = f"{col}::text {operator.upper()} {param(_text(value).replace('*', '%'))}"
+        elif operator in COMPARISONS:
+            sql = f"{col} {COMPARISONS[operator]} {param(_text(value))}::text::{sql_type}"
+        else:
+            raise _filter_error(f"filter operator {operator!r} is not supported by the postgres backend")
+        return f"NOT ({sql})" if negated else sql
+
+    def _where(self, types: dict, param) -> str:
+        clauses = []
+        for condition in self._filters:
+            if condition[0] == 'or' and len(condition) == 2:
+                clauses.append('(' + ' OR '.join(self._condition(c, types, param) for c in condition[1]) + ')')
+            else:
+                clauses.append(self._condition(condition, types, param))
+        return ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+    def _select_list(self, types: dict) -> str:
+        columns = [c.strip() for c in self._columns.split(',') if c.strip()]
+        if not columns or columns == ['*']:
+            return '*'
+        for column in columns:
+            if column not in types:
+                raise APIError({'message': f'column {self._table}.{column} does not exist', 'code': '42703', 'details': None, 'hint': None})
+        return ', '.join(_ident(c) for c in columns)
+
+    async def _execute(self):
+        client = self._client
+        types = await client.columns(self._table)
+        table = _ident(self._table)
+        args = []
+
+        def param(value) -> str:
+            args.append(value)
+            return f"${len(args)}"
+
+        if self._op == 'select':
+            where = self._where(types, param)
+            count = None
+            if self._count:
+                count = (await client.fetch(f"SELECT count(*) FROM {table}{where}", list(args)))[0][0]
+            sql = f"SELECT {self._select_list(types)} FROM {table}{where}"
+            if self._order:
+                sql += ' ORDER BY ' + ', '.join(self._order)
+            if self._limit is not None:
+                sql += f" LIMIT {param(int(self._limit))}"
+            if self._offset:
+                sql += f" OFFSET {param(int(self._offset))}"
+            records = await client.fetch(sql, args)
+            if self._csv:
+                header = list(records[0].keys()) if records else [c.strip() for c in self._columns.split(',')]
+                return PgResponse(_csv_body(records, header), count)
+            return PgResponse([_row(r) for r in records], count)
+
+        if self._op in ('insert', 'upsert'):
+            rows = self._payload if isinstance(self._payload, list) else [self._payload]
+            if not rows:
+                return PgResponse([])
+            columns = list(dict.fromkeys(k for row in rows for k in row))
+            cols = ', '.join(_ident(c) for c in columns)
+            sql = (f"INSERT INTO {table} ({cols}) SELECT {cols} "
+                   f"FROM jsonb_populate_recordset(NULL::{table}, {param(rows)}::jsonb)")
+            if self._op == 'upsert':
+                conflict = [c.strip() for c in (self._on_conflict or 'id').split(',')]
+                target = ', '.join(_ident(c) for c in conflict)
+                if self._ignore_duplicates:
+                    sql += f" ON CONFLICT ({target}) DO NOTHING"
+                else:
+                    updates = ', '.join(f"{_ident(c)} = EXCLUDED.{_ident(c)}" for c in columns if c not in conflict)
+                    sql += f" ON CONFLICT ({target}) " + (f"DO UPDATE SET {updates}" if updates else 'DO NOTHING')
+            records = await client.fetch(sql + ' RETURNING *', args)
+            return PgResponse([_row(r) for r in records])
+
+        if self._op == 'update':
+            values = param(self._payload)
+            sets = ', '.join(f"{_ident(c)} = (SELECT {_ident(c)} FROM jsonb_populate_record(NULL::{table}, {values}::jsonb))"
+                             for c in self._payload)
+            records = await client.fetch(f"UPDATE {table} SET {sets}{self._where(types, param)} RETURNING *", args)
+            return PgResponse([_row(r) for r in records])
+
+        records = await client.fetch(f"DELETE FROM {table}{self._where(types, param)} RETURNING *", args)
+        return PgResponse([_row(r) for r in records])
+
+    def execute(self) -> PgResponse:
+        return self._client.run(self._execute())
+
+class PgRpc:
+    """A database function call, returning what PostgREST would: rows for set-returning functions, else the value."""
+
+    def __init__(self, client: PostgresClient, name: str, params: dict):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    async def _execute(self):
+        client = self._client
+        returns_rows, arg_types = await client.function(self._name)
+        args, named = [], []
+        for key, value in self._params.items():
+            if key not in arg_types:
+                raise APIError({'message': f"function {self._name} has no argument {key}", 'code': '42883', 'details': None, 'hint': None})
+            text = json.dumps(value, default=_json_default) if isinstance(value, (dict, list)) else (
+                None if value is None else _text(value))
+            args.append(text)
+            named.append(f"{_ident(key)} => ${len(args)}::text::{arg_types[key]}")
+        call = f"{_ident(self._name)}({', '.join(named)})"
+        if returns_rows:
+            return PgResponse([_row(r) for r in await client.fetch(f"SELECT * FROM {call}", args)])
+        records = await client.fetch(f"SELECT {call}", args)
+        value = records[0][0] if records else None
+        convert = _AS_STRING.get(type(value))
+        return PgResponse(convert(value) if convert else value)
+
+    def execute(self) -> PgResponse:
+        return self._client.run(self._execute())
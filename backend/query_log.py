@@ -0,0 +1,101 @@
+"""
+Slow-query log for the data layer.
+
+Every ``execute()`` that takes longer than ``SLOW_QUERY_MS`` (default 200ms)
+is recorded with its table, filters, row count, duration and the router
+function that issued it. Recent entries are kept in a bounded ring buffer and
+aggregated per query shape so ``GET /admin/slow-queries`` can show the
+hottest shapes (and the filter columns that probably want an index).
+
+Configuration (environment):
+  SLOW_QUERY_MS       threshold in milliseconds (0 logs every query)
+  SLOW_QUERY_TOP_N    number of shapes returned in the summary
+  SLOW_QUERY_HISTORY  number of individual slow entries kept
+"""
+
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import data_layer
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = 200.0, top_n: int = 20, history: int = 500):
+        self.threshold_ms = threshold_ms
+        self.top_n = top_n
+        self._recent = deque(maxlen=history)
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, query: data_layer.QueryInfo, duration_ms: float, row_count: int, error: Exception | None = None):
+        """Data-layer observer: record the query if it crossed the threshold."""
+        if duration_ms < self.threshold_ms:
+            return
+        call_site, caller = data_layer.find_call_site()
+        entry = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'table': query.table,
+            'operation': query.operation,
+            'columns': query.columns,
+            'filters': [{'column': col, 'op': op, 'value': str(value)} for col, op, value in query.filters],
+            'row_count': row_count,
+            'duration_ms': round(duration_ms, 2),
+            'call_site': call_site,
+            'caller': caller,
+            'error': str(error) if error else None,
+        }
+        shape = query.shape()
+        with self._lock:
+            self._recent.append(entry)
+            stats = self._shapes.get(shape)
+            if stats is None:
+                stats = self._shapes[shape] = {
+                    'table': query.table,
+                    'operation': query.operation,
+                    'filter_columns': [col for col, _, _ in query.filters],
+                    'query': query.describe(),
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'total_rows': 0,
+                    'call_sites': {},
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['total_rows'] += row_count
+            stats['call_sites'][call_site] = stats['call_sites'].get(call_site, 0) + 1
+
+    def summary(self, limit: int | None = None) -> dict:
+        """Top query shapes by cumulative time, plus the most recent slow calls."""
+        limit = limit or self.top_n
+        with self._lock:
+            shapes = [dict(s, call_sites=dict(s['call_sites'])) for s in self._shapes.values()]
+            recent = list(self._recent)[-limit:]
+        shapes.sort(key=lambda s: s['total_ms'], reverse=True)
+        top = []
+        for s in shapes[:limit]:
+            s['total_ms'] = round(s['total_ms'], 2)
+            s['max_ms'] = round(s['max_ms'], 2)
+            s['avg_ms'] = round(s['total_ms'] / s['count'], 2)
+            s['avg_rows'] = round(s['total_rows'] / s['count'], 1)
+            top.append(s)
+        return {
+            'threshold_ms': self.threshold_ms,
+            'tracked_shapes': len(shapes),
+            'top': top,
+            'recent': list(reversed(recent)),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._shapes.clear()
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "200")),
+    top_n=int(os.getenv("SLOW_QUERY_TOP_N", "20")),
+    history=int(os.getenv("SLOW_QUERY_HISTORY", "500")),
+)
+data_layer.add_observer(slow_query_log.observe)
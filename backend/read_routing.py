@@ -0,0 +1,264 @@
+"""
+Read-replica routing with read-your-writes consistency.
+
+With a replica configured (REPLICA_DATABASE_URL for DATA_BACKEND=postgres,
+REPLICA_SUPABASE_URL for PostgREST), :class:`RoutedClient` picks a client
+per query by intent:
+  * writes and rpc() calls go to the primary
+  * selects issued while serving a GET go to the replica
+  * every other select goes to the primary: reads inside POST/PUT/PATCH/DELETE
+    handlers (read-modify-write, such as a loan payment reading the balance
+    it is about to change), reads from jobs and scripts, and reads that
+    fill a data_cache entry (see ``primary_reads()``)
+
+Read-your-writes: after a member's write, the primary's WAL position (see
+008_replication_lsn.sql) is recorded for that member, and their GETs stay
+on the primary until the replica has replayed past it. Without that function
+the member is pinned for REPLICA_PIN_SECONDS instead; so is a write whose
+position could not be read (a failed call is counted in ``lsn_errors`` and
+retried on the next write or poll). The position is also
+returned as an ``X-Read-After`` response header. A client that echoes it
+back (e.g. to a different API instance) gets the same guarantee.
+check_read_routing.py checks this against a real primary and replica.
+
+Configuration (environment):
+  REPLICA_DATABASE_URL / REPLICA_SUPABASE_URL   the replica; unset = no routing
+  REPLICA_SUPABASE_KEY     (optional) key for the replica's PostgREST (default SUPABASE_SERVICE_ROLE_KEY)
+  REPLICA_PIN_SECONDS      longest a member's reads stay pinned after a write (default 10)
+  REPLICA_LSN_POLL_MS      how often the replica's replay position is re-read (default 100)
+"""
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from postgrest.exceptions import APIError
+
+import deadlines
+
+SESSION_HEADER = 'X-Read-After'
+OPERATION_METHODS = {'select', 'insert', 'update', 'upsert', 'delete'}
+# undefined_function from Postgres, "function not found" from PostgREST
+MISSING_FUNCTION_CODES = {'42883', 'PGRST202'}
+
+def parse_lsn(text) -> int | None:
+    """'16/B374D848' -> comparable integer."""
+    try:
+        high, low = str(text).split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+class ReadSession:
+    """Routing state for one request; mutated by the data layer on the request's worker thread."""
+    __slots__ = ('user_id', 'replica_ok', 'after_lsn', 'after_time', 'wrote_lsn', 'wrote_at')
+
+    def __init__(self, user_id: str | None = None, replica_ok: bool = False):
+        self.user_id = user_id
+        self.replica_ok = replica_ok
+        self.after_lsn = None
+        self.after_time = None
+        self.wrote_lsn = None
+        self.wrote_at = None
+
+    def token(self) -> str | None:
+        """Session token for the response when this request wrote: '<unix time>:<lsn>' (lsn may be empty)."""
+        if self.wrote_at is None:
+            return None
+        return f"{self.wrote_at:.3f}:{self.wrote_lsn or ''}"
+
+    def accept_token(self, token: str | None):
+        if not token:
+            return
+        written, _, lsn = token.partition(':')
+        try:
+            self.after_time = float(written)
+        except ValueError:
+            return
+        self.after_lsn = parse_lsn(lsn)
+
+_session = contextvars.ContextVar('read_session', default=None)
+
+def begin_request(method: str, user_id: str | None, token: str | None = None):
+    """Install a ReadSession for the current request; returns the contextvar token for ``end_request``."""
+    session = ReadSession(user_id, replica_ok=method in ('GET', 'HEAD'))
+    session.accept_token(token)
+    return _session.set(session)
+
+def end_request(reset_token) -> str | None:
+    session = _session.get()
+    _session.reset(reset_token)
+    return session.token() if session else None
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Keep the reads inside on the primary. Used for values cached against
+    table versions (data_cache.py): a lagging replica read after a version
+    bump would otherwise be cached as current.
+    """
+    session = _session.get()
+    if session is None or not session.replica_ok:
+        yield
+        return
+    session.replica_ok = False
+    try:
+        yield
+    finally:
+        session.replica_ok = True
+
+class RoutedQuery:
+    """Builder proxy that binds to the primary or the replica once the statement kind is known."""
+
+    def __init__(self, router: 'RoutedClient', table: str):
+        self._router = router
+        self._table = table
+        self._builder = None
+        self._operation = None
+
+    def __getattr__(self, name):
+        if self._builder is None:
+            if name not in OPERATION_METHODS:
+                raise AttributeError(name)
+            self._operation = name
+            self._client = self._router.client_for(name)
+            self._builder = self._client.table(self._table)
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                self._builder = result
+                return self
+            return result
+        return call
+
+    def execute(self):
+        response = self._builder.execute()
+        session = _session.get()
+        if self._operation != 'select' and session is not None:
+            self._router.note_write(session)
+        return response
+
+class RoutedClient:
+    def __init__(self, primary, replica, pin_seconds: float = 10.0, lsn_poll_ms: float = 100.0):
+        self.primary = primary
+        self.replica = replica
+        self.pin_seconds = pin_seconds
+        self.lsn_poll = lsn_poll_ms / 1000.0
+        self.track_lsn = True
+        self._pins = {}             # user_id -> (primary lsn or None, unix time of the write)
+        self._replica_lsn = None
+        self._replica_lsn_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'replica_reads': 0, 'primary_reads': 0, 'pinned_reads': 0, 'writes': 0, 'lsn_errors': 0}
+
+    @classmethod
+    def from_env(cls, primary, replica) -> 'RoutedClient':
+        return cls(
+            primary, replica,
+            pin_seconds=float(os.getenv('REPLICA_PIN_SECONDS', '10')),
+            lsn_poll_ms=float(os.getenv('REPLICA_LSN_POLL_MS', '100')),
+        )
+
+    # Positions
+
+    def _lsn(self, client) -> int | None:
+        if not self.track_lsn:
+            return None
+        try:
+            return parse_lsn(client.rpc('replication_lsn', {}).execute().data)
+        except deadlines.DeadlineExceeded:
+            raise
+        except APIError as exc:
+            self.stats['lsn_errors'] += 1
+            if exc.code in MISSING_FUNCTION_CODES:
+                # No replication_lsn() (008 not applied): fall back to time-based pins for good
+                self.track_lsn = False
+            return None
+        except Exception:
+            # Transient (connection, timeout): this position is unknown, the next call tries again
+            self.stats['lsn_errors'] += 1
+            return None
+
+    def replica_lsn(self) -> int | None:
+        now = time.monotonic()
+        if now - self._replica_lsn_at >= self.lsn_poll:
+            self._replica_lsn = self._lsn(self.replica)
+            self._replica_lsn_at = now
+        return self._replica_lsn
+
+    def _caught_up(self, lsn: int | None, written_at: float | None) -> bool:
+        """Has the replica replayed a write made at ``written_at`` (primary position ``lsn``)?"""
+        if written_at is None:
+            return True
+        if lsn is not None:
+            replayed = self.replica_lsn()
+            if replayed is not None:
+                return replayed >= lsn
+        return time.time() - written_at >= self.pin_seconds
+
+    # Routing
+
+    def client_for(self, operation: str):
+        if operation != 'select':
+            return self.primary
+        session = _session.get()
+        if session is None or not session.replica_ok:
+            self.stats['primary_reads'] += 1
+            return self.primary
+        if session.wrote_at is not None or not self._caught_up(session.after_lsn, session.after_time):
+            self.stats['pinned_reads'] += 1
+            return self.primary
+        pin = self._pins.get(session.user_id) if session.user_id else None
+        if pin is not None:
+            # A pin never outlasts REPLICA_PIN_SECONDS, even if the replica's position is unknown
+            lsn, written_at = pin
+            if time.time() - written_at < self.pin_seconds and not self._caught_up(lsn, written_at):
+                self.stats['pinned_reads'] += 1
+                return self.primary
+            with self._lock:
+                if self._pins.get(session.user_id) == pin:
+                    del self._pins[session.user_id]
+        self.stats['replica_reads'] += 1
+        return self.replica
+
+    def note_write(self, session: ReadSession):
+        self.stats['writes'] += 1
+        lsn = self._lsn(self.primary)
+        session.wrote_at = time.time()
+        if lsn is not None:
+            session.wrote_lsn = f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+        if session.user_id:
+            with self._lock:
+                self._pins[session.user_id] = (lsn, session.wrote_at)
+
+    def table(self, name: str) -> RoutedQuery:
+        return RoutedQuery(self, name)
+
+    def from_(self, name: str) -> RoutedQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: dict | None = None):
+        return _RoutedRpc(self, self.primary.rpc(name, params or {}))
+
+    def info(self) -> dict:
+        return {'pinned_members': len(self._pins), 'lsn_tracking': self.track_lsn,
+                'replica_lsn': self._replica_lsn, **self.stats}
+
+class _RoutedRpc:
+    def __init__(self, router: RoutedClient, call):
+        self._router = router
+        self._call = call
+
+    def execute(self):
+        response = self._call.execute()
+        session = _session.get()
+        # Functions may write; treat every call as a write for the caller's session
+        if session is not None:
+            self._router.note_write(session)
+        return response
@@ -1,55 +1,65 @@
-"""Utility script to recompute and print user financial metrics based on current DB state.
+"""Recompute user financial metrics from current DB state and emit repair SQL.
 
-Run inside backend environment (ensure SUPABASE credentials env vars are set if required by supabase_client module).
+Members are paged from `profiles` and processed in parallel chunks (see
+batch.py); each chunk's completed contributions and approved loans are folded
+into integer-cent totals, so memory stays bounded by --page-size.
+
+Run inside backend environment (ensure SUPABASE credentials env vars are set if required by supabase_client module):
+  python backend/recompute_user_metrics.py > recompute.sql
+  python backend/recompute_user_metrics.py --workers 8 --preview --output recompute.sql
 """
-from decimal import Decimal, ROUND_HALF_UP
-from collections import defaultdict
-import supabase_client
-
-# Fetch base profile list
-profiles_res = supabase_client.supabase.table('profiles').select('*').execute()
-profiles = profiles_res.data or []
-
-# Fetch contributions (completed only) and loans (approved only)
-contrib_res = supabase_client.supabase.table('contributions').select('user_id, amount, status').eq('status','completed').execute()
-loan_res = supabase_client.supabase.table('loans').select('user_id, remaining_balance, status').eq('status','approved').execute()
-
-paid_sum = defaultdict(lambda: Decimal('0.00'))
-if contrib_res.data:
-    for c in contrib_res.data:
-        try:
-            paid_sum[c['user_id']] += Decimal(str(c.get('amount',0)))
-        except Exception:
-            pass
-
-loan_balance = defaultdict(lambda: Decimal('0.00'))
-if loan_res.data:
-    for l in loan_res.data:
-        try:
-            loan_balance[l['user_id']] += Decimal(str(l.get('remaining_balance',0)))
-        except Exception:
-            pass
-
-rows = []
-for p in profiles:
-    uid = p['id']
-    total_contributed = paid_sum[uid]
-    borrowing_limit = (total_contributed * Decimal('0.75')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    current_loan_balance = loan_balance[uid].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    rows.append({
-        'id': uid,
-        'full_name': p.get('full_name'),
-        'role': p.get('role'),
-        'weekly_contribution': p.get('weekly_contribution'),
-        'total_contributed_new': str(total_contributed),
-        'borrowing_limit_new': str(borrowing_limit),
-        'current_loan_balance_new': str(current_loan_balance)
-    })
-
-print("Computed Metrics (preview):")
-for r in rows:
-    print(r)
-
-print("\nSuggested SQL UPDATE statements:")
-for r in rows:
-    print(f"UPDATE profiles SET total_contributed = {r['total_contributed_new']}, borrowing_limit = {r['borrowing_limit_new']}, current_loan_balance = {r['current_loan_balance_new']}, updated_at = NOW() WHERE id = '{r['id']}';")
+import argparse
+import sys
+
+import batch
+from aggregation import cents_to_decimal, format_cents
+
+PROFILE_COLUMNS = 'id, full_name, role, weekly_contribution'
+
+def recompute_chunk(members, agg):
+    """Pair each profile row with its MemberTotals."""
+    totals = {t.id: t for t in agg.results()}
+    return [(m, totals[m['id']]) for m in members]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', '-o', help='write SQL here instead of stdout')
+    parser.add_argument('--preview', action='store_true', help='also print the computed metrics as SQL comments')
+    parser.add_argument('--workers', type=int, default=batch.DEFAULT_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=batch.DEFAULT_CHUNK_SIZE, help='members per worker task')
+    parser.add_argument('--page-size', type=int, default=batch.DEFAULT_PAGE_SIZE, help='rows per request')
+    parser.add_argument('--batch-size', type=int, default=batch.DEFAULT_SQL_BATCH, help='rows per generated statement')
+    args = parser.parse_args(argv)
+
+    import supabase_client
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        writer = batch.SqlWriter(out, args.batch_size)
+        writer.comment('Recomputed user metrics (completed contributions, approved loans, 75% borrowing limit)')
+
+        def rows():
+            chunks = batch.run_member_batches(
+                supabase_client.supabase, recompute_chunk, PROFILE_COLUMNS, args.workers,
+                args.chunk_size, args.page_size, batch.stderr_progress('recompute'))
+            for chunk in chunks:
+                for member, t in chunk:
+                    if args.preview:
+                        writer.comment(
+                            f"{member['id']} {member.get('full_name')} ({member.get('role')}, weekly {member.get('weekly_contribution')}): "
+                            f"total_contributed={format_cents(t.total_contributed)} borrowing_limit={format_cents(t.borrowing_limit)} "
+                            f"current_loan_balance={format_cents(t.current_loan_balance)}")
+                    yield (member['id'], cents_to_decimal(t.total_contributed), cents_to_decimal(t.borrowing_limit),
+                           cents_to_decimal(t.current_loan_balance))
+
+        writer.update_from_values(
+            'profiles', 'id', ['total_contributed', 'borrowing_limit', 'current_loan_balance'], rows(),
+            casts={'id': 'uuid', 'total_contributed': 'numeric', 'borrowing_limit': 'numeric', 'current_loan_balance': 'numeric'},
+            extra_set='updated_at = NOW()')
+        print(f"-- recompute: wrote {writer.statements} statement(s)", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,74 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from decimal import Decimal
-from dependencies import require_admin, UserContext
+from dependencies import require_admin, require_operator, require_same_family, UserContext
 import supabase_client
-from db_utils import recalculate_all_user_totals, recalculate_user_totals
+from aggregation import DEFAULT_BORROW_LIMIT_PERCENT, FundAggregator, cents_to_decimal, percent_of_cents
+from db_utils import recalculate_user_totals, recalculate_users_totals
+from jobs import Job, JobContext, job_runner
+from contribution_sweep import sweep_overdue_contributions
+from interest import FREQUENCIES, accrue_interest
+from ledger import record_adjustment, snapshot_members
+from statements import generate_statements, month_period
+from models import LedgerAdjustment
+from datetime import date, datetime
+from query_log import slow_query_log
+from data_cache import table_versions
+from auth import jwks_cache, token_cache
+from read_routing import RoutedClient
+import admission
+import batch
+import deadlines
+import logs
+import tenancy
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-@router.post("/recalculate-contributions", dependencies=[Depends(require_admin)])
-def recalculate_all_contributions():
-    """Recalculate total_contributed for all users based on completed contributions"""
+def _recalculate_contributions(ctx: JobContext, family_id: str):
+    """Recalculate total_contributed for all users in a family based on completed contributions"""
     
     # Get all users
-    users_res = supabase_client.supabase.table('profiles').select('id').execute()
+    users_res = supabase_client.supabase.table('profiles').select('id').eq('family_id', family_id).execute()
     if not users_res.data:
         return {"message": "No users found"}
+    ctx.set_total(len(users_res.data))
+    
+    # One query for the whole family, folded per member in integer cents (see aggregation.py)
+    agg = FundAggregator(user['id'] for user in users_res.data)
+    agg.add_contributions(supabase_client.supabase.table('contributions').select('user_id, amount')
+                          .eq('family_id', family_id).eq('status', 'completed').csv().execute().data)
     
     updated_users = []
     
     for user in users_res.data:
         user_id = user['id']
-        
-        # Calculate total completed contributions for this user
-        contrib_res = supabase_client.supabase.table('contributions').select('amount').eq('user_id', user_id).eq('status', 'paid').execute()
-        
-        total_contributed = Decimal('0.00')
-        if contrib_res.data:
-            total_contributed = sum(Decimal(str(contrib.get('amount', 0))) for contrib in contrib_res.data)
+        total_contributed = agg.contributed.get(user_id)
         
         # Update user profile with calculated total
         update_res = supabase_client.supabase.table('profiles').update({
-            'total_contributed': float(total_contributed)
-        }).eq('id', user_id).execute()
+            'total_contributed': float(cents_to_decimal(total_contributed))
+        }).eq('id', user_id).eq('family_id', family_id).execute()
         
         if update_res.data:
             updated_users.append({
                 'user_id': user_id,
-                'total_contributed': float(total_contributed),
-                'borrowing_limit': float(total_contributed * Decimal('0.75'))
+                'total_contributed': float(cents_to_decimal(total_contributed)),
+                'borrowing_limit': float(cents_to_decimal(percent_of_cents(total_contributed, DEFAULT_BORROW_LIMIT_PERCENT)))
             })
+        ctx.advance()
     
     return {
         "message": f"Recalculated contributions for {len(updated_users)} users",
         "updated_users": updated_users
     }
 
-@router.post("/update-borrowing-limits", dependencies=[Depends(require_admin)])
-def update_all_borrowing_limits():
-    """Update borrowing limits for all users (75% of total contributions)"""
+def _update_borrowing_limits(ctx: JobContext, family_id: str):
+    """Update borrowing limits for all users in a family (75% of total contributions)"""
     
     # Get all users with their total contributions
-    users_res = supabase_client.supabase.table('profiles').select('id, total_contributed').execute()
+    users_res = supabase_client.supabase.table('profiles').select('id, total_contributed').eq('family_id', family_id).execute()
     if not users_res.data:
         return {"message": "No users found"}
+    ctx.set_total(len(users_res.data))
     
     updated_users = []
     
@@ -63,7 +80,7 @@ def update_all_borrowing_limits():
         # Update borrowing limit in profile
         update_res = supabase_client.supabase.table('profiles').update({
             'borrowing_limit': float(borrowing_limit)
-        }).eq('id', user_id).execute()
+        }).eq('id', user_id).eq('family_id', family_id).execute()
         
         if update_res.data:
             updated_users.append({
@@ -71,32 +88,238 @@ def update_all_borrowing_limits():
                 'total_contributed': float(total_contributed),
                 'borrowing_limit': float(borrowing_limit)
             })
+        ctx.advance()
     
     return {
         "message": f"Updated borrowing limits for {len(updated_users)} users",
         "updated_users": updated_users
     }
 
-@router.post("/recalculate-all-totals-v2")
-def recalculate_all_user_totals_endpoint(user: UserContext = Depends(require_admin)):
-    """
-    Recalculate total_contributed and current_loan_balance for all users.
-    This is the improved version that handles both contributions and loans.
-    """
-    results = recalculate_all_user_totals()
+def _recalculate_all_totals(ctx: JobContext, family_id: str):
+    """Recalculate total_contributed and current_loan_balance for all users in a family."""
+    users = tenancy.family_members(family_id)
+    ctx.set_total(len(users))
+    results = []
+    # A chunk costs two paged reads plus its profile updates; cancellation is checked between chunks
+    for start in range(0, len(users), batch.DEFAULT_CHUNK_SIZE):
+        chunk = users[start:start + batch.DEFAULT_CHUNK_SIZE]
+        results.extend(recalculate_users_totals(chunk))
+        ctx.advance(len(chunk))
     return {
         "message": "All user totals recalculated successfully",
         "users_updated": len(results),
         "results": results
     }
 
+def _submit(kind: str, fn, user: UserContext, params: dict | None = None, family: bool = False, **kwargs):
+    """
+    Queue a job; a repeat submission with the same params while it is pending
+    returns the same job. ``family=True`` runs it for the admin's family only
+    (``fn`` gets ``family_id``), deduplicated per family. Other jobs are
+    deployment-wide maintenance (sweep, interest, snapshots) and only
+    operators submit them.
+    """
+    params = dict(params or {})
+    if family:
+        params['family_id'] = kwargs['family_id'] = user.family_id
+    # e.g. "accrue-interest:as_of=2024-05-01:frequency=None"; a different as_of is a different job
+    key = ':'.join([kind, *(f"{name}={value}" for name, value in sorted(params.items()))])
+    params['requested_by'] = user.id
+    job, created = job_runner.submit(kind, fn, key=key, params=params, **kwargs)
+    return {
+        "message": f"Job {kind} {'queued' if created else 'already in progress'}",
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/admin/jobs/{job.id}"
+    }
+
+@router.post("/recalculate-contributions", status_code=202)
+def recalculate_all_contributions(user: UserContext = Depends(require_admin)):
+    """Queue recalculation of total_contributed for all users; poll /admin/jobs/{job_id} for the result."""
+    return _submit('recalculate-contributions', _recalculate_contributions, user, family=True)
+
+@router.post("/update-borrowing-limits", status_code=202)
+def update_all_borrowing_limits(user: UserContext = Depends(require_admin)):
+    """Queue a borrowing limit update (75% of total contributions) for all users."""
+    return _submit('update-borrowing-limits', _update_borrowing_limits, user, family=True)
+
+@router.post("/recalculate-all-totals-v2", status_code=202)
+def recalculate_all_user_totals_endpoint(user: UserContext = Depends(require_admin)):
+    """
+    Queue recalculation of total_contributed and current_loan_balance for all users.
+    This is the improved version that handles both contributions and loans.
+    """
+    return _submit('recalculate-all-totals', _recalculate_all_totals, user, family=True)
+
+@router.post("/sweep-contributions", status_code=202)
+def sweep_contributions(
+    as_of: date | None = Query(default=None, description="Sweep as if run on this date (default today)"),
+    dry_run: bool = Query(default=False),
+    user: UserContext = Depends(require_operator),
+):
+    """
+    Queue the overdue sweep: pending contributions past due_date become late or
+    missed per the grace rules, late fees are assessed, and each affected
+    member's totals are refreshed once.
+    """
+    kind = 'sweep-contributions-dry-run' if dry_run else 'sweep-contributions'
+    return _submit(kind, sweep_overdue_contributions, user, params={'as_of': as_of.isoformat() if as_of else None},
+                   as_of=as_of, dry_run=dry_run)
+
+@router.post("/accrue-interest", status_code=202)
+def accrue_loan_interest(
+    frequency: str | None = Query(default=None, description="daily or weekly (default INTEREST_ACCRUAL_FREQUENCY)"),
+    as_of: date | None = Query(default=None, description="Accrue through this date (default yesterday)"),
+    dry_run: bool = Query(default=False),
+    user: UserContext = Depends(require_operator),
+):
+    """
+    Queue interest accrual for every open loan with an interest rate. Each
+    (loan, period) is charged at most once, so re-running is safe.
+    """
+    if frequency is not None and frequency not in FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"frequency must be one of {', '.join(FREQUENCIES)}")
+    kind = 'accrue-interest-dry-run' if dry_run else 'accrue-interest'
+    return _submit(kind, accrue_interest, user, params={'as_of': as_of.isoformat() if as_of else None, 'frequency': frequency},
+                   as_of=as_of, frequency=frequency, dry_run=dry_run)
+
+@router.post("/ledger/snapshots", status_code=202)
+def snapshot_ledgers(
+    as_of: datetime | None = Query(default=None, description="Snapshot events before this time (default today 00:00 UTC)"),
+    user: UserContext = Depends(require_operator),
+):
+    """Queue a snapshot of every member's ledger totals; point-in-time queries replay from the latest one."""
+    return _submit('ledger-snapshots', snapshot_members, user, params={'as_of': as_of.isoformat() if as_of else None}, as_of=as_of)
+
+@router.post("/ledger/adjustments", status_code=201)
+def ledger_adjustment(payload: LedgerAdjustment, user: UserContext = Depends(require_admin)):
+    """
+    Append a manual correction to a member's ledger. It changes point-in-time
+    totals only; stored profile totals still follow contributions and loans.
+    """
+    if not payload.contributed_delta and not payload.loan_delta:
+        raise HTTPException(status_code=400, detail="Adjustment must change contributed or loan balance")
+    require_same_family(user, payload.user_id)
+    note = payload.note or f"adjustment by {user.id}"
+    return record_adjustment(payload.user_id, payload.contributed_delta, payload.loan_delta, payload.occurred_at, note,
+                             family_id=user.family_id)
+
+@router.post("/statements", status_code=202)
+def render_statements(
+    month: str = Query(..., description="YYYY-MM"),
+    format: str = Query(default='html', pattern='^(csv|html)$'),
+    user: UserContext = Depends(require_admin),
+):
+    """Queue rendering of every statement in the admin's family for a month; download them from the job's download_url."""
+    try:
+        month_period(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    return _submit(f'statements-{month}-{format}', generate_statements, user, params={'month': month, 'format': format},
+                   family=True, month=month, fmt=format)
+
+def _job_families(user: UserContext) -> set:
+    """Jobs an admin may see: their family's, plus deployment-wide ones for operators."""
+    return {user.family_id, None} if user.operator else {user.family_id}
+
+def _visible_job(job_id: str, user: UserContext) -> Job:
+    """404 unless the job exists and belongs to the caller (other families' jobs are not disclosed)."""
+    job = job_runner.get(job_id)
+    if job is None or job.family_id not in _job_families(user):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs")
+def list_jobs(status: str = Query(default=None), kind: str = Query(default=None), limit: int = Query(default=50, ge=1, le=200),
+              user: UserContext = Depends(require_admin)):
+    """Recent background jobs of the admin's family, newest first (results omitted; fetch a job by id for them)."""
+    return [job.as_dict(include_result=False) for job in job_runner.list(status, kind, limit, families=_job_families(user))]
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, user: UserContext = Depends(require_admin)):
+    """Status, progress and (once finished) result of a background job."""
+    return _visible_job(job_id, user).as_dict()
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, user: UserContext = Depends(require_admin)):
+    """Cancel a queued job, or ask a running one to stop at its next checkpoint."""
+    job = job_runner.cancel(_visible_job(job_id, user).id)
+    return job.as_dict(include_result=False)
+
 @router.post("/recalculate-user-totals/{user_id}")
 def recalculate_single_user_totals_endpoint(user_id: str, user: UserContext = Depends(require_admin)):
     """
     Recalculate totals for a specific user.
     """
+    require_same_family(user, user_id)
     result = recalculate_user_totals(user_id)
     return {
         "message": f"User totals recalculated successfully for user {user_id}",
         "result": result
     }
+
+@router.get("/slow-queries", dependencies=[Depends(require_operator)])
+def slow_queries(limit: int = Query(default=None, ge=1, le=200)):
+    """
+    Rolling summary of data-layer calls slower than SLOW_QUERY_MS.
+
+    Shapes are ranked by cumulative time; each lists the filter columns and
+    the router functions that issued it, which is where to look for missing
+    indexes or duplicated queries.
+    """
+    return slow_query_log.summary(limit)
+
+@router.delete("/slow-queries", dependencies=[Depends(require_operator)])
+def reset_slow_queries():
+    """Clear the slow-query log (e.g. after adding an index)."""
+    slow_query_log.reset()
+    return {"message": "Slow-query log cleared"}
+
+@router.get("/auth-cache", dependencies=[Depends(require_operator)])
+def auth_cache():
+    """Signing-key refreshes, verified-token and member -> family cache hit rates (see auth.py, tenancy.py)."""
+    return {"jwks": jwks_cache.info(), "tokens": token_cache.info(), "families": tenancy.directory.info()}
+
+@router.get("/replica", dependencies=[Depends(require_operator)])
+def replica_routing():
+    """Read routing between primary and replica (see read_routing.py)."""
+    client = supabase_client.supabase.raw
+    if not isinstance(client, RoutedClient):
+        return {"enabled": False}
+    return {"enabled": True, **client.info()}
+
+@router.get("/admission", dependencies=[Depends(require_operator)])
+def admission_control():
+    """
+    In-flight requests, queue depth and shed counts per priority class and
+    heavy route (see admission.py), and requests stopped by their deadline
+    or a client disconnect (see deadlines.py).
+    """
+    return dict(admission.controller.info(), deadlines=deadlines.policy.stats)
+
+@router.get("/logging", dependencies=[Depends(require_operator)])
+def logging_pipeline():
+    """Log queue depth, records dropped because the queue was full, and records sampled out per event (see logs.py)."""
+    return logs.stats()
+
+@router.post("/archive-closed-loans", dependencies=[Depends(require_operator)])
+def archive_closed_loans(older_than_days: int = Query(default=365, ge=0)):
+    """
+    Move paid/rejected loans closed more than `older_than_days` ago (and their
+    payments) into loans_archive / loan_payments_archive.
+    See supabase/migrations/004_partition_contributions_payments.sql.
+    """
+    res = supabase_client.supabase.rpc('archive_closed_loans', {'p_older_than_days': older_than_days}).execute()
+    # RPC writes bypass the data-layer observer
+    table_versions.bump('loans', 'loan_payments', 'loans_archive', 'loan_payments_archive')
+    return {
+        "message": f"Archived {res.data or 0} closed loans",
+        "archived": res.data or 0
+    }
+
+@router.post("/ensure-partitions", dependencies=[Depends(require_operator)])
+def ensure_partitions(years_ahead: int = Query(default=1, ge=0, le=10)):
+    """Create contributions / loan_payments partitions for the current and upcoming years."""
+    supabase_client.supabase.rpc('ensure_time_partitions', {'p_years_ahead': years_ahead}).execute()
+    return {"message": f"Partitions ensured through {years_ahead} year(s) ahead"}
@@ -0,0 +1,172 @@
+"""
+POST /batch: several GET calls in one round trip.
+
+A dashboard load needs users, loans, contributions, per-loan payments and
+stats. Sent separately, each call pays its own HTTP round trip and auth.
+A batch lists them as sub-requests::
+
+    {"requests": [{"id": "loans", "path": "/loans"},
+                  {"id": "payments", "path": "/loans/<id>/payments"},
+                  {"path": "/stats/me"}]}
+
+and they run concurrently (at most BATCH_CONCURRENCY at a time) through
+the same routes, dependencies and exception handlers as direct calls. The
+answer lists ``{"id", "status", "body"}`` in request order. A sub-request
+that fails gets its own status (403, 404, 422, 503, 504...) and the rest
+are unaffected. A non-JSON answer also gets its ``content_type``: text
+comes back as a string, anything else (e.g. the zip of
+/statements/archive) base64-encoded with ``"encoding": "base64"``.
+
+Sub-requests share the batch's context:
+  * auth     the caller is authenticated once for the batch; sub-requests
+             act as that caller (their own auth headers are not consulted)
+  * reads    identical queries are issued once for the whole batch
+             (see ``data_layer.memoized``)
+  * deadline the batch's deadline (see deadlines.py) bounds every sub-request
+  * logs     records carry the batch's request id (see logs.py)
+Each sub-request is admitted in its own priority class, as the separate
+call would be (see admission.py), and reads from the replica like any GET
+(see read_routing.py).
+
+Only GET sub-requests are accepted: reads can run in any order and retried
+safely, so one failed sub-request never leaves a write half-applied.
+
+Configuration (environment):
+  BATCH_MAX_REQUESTS   sub-requests accepted per batch (default 50)
+  BATCH_CONCURRENCY    sub-requests running at once within a batch (default 8)
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+from urllib.parse import unquote, urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+from starlette.responses import Response
+
+import admission
+import data_layer
+import fast_json
+import read_routing
+import supabase_client
+from dependencies import get_current_user, shared_user, UserContext
+from models import BatchOut, BatchRequest, BatchSubRequest
+
+log = logging.getLogger(__name__)
+
+router = APIRouter(tags=["batch"])
+
+MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '50'))
+CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+# Headers describing the batch's own body; not passed on to sub-requests
+_BODY_HEADERS = {b'content-length', b'content-type', b'transfer-encoding', b'expect'}
+# Set by the router when it matches a route; a sub-request starts without them
+_ROUTE_KEYS = ('endpoint', 'path_params', 'route', 'fastapi_astack')
+
+def _dispatcher(app):
+    """The app's routes wrapped as FastAPI wraps them, inside all middleware (built once per app)."""
+    dispatch = getattr(app.state, 'batch_dispatcher', None)
+    if dispatch is None:
+        handlers = {key: handler for key, handler in app.exception_handlers.items() if key not in (500, Exception)}
+        dispatch = ExceptionMiddleware(AsyncExitStackMiddleware(app.router), handlers=handlers, debug=app.debug)
+        app.state.batch_dispatcher = dispatch
+    return dispatch
+
+def _scope(request: Request, path: str, query: str) -> dict:
+    scope = {key: value for key, value in request.scope.items() if key not in _ROUTE_KEYS}
+    scope.update(
+        method='GET',
+        path=unquote(path),
+        raw_path=path.encode('latin-1', 'replace'),
+        query_string=query.encode('latin-1', 'replace'),
+        headers=[(name, value) for name, value in request.scope['headers'] if name not in _BODY_HEADERS],
+    )
+    return scope
+
+async def _call(dispatch, scope: dict) -> tuple:
+    """Serve one sub-request; returns (status, content type, body)."""
+    messages = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Sub-requests have no client of their own; the batch's deadline ends them
+        await asyncio.Future()
+
+    async def send(message):
+        messages.append(message)
+
+    await dispatch(scope, receive, send)
+    start = next(m for m in messages if m['type'] == 'http.response.start')
+    content_type = next((value for name, value in start.get('headers', []) if name == b'content-type'), b'')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return start['status'], content_type, body
+
+def _entry(item_id: str, status: int, content_type: bytes, body: bytes) -> bytes:
+    """One ``{"id", "status", "body"}`` object; JSON bodies are spliced in as they are."""
+    prefix = b'{"id":%s,"status":%d' % (fast_json.dumps(item_id), status)
+    if not body:
+        return prefix + b',"body":null}'
+    if content_type.startswith(b'application/json'):
+        return prefix + b',"body":%s}' % body
+    prefix += b',"content_type":%s' % fast_json.dumps(content_type.decode('latin-1'))
+    if content_type.startswith(b'text/'):
+        try:
+            return prefix + b',"body":%s}' % fast_json.dumps(body.decode('utf-8'))
+        except UnicodeDecodeError:
+            pass
+    return prefix + b',"encoding":"base64","body":"%s"}' % base64.b64encode(body)
+
+async def _run(dispatch, request: Request, user: UserContext, item: BatchSubRequest, item_id: str,
+               slots: asyncio.Semaphore) -> bytes:
+    target = urlsplit(item.path)
+    async with slots:
+        # Runs in its own task, so the read session below is this sub-request's alone
+        reset = None
+        if supabase_client.replica_configured():
+            reset = read_routing.begin_request('GET', user.id, request.headers.get(read_routing.SESSION_HEADER))
+        held, shed = await admission.controller.admit('GET', unquote(target.path))
+        try:
+            if shed is not None:
+                response = admission.shed_response(*shed)
+                return _entry(item_id, response.status_code, b'application/json', response.body)
+            started = time.monotonic()
+            try:
+                return _entry(item_id, *await _call(dispatch, _scope(request, target.path, target.query)))
+            except Exception:
+                log.exception("Batch sub-request failed", extra={'event': 'batch_request_failed', 'sub_path': target.path})
+                return _entry(item_id, 500, b'application/json', b'{"detail":"Internal Server Error"}')
+            finally:
+                held_ms = (time.monotonic() - started) * 1000
+                for limiter in held:
+                    limiter.release(held_ms)
+                held = []
+        finally:
+            for limiter in held:
+                limiter.release()
+            if reset is not None:
+                read_routing.end_request(reset)
+
+@router.post("/batch", response_model=BatchOut)
+async def batch(payload: BatchRequest, request: Request, user: UserContext = Depends(get_current_user)):
+    """Run GET sub-requests concurrently, sharing auth and reads; per-sub-request status and body."""
+    if len(payload.requests) > MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REQUESTS} requests per batch")
+    if any(urlsplit(item.path).path.rstrip('/') in admission.DISPATCH_PATHS for item in payload.requests):
+        raise HTTPException(status_code=400, detail="Batches cannot be nested")
+    dispatch = _dispatcher(request.app)
+    slots = asyncio.Semaphore(CONCURRENCY if CONCURRENCY > 0 else len(payload.requests))
+    with shared_user(user), data_layer.memoized() as memo:
+        entries = await asyncio.gather(*(
+            _run(dispatch, request, user, item, item.id if item.id is not None else str(position), slots)
+            for position, item in enumerate(payload.requests)
+        ))
+    log.info("Batch of %d served", len(entries), extra={'event': 'batch', 'requests': len(entries), **memo.info()})
+    return Response(b'{"responses":[' + b','.join(entries) + b']}', media_type='application/json')
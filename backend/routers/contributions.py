@@ -1,26 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException
-from dependencies import get_current_user, require_admin, UserContext
+from fastapi import APIRouter, Depends, HTTPException, Query
+from dependencies import get_current_user, require_admin, require_same_family, UserContext
 import supabase_client
 from models import ContributionCreate, ContributionOut, ContributionMarkPaid, ContributionUpdate
 from datetime import datetime, date
 import decimal
 from db_utils import update_user_totals_after_contribution_change
+from contribution_calendar import contribution_calendar, week_index, week_of, current_week_index, STATUS_NAMES
+from aggregation import cents_to_decimal
+import tenancy
+from fast_json import FastJSONResponse
 
 router = APIRouter(prefix="/contributions", tags=["contributions"])
 
+def _years(query, period_year: int | None, from_year: int | None, to_year: int | None):
+    """Year filters; with any of them Postgres prunes to the matching yearly partitions (004)."""
+    if period_year is not None:
+        query = query.eq('period_year', period_year)
+    if from_year is not None:
+        query = query.gte('period_year', from_year)
+    if to_year is not None:
+        query = query.lte('period_year', to_year)
+    return query
+
 @router.get("/mine")
-def my_contributions(user: UserContext = Depends(get_current_user)):
-    res = supabase_client.supabase.table('contributions').select('*').eq('user_id', user.id).execute()
-    return res.data
+def my_contributions(
+    period_year: int | None = Query(default=None),
+    from_year: int | None = Query(default=None, ge=2000, le=2100),
+    to_year: int | None = Query(default=None, ge=2000, le=2100),
+    user: UserContext = Depends(get_current_user),
+):
+    query = supabase_client.supabase.table('contributions').select('*').eq('user_id', user.id)
+    return FastJSONResponse(_years(query, period_year, from_year, to_year).execute().data)
+
+@router.get("")
+def all_contributions(
+    period_year: int | None = Query(default=None),
+    from_year: int | None = Query(default=None, ge=2000, le=2100),
+    to_year: int | None = Query(default=None, ge=2000, le=2100),
+    user: UserContext = Depends(require_admin),
+):
+    query = supabase_client.supabase.table('contributions').select('*').eq('family_id', user.family_id)
+    return FastJSONResponse(_years(query, period_year, from_year, to_year).execute().data)
+
+def _calendar_user(user_id: str | None, user: UserContext) -> str:
+    """Members may only look at their own calendar; admins pass user_id for anyone's in their family."""
+    if user_id is None or user_id == user.id:
+        return user.id
+    if user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    require_same_family(user, user_id)
+    return user_id
+
+def _week_label(index: int) -> dict:
+    year, week = week_of(index)
+    return {'year': year, 'week': week}
+
+def _week_range(from_year: int | None, to_year: int | None) -> tuple:
+    first = week_index(from_year, 1) if from_year is not None else None
+    last = week_index(to_year + 1, 1) - 1 if to_year is not None else None
+    return first, last
 
-@router.get("", dependencies=[Depends(require_admin)])
-def all_contributions():
-    return supabase_client.supabase.table('contributions').select('*').execute().data
+@router.get("/calendar")
+def contribution_heatmap(
+    user_id: str | None = Query(default=None),
+    from_year: int | None = Query(default=None, ge=2000, le=2100),
+    to_year: int | None = Query(default=None, ge=2000, le=2100),
+    user: UserContext = Depends(get_current_user),
+):
+    """Week-by-week contribution status for one member (heatmap), from the in-memory calendar."""
+    target = _calendar_user(user_id, user)
+    first, last = _week_range(from_year, to_year)
+    return {
+        'user_id': target,
+        'weeks': [dict(_week_label(index), status=STATUS_NAMES[status], amount=cents_to_decimal(cents))
+                  for index, status, cents in contribution_calendar.heatmap(target, user.family_id, first, last)],
+    }
+
+@router.get("/calendar/matrix")
+def contribution_matrix(
+    from_year: int | None = Query(default=None, ge=2000, le=2100),
+    to_year: int | None = Query(default=None, ge=2000, le=2100),
+    user: UserContext = Depends(require_admin),
+):
+    """
+    Members x weeks status matrix, one character per week:
+    '-' no record, 'p' pending, 'c' completed, 'l' late, 'm' missed.
+    Defaults to the last 52 weeks.
+    """
+    first, last = _week_range(from_year, to_year)
+    last = current_week_index() if last is None else last
+    first = last - 51 if first is None else first
+    return {
+        'from': _week_label(first),
+        'to': _week_label(last),
+        'members': contribution_calendar.matrix(user.family_id, first, last, tenancy.family_members(user.family_id)),
+    }
+
+@router.get("/missed")
+def missed_weeks(user_id: str | None = Query(default=None), user: UserContext = Depends(get_current_user)):
+    """Past weeks marked missed or late, and weeks with no contribution record."""
+    target = _calendar_user(user_id, user)
+    result = contribution_calendar.missed(target, user.family_id)
+    return dict({key: [_week_label(i) for i in weeks] for key, weeks in result.items()}, user_id=target)
+
+@router.get("/streak")
+def contribution_streak(user_id: str | None = Query(default=None), user: UserContext = Depends(get_current_user)):
+    """Current and longest runs of consecutive completed weeks."""
+    target = _calendar_user(user_id, user)
+    result = contribution_calendar.streak(target, user.family_id)
+    return {
+        'user_id': target,
+        'current_streak': result['current'],
+        'longest_streak': result['longest'],
+        'longest_streak_ended': _week_label(result['longest_end']) if result['longest_end'] is not None else None,
+    }
 
-@router.post("", dependencies=[Depends(require_admin)])
-def create_contribution(payload: ContributionCreate):
+@router.post("")
+def create_contribution(payload: ContributionCreate, user: UserContext = Depends(require_admin)):
+    require_same_family(user, payload.user_id)
     insert = payload.dict()
     insert['status'] = 'pending'
+    insert['family_id'] = user.family_id
     
     # Convert Decimal fields to float for JSON serialization
     if 'expected_amount' in insert:
@@ -33,57 +133,64 @@ def create_contribution(payload: ContributionCreate):
     res = supabase_client.supabase.table('contributions').insert(insert).execute()
     if not res.data:
         raise HTTPException(status_code=400, detail="Failed to create contribution")
+    contribution_calendar.apply(res.data, user.family_id)
     return res.data[0]
 
 @router.post("/{contribution_id}/mark-completed")
 def mark_completed(contribution_id: str, payload: ContributionMarkPaid, user: UserContext = Depends(get_current_user)):
     # Fetch contribution
-    res = supabase_client.supabase.table('contributions').select('*').eq('id', contribution_id).execute()
+    res = supabase_client.supabase.table('contributions').select('*').eq('id', contribution_id).eq('family_id', user.family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="Contribution not found")
     contrib = res.data[0]
     if user.role != 'admin' and contrib['user_id'] != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    if contrib['status'] == 'paid':
+    if contrib['status'] == 'completed':
         raise HTTPException(status_code=400, detail="Already completed")
     update = {
-        'status': 'paid',
+        'status': 'completed',
         'amount': float(payload.amount) if payload.amount is not None else contrib.get('amount'),
         'paid_at': datetime.utcnow().isoformat(),
         'method': payload.method or 'manual'
     }
-    res2 = supabase_client.supabase.table('contributions').update(update).eq('id', contribution_id).execute()
+    # The row's period_year confines the update to its partition
+    res2 = (supabase_client.supabase.table('contributions').update(update).eq('id', contribution_id)
+            .eq('family_id', user.family_id).eq('period_year', contrib['period_year']).execute())
+    contribution_calendar.apply(res2.data, user.family_id)
     
     # Update user totals after contribution status change
     update_user_totals_after_contribution_change(contrib['user_id'])
     
     return res2.data[0] if res2.data else update
 
-@router.post("/{contribution_id}/mark-late", dependencies=[Depends(require_admin)])
-def mark_late(contribution_id: str):
+@router.post("/{contribution_id}/mark-late")
+def mark_late(contribution_id: str, user: UserContext = Depends(require_admin)):
     # Fetch contribution first to get user_id
-    contrib_res = supabase_client.supabase.table('contributions').select('user_id').eq('id', contribution_id).execute()
+    contrib_res = supabase_client.supabase.table('contributions').select('user_id, period_year').eq('id', contribution_id).eq('family_id', user.family_id).execute()
     if not contrib_res.data:
         raise HTTPException(status_code=404, detail="Contribution not found")
     
-    res = supabase_client.supabase.table('contributions').update({'status': 'late'}).eq('id', contribution_id).execute()
+    res = (supabase_client.supabase.table('contributions').update({'status': 'late'}).eq('id', contribution_id)
+           .eq('family_id', user.family_id).eq('period_year', contrib_res.data[0]['period_year']).execute())
     if not res.data:
         raise HTTPException(status_code=404, detail="Contribution not found")
+    contribution_calendar.apply(res.data, user.family_id)
     
     # Update user totals after contribution status change
     update_user_totals_after_contribution_change(contrib_res.data[0]['user_id'])
     
     return res.data[0]
 
-@router.post("/{contribution_id}/mark-missed", dependencies=[Depends(require_admin)])
-def mark_missed(contribution_id: str):
-    res = supabase_client.supabase.table('contributions').update({'status': 'missed'}).eq('id', contribution_id).execute()
+@router.post("/{contribution_id}/mark-missed")
+def mark_missed(contribution_id: str, user: UserContext = Depends(require_admin)):
+    res = supabase_client.supabase.table('contributions').update({'status': 'missed'}).eq('id', contribution_id).eq('family_id', user.family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="Contribution not found")
+    contribution_calendar.apply(res.data, user.family_id)
     return res.data[0]
 
-@router.patch("/{contribution_id}", dependencies=[Depends(require_admin)])
-def update_contribution(contribution_id: str, payload: ContributionUpdate):
+@router.patch("/{contribution_id}")
+def update_contribution(contribution_id: str, payload: ContributionUpdate, user: UserContext = Depends(require_admin)):
     update = {}
     for k, v in payload.dict(exclude_unset=True).items():
         if v is not None:
@@ -98,12 +205,14 @@ def update_contribution(contribution_id: str, payload: ContributionUpdate):
     if not update:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    res = supabase_client.supabase.table('contributions').update(update).eq('id', contribution_id).execute()
+    res = supabase_client.supabase.table('contributions').update(update).eq('id', contribution_id).eq('family_id', user.family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="Contribution not found")
+    contribution_calendar.apply(res.data, user.family_id)
     return res.data[0]
 
-@router.delete("/{contribution_id}", dependencies=[Depends(require_admin)])
-def delete_contribution(contribution_id: str):
-    res = supabase_client.supabase.table('contributions').delete().eq('id', contribution_id).execute()
+@router.delete("/{contribution_id}")
+def delete_contribution(contribution_id: str, user: UserContext = Depends(require_admin)):
+    res = supabase_client.supabase.table('contributions').delete().eq('id', contribution_id).eq('family_id', user.family_id).execute()
+    contribution_calendar.remove(res.data, user.family_id)
     return { 'deleted': bool(res.data) }
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime
+from decimal import Decimal
+from dependencies import require_admin, UserContext
+from models import ForecastOut, ForecastScenarioRequest, ForecastScenarioOut
+from aggregation import cents_to_decimal, to_cents
+import forecast
+
+router = APIRouter(prefix="/forecast", tags=["forecast"], dependencies=[Depends(require_admin)])
+
+MONEY_FIELDS = ('outstanding_loans', 'opening_cash', 'closing_cash', 'min_cash')
+WEEK_MONEY_FIELDS = ('contributions_in', 'repayments_in', 'disbursements_out', 'net', 'cash')
+
+def _to_out(result: dict) -> dict:
+    out = dict(result)
+    for key in MONEY_FIELDS:
+        out[key] = cents_to_decimal(result[key])
+    out['schedule'] = [dict(row, **{key: cents_to_decimal(row[key]) for key in WEEK_MONEY_FIELDS}) for row in result['schedule']]
+    return out
+
+def _opening(opening_balance: Decimal | None) -> int | None:
+    return to_cents(opening_balance) if opening_balance is not None else None
+
+@router.get("", response_model=ForecastOut)
+def fund_forecast(
+    weeks: int = Query(default=forecast.DEFAULT_FORECAST_WEEKS, ge=1, le=forecast.MAX_FORECAST_WEEKS),
+    collection_rate: float = Query(default=1.0, ge=0, le=1, description="Share of expected weekly contributions assumed collected"),
+    opening_balance: Decimal | None = Query(default=None, description="Override the computed opening cash position"),
+    user: UserContext = Depends(require_admin),
+):
+    """Projected weekly cash position: expected contributions plus scheduled repayments on open loans."""
+    today = datetime.utcnow().date()
+    return _to_out(forecast.forecast(user.family_id, weeks, today, collection_rate, _opening(opening_balance)))
+
+@router.post("/scenario", response_model=ForecastScenarioOut)
+def forecast_scenario(payload: ForecastScenarioRequest, user: UserContext = Depends(require_admin)):
+    """Impact on the cash position of approving a set of pending loans today."""
+    today = datetime.utcnow().date()
+    opening = _opening(payload.opening_balance)
+    baseline = forecast.forecast(user.family_id, payload.weeks, today, payload.collection_rate, opening)
+    try:
+        scenario = forecast.forecast(user.family_id, payload.weeks, today, payload.collection_rate, opening,
+                                     approve=payload.loan_ids)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Loan {e.args[0]} is not a pending loan")
+    return {
+        'baseline': _to_out(baseline),
+        'scenario': _to_out(scenario),
+        'closing_cash_change': cents_to_decimal(scenario['closing_cash'] - baseline['closing_cash']),
+        'min_cash_change': cents_to_decimal(scenario['min_cash'] - baseline['min_cash']),
+    }
@@ -1,60 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from dependencies import get_current_user, require_admin, UserContext
 import supabase_client
-from models import LoanRequest, LoanActionResponse, LoanPayment
-from db_utils import update_user_totals_after_loan_change, update_user_totals_after_payment
+from models import (LoanRequest, LoanActionResponse, LoanPayment, LoanInterestSettings, LoanScheduleOut, LoanScenario,
+                    LoanSimulationRequest, LoanSimulationOut, FundSimulationOut)
+from aggregation import cents_to_decimal, to_cents
+import amortization
+import interest
+from db_utils import calculate_borrowing_limit, calculate_loan_balance, totals_queue, update_user_totals_after_loan_change, update_user_totals_after_payment
+from fast_json import FastJSONResponse, typed_response
 
 router = APIRouter(prefix="/loans", tags=["loans"])
 
-def _calculate_user_borrowing_limit(user_id: str) -> Decimal:
-    """Calculate borrowing limit based on user's borrow_limit_percent and total paid contributions"""
-    # Get user's borrow_limit_percent setting
-    user_res = supabase_client.supabase.table('users').select('borrow_limit_percent').eq('id', user_id).execute()
-    
-    if not user_res.data:
-        return Decimal('0.00')
-    
-    borrow_limit_percent = Decimal(str(user_res.data[0].get('borrow_limit_percent', 75.0)))
-    
-    # Get user's total paid contributions
-    contrib_res = supabase_client.supabase.table('contributions').select('amount').eq('user_id', user_id).eq('status', 'paid').execute()
-    
-    total_contributed = Decimal('0.00')
-    if contrib_res.data:
-        total_contributed = sum(Decimal(str(contrib.get('amount', 0))) for contrib in contrib_res.data)
-    
-    # Calculate borrowing limit using user's configurable percentage
-    borrowing_limit = (total_contributed * (borrow_limit_percent / Decimal('100'))).quantize(Decimal('0.01'))
-    
-    return borrowing_limit
-
-def _get_user_current_loan_balance(user_id: str) -> Decimal:
-    """Get user's current outstanding loan balance"""
-    res = supabase_client.supabase.table('loans').select('remaining_balance').eq('user_id', user_id).eq('status', 'approved').execute()
-    if not res.data:
-        return Decimal('0.00')
-    
-    total_balance = sum((Decimal(str(loan.get('remaining_balance', 0))) for loan in res.data), Decimal('0.00'))
-    return total_balance
-
-def _fetch_loan(loan_id: str):
-    res = supabase_client.supabase.table('loans').select('*').eq('id', loan_id).execute()
+def _fetch_loan(loan_id: str, family_id: str):
+    res = supabase_client.supabase.table('loans').select('*').eq('id', loan_id).eq('family_id', family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="Loan not found")
     return res.data[0]
 
 @router.get("/mine")
-def my_loans(user: UserContext = Depends(get_current_user)):
+def my_loans(include_archived: bool = Query(default=False), user: UserContext = Depends(get_current_user)):
     res = supabase_client.supabase.table('loans').select('*').eq('user_id', user.id).execute()
-    return res.data
+    if not include_archived:
+        return FastJSONResponse(res.data)
+    # Closed loans moved out by archive_closed_loans()
+    archived = supabase_client.supabase.table('loans_archive').select('*').eq('user_id', user.id).execute()
+    return FastJSONResponse((res.data or []) + (archived.data or []))
 
 @router.get("/my-capacity")
 def my_loan_capacity(user: UserContext = Depends(get_current_user)):
     """Get user's borrowing capacity based on 75% of total contributions"""
-    borrowing_limit = _calculate_user_borrowing_limit(user.id)
-    current_loan_balance = _get_user_current_loan_balance(user.id)
+    # Stored totals must reflect this member's own queued updates
+    totals_queue.flush_user(user.id)
+    borrowing_limit = calculate_borrowing_limit(user.id)
+    current_loan_balance = calculate_loan_balance(user.id)
     available_credit = borrowing_limit - current_loan_balance
     
     # Get total contributions for reference
@@ -62,22 +42,61 @@ def my_loan_capacity(user: UserContext = Depends(get_current_user)):
     total_contributed = Decimal(str(prof_res.data[0].get('total_contributed', 0))) if prof_res.data else Decimal('0.00')
     
     return {
-        'total_contributed': float(total_contributed),
-        'borrowing_limit': float(borrowing_limit),
-        'current_loan_balance': float(current_loan_balance),
-        'available_credit': float(available_credit),
+        'total_contributed': total_contributed,
+        'borrowing_limit': borrowing_limit,
+        'current_loan_balance': current_loan_balance,
+        'available_credit': available_credit,
         'loan_to_contribution_ratio': 0.75
     }
 
-@router.get("", dependencies=[Depends(require_admin)])
-def all_loans():
-    return supabase_client.supabase.table('loans').select('*').execute().data
+@router.get("")
+def all_loans(user: UserContext = Depends(require_admin)):
+    return FastJSONResponse(supabase_client.supabase.table('loans').select('*').eq('family_id', user.family_id).execute().data)
+
+def _scenario_cents(scenario: LoanScenario) -> dict:
+    return {
+        'name': scenario.name,
+        'extra_weekly': to_cents(scenario.extra_weekly) or 0,
+        'lump_sum': to_cents(scenario.lump_sum) or 0,
+        'skip_weeks': [w for w in scenario.skip_weeks if w >= 1],
+    }
+
+def _scenario_out(result: dict) -> dict:
+    out = dict(result, total_paid=cents_to_decimal(result['total_paid']))
+    if 'balances' in result:
+        out['balances'] = [cents_to_decimal(b) for b in result['balances']]
+    return out
+
+@router.post("/simulate", response_model=FundSimulationOut)
+def simulate_open_loans(scenario: LoanScenario, user: UserContext = Depends(require_admin)):
+    """Apply one what-if scenario to every open loan in the family: per-loan payoff plus fund-wide weekly repayments."""
+    loans = (supabase_client.supabase.table('loans').select('id, user_id, amount, status, duration_weeks, weekly_payment, remaining_balance')
+             .eq('family_id', user.family_id).eq('status', 'approved').execute().data or [])
+    today = datetime.utcnow().date()
+    open_loans, projection = amortization.project_open_loans(loans, today, _scenario_cents(scenario))
+    projected = []
+    for loan, weeks in zip(open_loans, projection.payoff_weeks):
+        projected.append({
+            'loan_id': loan['id'],
+            'user_id': loan['user_id'],
+            'remaining_balance': cents_to_decimal(to_cents(loan['remaining_balance']) or 0),
+            'weeks_to_payoff': weeks,
+            'payoff_date': today + timedelta(weeks=weeks) if weeks is not None else None,
+        })
+    return typed_response(FundSimulationOut, {
+        'as_of': today,
+        'scenario': scenario,
+        'open_loans': len(open_loans),
+        'total_outstanding': sum((p['remaining_balance'] for p in projected), Decimal('0.00')),
+        'weekly_repayments': [cents_to_decimal(c) for c in amortization.weekly_totals(projection)] if open_loans else [],
+        'loans': projected,
+    })
 
 @router.post("/request", response_model=LoanActionResponse)
 def request_loan(payload: LoanRequest, user: UserContext = Depends(get_current_user)):
     # Calculate user's borrowing limit (75% of total contributions)
-    borrowing_limit = _calculate_user_borrowing_limit(user.id)
-    current_loan_balance = _get_user_current_loan_balance(user.id)
+    borrowing_limit = calculate_borrowing_limit(user.id)
+    current_loan_balance = calculate_loan_balance(user.id)
     
     # Check if requested amount exceeds available credit
     available_credit = borrowing_limit - current_loan_balance
@@ -90,6 +109,7 @@ def request_loan(payload: LoanRequest, user: UserContext = Depends(get_current_u
     weekly_payment = (payload.amount / payload.duration_weeks).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
     insert = {
         'user_id': user.id,
+        'family_id': user.family_id,
         'amount': float(payload.amount),
         'status': 'pending',
         'reason': payload.reason,
@@ -103,13 +123,13 @@ def request_loan(payload: LoanRequest, user: UserContext = Depends(get_current_u
     row = res.data[0]
     return LoanActionResponse(id=row['id'], status=row['status'], amount=Decimal(str(row['amount'])), remaining_balance=Decimal(str(row['remaining_balance'])), weekly_payment=Decimal(str(row['weekly_payment'])))
 
-@router.post("/{loan_id}/approve", response_model=LoanActionResponse, dependencies=[Depends(require_admin)])
-def approve_loan(loan_id: str):
-    loan = _fetch_loan(loan_id)
+@router.post("/{loan_id}/approve", response_model=LoanActionResponse)
+def approve_loan(loan_id: str, user: UserContext = Depends(require_admin)):
+    loan = _fetch_loan(loan_id, user.family_id)
     if loan['status'] != 'pending':
         raise HTTPException(status_code=400, detail="Loan not pending")
     update = {'status': 'approved', 'approved_at': datetime.utcnow().isoformat()}
-    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).execute()
+    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).eq('family_id', user.family_id).execute()
     
     # Update user totals after loan approval
     update_user_totals_after_loan_change(loan['user_id'])
@@ -117,24 +137,24 @@ def approve_loan(loan_id: str):
     row = res.data[0]
     return LoanActionResponse(id=row['id'], status=row['status'], amount=Decimal(str(row['amount'])), remaining_balance=Decimal(str(row['remaining_balance'])), weekly_payment=Decimal(str(row['weekly_payment'])))
 
-@router.post("/{loan_id}/reject", response_model=LoanActionResponse, dependencies=[Depends(require_admin)])
-def reject_loan(loan_id: str):
-    loan = _fetch_loan(loan_id)
+@router.post("/{loan_id}/reject", response_model=LoanActionResponse)
+def reject_loan(loan_id: str, user: UserContext = Depends(require_admin)):
+    loan = _fetch_loan(loan_id, user.family_id)
     if loan['status'] != 'pending':
         raise HTTPException(status_code=400, detail="Loan not pending")
     update = {'status': 'rejected', 'rejected_at': datetime.utcnow().isoformat()}
-    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).execute()
+    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).eq('family_id', user.family_id).execute()
     row = res.data[0]
     return LoanActionResponse(id=row['id'], status=row['status'], amount=Decimal(str(row['amount'])))
 
 @router.post("/{loan_id}/cancel")
 def cancel_loan(loan_id: str, user: UserContext = Depends(get_current_user)):
-    loan = _fetch_loan(loan_id)
+    loan = _fetch_loan(loan_id, user.family_id)
     if user.role != 'admin' and loan['user_id'] != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     if loan['status'] not in ['pending']:
         raise HTTPException(status_code=400, detail="Only pending loans can be cancelled")
-    res = supabase_client.supabase.table('loans').update({'status': 'rejected', 'rejected_at': datetime.utcnow().isoformat()}).eq('id', loan_id).execute()
+    res = supabase_client.supabase.table('loans').update({'status': 'rejected', 'rejected_at': datetime.utcnow().isoformat()}).eq('id', loan_id).eq('family_id', user.family_id).execute()
     
     # Update user totals after loan cancellation
     update_user_totals_after_loan_change(loan['user_id'])
@@ -147,7 +167,7 @@ def loan_payment(loan_id: str, payload: LoanPayment, user: UserContext = Depends
     amount = payload.amount
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid amount")
-    loan = _fetch_loan(loan_id)
+    loan = _fetch_loan(loan_id, user.family_id)
     if user.role != 'admin' and loan['user_id'] != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     if loan['status'] != 'approved':
@@ -161,11 +181,12 @@ def loan_payment(loan_id: str, payload: LoanPayment, user: UserContext = Depends
     supabase_client.supabase.table('loan_payments').insert({
         'loan_id': loan_id,
         'user_id': loan['user_id'],
+        'family_id': user.family_id,
         'amount': float(amount),
         'payment_date': datetime.utcnow().isoformat()
     }).execute()
     # Update the loan
-    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).execute()
+    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).eq('family_id', user.family_id).execute()
     
     # Update user totals after loan payment
     update_user_totals_after_payment(loan['user_id'], loan_id)
@@ -175,8 +196,81 @@ def loan_payment(loan_id: str, payload: LoanPayment, user: UserContext = Depends
 
 @router.get("/{loan_id}/payments")
 def list_payments(loan_id: str, user: UserContext = Depends(get_current_user)):
-    loan = _fetch_loan(loan_id)
+    loan = _fetch_loan(loan_id, user.family_id)
     if user.role != 'admin' and loan['user_id'] != user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     res = supabase_client.supabase.table('loan_payments').select('*').eq('loan_id', loan_id).execute()
-    return res.data
+    return FastJSONResponse(res.data)
+
+@router.put("/{loan_id}/interest")
+def set_loan_interest(loan_id: str, payload: LoanInterestSettings, user: UserContext = Depends(require_admin)):
+    """
+    Set a loan's interest rate and compounding. On an approved loan the new
+    terms apply from today: the days up to yesterday are first charged at the
+    old terms, so a rate is never charged retroactively.
+    """
+    loan = _fetch_loan(loan_id, user.family_id)
+    if loan['status'] not in ('pending', 'approved'):
+        raise HTTPException(status_code=400, detail="Interest can only be set on pending or approved loans")
+    update = {'interest_rate': float(payload.interest_rate), 'interest_compounding': payload.interest_compounding}
+    if loan['status'] == 'approved':
+        yesterday = datetime.utcnow().date() - timedelta(days=1)
+        through = amortization.parse_date(loan.get('interest_accrued_through'))
+        changed = (Decimal(str(loan.get('interest_rate') or 0)) != payload.interest_rate
+                   or (loan.get('interest_compounding') or 'none') != payload.interest_compounding)
+        if changed:
+            # Accrual skips interest-free loans without moving their date, so the gap is settled here
+            interest.settle_loan(loan, yesterday)
+        if changed or through is None:
+            update['interest_accrued_through'] = max(through or yesterday, yesterday).isoformat()
+    res = supabase_client.supabase.table('loans').update(update).eq('id', loan_id).eq('family_id', user.family_id).execute()
+    row = res.data[0]
+    return {
+        'id': row['id'],
+        'status': row['status'],
+        'interest_rate': row.get('interest_rate'),
+        'interest_compounding': row.get('interest_compounding'),
+        'interest_accrued_through': row.get('interest_accrued_through'),
+    }
+
+@router.get("/{loan_id}/interest")
+def list_interest_accruals(loan_id: str, user: UserContext = Depends(get_current_user)):
+    """Interest ledger of a loan, oldest period first."""
+    loan = _fetch_loan(loan_id, user.family_id)
+    if user.role != 'admin' and loan['user_id'] != user.id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    res = supabase_client.supabase.table('loan_interest_accruals').select('*').eq('loan_id', loan_id).order('period_end').execute()
+    return FastJSONResponse(res.data)
+
+@router.get("/{loan_id}/schedule", response_model=LoanScheduleOut)
+def loan_schedule(loan_id: str, user: UserContext = Depends(get_current_user)):
+    """Weekly schedule: instalments, payments made, arrears, and projected balance until payoff."""
+    loan = _fetch_loan(loan_id, user.family_id)
+    if user.role != 'admin' and loan['user_id'] != user.id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    payments = supabase_client.supabase.table('loan_payments').select('amount, payment_date, created_at').eq('loan_id', loan_id).execute().data or []
+    today = datetime.utcnow().date()
+    schedule = amortization.build_schedule(loan, payments, today)
+    for key in ('amount', 'weekly_payment', 'paid_to_date', 'remaining_balance', 'arrears'):
+        schedule[key] = cents_to_decimal(schedule[key])
+    for row in schedule['schedule']:
+        for key in ('scheduled_payment', 'scheduled_balance', 'payment', 'balance', 'arrears'):
+            row[key] = cents_to_decimal(row[key])
+    return typed_response(LoanScheduleOut, dict(schedule, loan_id=loan_id, status=loan['status'], as_of=today))
+
+@router.post("/{loan_id}/simulate", response_model=LoanSimulationOut)
+def simulate_loan(loan_id: str, payload: LoanSimulationRequest, user: UserContext = Depends(get_current_user)):
+    """What-if payoff for extra, lump-sum or skipped payments; all scenarios are projected in one pass."""
+    loan = _fetch_loan(loan_id, user.family_id)
+    if user.role != 'admin' and loan['user_id'] != user.id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    payments = supabase_client.supabase.table('loan_payments').select('amount, payment_date, created_at').eq('loan_id', loan_id).execute().data or []
+    today = datetime.utcnow().date()
+    result = amortization.simulate(loan, payments, [_scenario_cents(s) for s in payload.scenarios], today, payload.include_balances)
+    return typed_response(LoanSimulationOut, {
+        'loan_id': loan_id,
+        'as_of': today,
+        'remaining_balance': cents_to_decimal(result['remaining_balance']),
+        'baseline': _scenario_out(result['baseline']),
+        'scenarios': [_scenario_out(r) for r in result['scenarios']],
+    })
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from datetime import date, timedelta
+from dependencies import get_current_user, require_admin, require_same_family, UserContext
+import statements
+
+router = APIRouter(prefix="/statements", tags=["statements"])
+
+FORMAT_PATTERN = '^(csv|html)$'
+
+def _last_month() -> str:
+    return (date.today().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+def _period(month: str | None) -> tuple:
+    try:
+        return statements.month_period(month or _last_month())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+
+def _statement_response(user_id: str, family_id: str, month: str | None, format: str) -> Response:
+    start, end = _period(month)
+    text = statements.member_statement(user_id, start, end, format, family_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    filename = statements.statement_filename(user_id, start, format)
+    disposition = 'attachment' if format == 'csv' else 'inline'
+    return Response(content=text, media_type=statements.FORMATS[format],
+                    headers={'Content-Disposition': f'{disposition}; filename="{filename}"'})
+
+@router.get("/me")
+def my_statement(month: str | None = Query(default=None, description="YYYY-MM (default last month)"),
+                 format: str = Query(default='html', pattern=FORMAT_PATTERN),
+                 user: UserContext = Depends(get_current_user)):
+    """The signed-in member's statement for a month."""
+    return _statement_response(user.id, user.family_id, month, format)
+
+@router.get("/archive")
+def statements_archive(month: str | None = Query(default=None, description="YYYY-MM (default last month)"),
+                       format: str = Query(default='html', pattern=FORMAT_PATTERN),
+                       user: UserContext = Depends(require_admin)):
+    """Every family member's statement for a month as a zip (rendered now unless POST /admin/statements already did)."""
+    start, end = _period(month)
+    rendered = statements.period_statements(start, end, format, user.family_id)
+    return Response(content=statements.statements_zip(rendered, start, format), media_type='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="statements-{start:%Y-%m}-{format}.zip"'})
+
+@router.get("/{user_id}")
+def member_statement(user_id: str,
+                     month: str | None = Query(default=None, description="YYYY-MM (default last month)"),
+                     format: str = Query(default='html', pattern=FORMAT_PATTERN),
+                     user: UserContext = Depends(get_current_user)):
+    """A member's statement for a month (admins, or the member themselves)."""
+    if user.role != 'admin' and user.id != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    require_same_family(user, user_id)
+    return _statement_response(user_id, user.family_id, month, format)
@@ -1,23 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
-from datetime import datetime, timezone
-from decimal import Decimal, ROUND_HALF_UP
+from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import date, datetime, timezone
+from decimal import Decimal
 from dependencies import get_current_user, UserContext
 import supabase_client
 from models import StatsMeOut
+from aggregation import cents_to_decimal
+from db_utils import totals_queue
+from ledger import ledger_cutoff, position_as_of
 
 router = APIRouter(prefix="/stats", tags=["stats"])
 
-def _calculate_user_borrowing_limit(user_id: str, total_contributed: Decimal) -> Decimal:
-    """Calculate borrowing limit based on user's borrow_limit_percent and total contributions"""
-    # Get user's borrow_limit_percent setting
+def _borrow_limit_percent(user_id: str) -> Decimal:
+    """User's borrow_limit_percent setting"""
     user_res = supabase_client.supabase.table('users').select('borrow_limit_percent').eq('id', user_id).execute()
     
     if not user_res.data:
-        borrow_limit_percent = Decimal('75.0')  # Default fallback
-    else:
-        borrow_limit_percent = Decimal(str(user_res.data[0].get('borrow_limit_percent', 75.0)))
-    
-    return (total_contributed * (borrow_limit_percent / Decimal('100'))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return Decimal('75.0')  # Default fallback
+    return Decimal(str(user_res.data[0].get('borrow_limit_percent', 75.0)))
+
+def _calculate_user_borrowing_limit(user_id: str, total_contributed: Decimal) -> Decimal:
+    """Calculate borrowing limit based on user's borrow_limit_percent and total contributions"""
+    borrow_limit_percent = _borrow_limit_percent(user_id)
+    return (total_contributed * (borrow_limit_percent / Decimal('100'))).quantize(Decimal('0.01'))
 
 def _get_user_current_loan_balance(user_id: str) -> Decimal:
     """Get user's current outstanding loan balance"""
@@ -29,7 +33,10 @@ def _get_user_current_loan_balance(user_id: str) -> Decimal:
     return Decimal(str(total_balance))
 
 @router.get("/me", response_model=StatsMeOut)
-def stats_me(user: UserContext = Depends(get_current_user)):
+def stats_me(as_of: date | None = Query(default=None, description="Stats as they stood at the end of this day"),
+             user: UserContext = Depends(get_current_user)):
+    # Stored totals must reflect this member's own queued updates
+    totals_queue.flush_user(user.id)
     # Fetch profile
     prof_res = supabase_client.supabase.table('profiles').select('*').eq('id', user.id).execute()
     if not prof_res.data:
@@ -48,9 +55,19 @@ def stats_me(user: UserContext = Depends(get_current_user)):
     weekly = Decimal(str(profile.get('weekly_contribution') or 0))
     total_contributed = Decimal(str(profile.get('total_contributed') or 0))
     
-    # Calculate borrowing limit as 75% of total contributions
-    calculated_borrowing_limit = _calculate_user_borrowing_limit(user.id, total_contributed)
-    current_loan_balance = _get_user_current_loan_balance(user.id)
+    available_credit = None
+    if as_of:
+        # Point-in-time figures from the member ledger (see ledger.py)
+        position = position_as_of(user.id, as_of)
+        percent = _borrow_limit_percent(user.id)
+        total_contributed = cents_to_decimal(position.total_contributed)
+        current_loan_balance = cents_to_decimal(position.loan_balance)
+        calculated_borrowing_limit = cents_to_decimal(position.borrowing_limit(percent))
+        available_credit = cents_to_decimal(position.available_credit(percent))
+    else:
+        # Calculate borrowing limit as 75% of total contributions
+        calculated_borrowing_limit = _calculate_user_borrowing_limit(user.id, total_contributed)
+        current_loan_balance = _get_user_current_loan_balance(user.id)
 
     # Weeks active
     joined_raw = profile.get('joined_at')
@@ -58,7 +75,7 @@ def stats_me(user: UserContext = Depends(get_current_user)):
         joined_at = datetime.fromisoformat(joined_raw.replace('Z', '+00:00')) if isinstance(joined_raw, str) else datetime.now(timezone.utc)
     except Exception:
         joined_at = datetime.now(timezone.utc)
-    now = datetime.now(timezone.utc)
+    now = ledger_cutoff(as_of) if as_of else datetime.now(timezone.utc)
     delta_days = max((now - joined_at).days, 0)
     weeks_active = max(delta_days // 7, 1)
 
@@ -74,5 +91,7 @@ def stats_me(user: UserContext = Depends(get_current_user)):
         actual_total=total_contributed,
         deficiency=deficiency,
         current_loan_balance=current_loan_balance,
-        borrowing_limit=calculated_borrowing_limit
+        borrowing_limit=calculated_borrowing_limit,
+        available_credit=available_credit,
+        as_of=as_of
     )
@@ -1,45 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException
-from dependencies import get_current_user, require_admin, UserContext
+from fastapi import APIRouter, Depends, HTTPException, Query
+from postgrest.exceptions import APIError
+from dependencies import get_current_user, require_admin, require_same_family, UserContext
 import supabase_client
 from models import UserCreate, UserOut, UserUpdate
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from aggregation import FundAggregator, format_cents
+from db_utils import calculate_borrowing_limit, calculate_loan_balance, totals_queue
+from ledger import ledger_cutoff, position_as_of, positions_as_of
+from fast_json import FastJSONResponse
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-def _calculate_user_borrowing_limit(user_id: str) -> Decimal:
-    """Calculate borrowing limit based on user's borrow_limit_percent and total paid contributions"""
-    # Get user's borrow_limit_percent setting
-    user_res = supabase_client.supabase.table('users').select('borrow_limit_percent').eq('id', user_id).execute()
-    
-    if not user_res.data:
-        return Decimal('0.00')
-    
-    borrow_limit_percent = Decimal(str(user_res.data[0].get('borrow_limit_percent', 75.0)))
-    
-    # Get user's total paid contributions
-    contrib_res = supabase_client.supabase.table('contributions').select('amount').eq('user_id', user_id).eq('status', 'paid').execute()
-    
-    total_contributed = Decimal('0.00')
-    if contrib_res.data:
-        total_contributed = sum(Decimal(str(contrib.get('amount', 0))) for contrib in contrib_res.data)
-    
-    # Calculate borrowing limit using user's configurable percentage
-    borrowing_limit = (total_contributed * (borrow_limit_percent / Decimal('100'))).quantize(Decimal('0.01'))
-    
-    return borrowing_limit
+# Cleared when the database has no member_totals() (011_member_totals.sql)
+_server_totals = True
 
-def _get_user_current_loan_balance(user_id: str) -> Decimal:
-    """Get user's current outstanding loan balance"""
-    res = supabase_client.supabase.table('loans').select('remaining_balance').eq('user_id', user_id).eq('status', 'approved').execute()
-    if not res.data:
-        return Decimal('0.00')
-    
-    total_balance = sum((Decimal(str(loan.get('remaining_balance', 0))) for loan in res.data), Decimal('0.00'))
-    return total_balance
+def _family_totals(family_id: str, member_ids: list) -> FundAggregator:
+    """
+    Completed contributions and approved loan balances per member, summed by
+    member_totals() in the database; without that function the family's rows
+    are fetched as two-column CSV bodies and folded here (see aggregation.py).
+    """
+    global _server_totals
+    agg = FundAggregator(member_ids)
+    if _server_totals:
+        try:
+            rows = supabase_client.supabase.rpc('member_totals', {'p_family_id': family_id}).execute().data or []
+        except APIError as exc:
+            if exc.code not in ('42883', 'PGRST202'):
+                raise
+            _server_totals = False
+        else:
+            agg.add_contributions(rows, 'total_contributed')
+            agg.add_loans(rows, 'loan_balance')
+            return agg
+    # Use 'completed' which matches enum in schema (pending, completed, late, missed)
+    agg.add_contributions(supabase_client.supabase.table('contributions').select('user_id, amount')
+                          .eq('family_id', family_id).eq('status', 'completed').csv().execute().data)
+    agg.add_loans(supabase_client.supabase.table('loans').select('user_id, remaining_balance')
+                  .eq('family_id', family_id).eq('status', 'approved').csv().execute().data)
+    return agg
+
+def _ledger_fields(position, percent, as_of: date) -> dict:
+    """Point-in-time totals from the member ledger (see ledger.py)."""
+    default = Decimal(str(percent)) if percent is not None else None
+    return {
+        'total_contributed': format_cents(position.total_contributed),
+        'current_loan_balance': format_cents(position.loan_balance),
+        'borrowing_limit': format_cents(position.borrowing_limit(default)),
+        'available_credit': format_cents(position.available_credit(default)),
+        'as_of': as_of,
+    }
+
+def _limit_percent(user_id: str):
+    res = supabase_client.supabase.table('users').select('borrow_limit_percent').eq('id', user_id).execute()
+    return res.data[0].get('borrow_limit_percent') if res.data else None
 
 @router.get("/me", response_model=UserOut)
-def get_me(user: UserContext = Depends(get_current_user)):
+def get_me(as_of: date | None = Query(default=None, description="Totals as they stood at the end of this day"),
+           user: UserContext = Depends(get_current_user)):
+    # Stored totals must reflect this member's own queued updates
+    totals_queue.flush_user(user.id)
     data = supabase_client.supabase.table('profiles').select('*').eq('id', user.id).execute().data
     profile = data[0] if data else {
         'id': user.id,
@@ -52,13 +73,15 @@ def get_me(user: UserContext = Depends(get_current_user)):
     }
     
     # Calculate real-time borrowing limit and current loan balance instead of using stored values
-    calculated_borrowing_limit = _calculate_user_borrowing_limit(user.id)
-    calculated_loan_balance = _get_user_current_loan_balance(user.id)
+    calculated_borrowing_limit = calculate_borrowing_limit(user.id)
+    calculated_loan_balance = calculate_loan_balance(user.id)
     
     # Override stored values with calculated ones
     profile['borrowing_limit'] = str(calculated_borrowing_limit)
     profile['current_loan_balance'] = str(calculated_loan_balance)
     profile['email'] = user.email
+    if as_of:
+        profile.update(_ledger_fields(position_as_of(user.id, as_of), _limit_percent(user.id), as_of))
     return profile
 
 @router.post("/signout")
@@ -75,68 +98,48 @@ def signout():
         "message": "Successfully signed out"
     }
 
-@router.get("", dependencies=[Depends(require_admin)])
-def list_users():
-    """List all users enriched with current business logic derived fields.
+@router.get("")
+def list_users(as_of: date | None = Query(default=None, description="Totals as they stood at the end of this day"),
+               admin: UserContext = Depends(require_admin)):
+    """List the users of the admin's family enriched with current business logic derived fields.
 
     Business rules applied per user:
-      - total_contributed: sum of paid contributions (contributions.status = 'paid')
+      - total_contributed: sum of completed contributions (contributions.status = 'completed')
       - borrowing_limit: user's borrow_limit_percent of total_contributed (rounded to 2 decimals)
       - current_loan_balance: aggregate remaining_balance of approved loans
     Stored columns are not trusted for these derived values; they are recalculated live.
+    With ``as_of`` the totals come from the member ledger instead.
     """
-    users_res = supabase_client.supabase.table('users').select('*').execute()
+    family_id = admin.family_id
+    users_res = supabase_client.supabase.table('users').select('*').eq('family_id', family_id).execute()
     users = users_res.data or []
+    if as_of:
+        positions = positions_as_of((u.get('id') for u in users), ledger_cutoff(as_of))
+        return FastJSONResponse([{**u, **_ledger_fields(positions[u.get('id')], u.get('borrow_limit_percent'), as_of)} for u in users])
 
-    # Pre-fetch contributions & loans to reduce per-user round trips (basic optimization)
-    # Use 'completed' which matches enum in schema (pending, completed, late, missed)
-    contrib_res = supabase_client.supabase.table('contributions').select('user_id, amount, status').eq('status', 'completed').execute()
-    loan_res = supabase_client.supabase.table('loans').select('user_id, remaining_balance, status').eq('status', 'approved').execute()
-
-    from decimal import Decimal
-    from collections import defaultdict
-
-    paid_contrib_sum = defaultdict(lambda: Decimal('0.00'))
-    if contrib_res.data:
-        for c in contrib_res.data:
-            try:
-                paid_contrib_sum[c.get('user_id')] += Decimal(str(c.get('amount', 0)))
-            except Exception:
-                continue
-
-    loan_balance_sum = defaultdict(lambda: Decimal('0.00'))
-    if loan_res.data:
-        for l in loan_res.data:
-            try:
-                loan_balance_sum[l.get('user_id')] += Decimal(str(l.get('remaining_balance', 0)))
-            except Exception:
-                continue
+    agg = _family_totals(family_id, [user.get('id') for user in users])
+    percents = {u.get('id'): u['borrow_limit_percent'] for u in users if u.get('borrow_limit_percent') is not None}
+    totals = {t.id: t for t in agg.results(percents)}
 
     enriched = []
     for user in users:
-        uid = user.get('id')
-        total_contributed = paid_contrib_sum[uid]
-        
-        # Get user's borrow_limit_percent for dynamic calculation
-        borrow_limit_percent = Decimal(str(user.get('borrow_limit_percent', 75.0)))
-        borrowing_limit = (total_contributed * (borrow_limit_percent / Decimal('100'))).quantize(Decimal('0.01'))
-        
-        current_loan_balance = loan_balance_sum[uid]
+        t = totals[user.get('id')]
         # Preserve original user fields and override / add derived ones as strings for JSON compatibility
         enriched.append({
             **user,
-            'total_contributed': str(total_contributed),
-            'borrow_limit_percent': str(borrow_limit_percent),
-            'current_loan_balance': str(current_loan_balance),
+            'total_contributed': format_cents(t.total_contributed),
+            'borrow_limit_percent': str(t.borrow_limit_percent),
+            'current_loan_balance': format_cents(t.current_loan_balance),
         })
 
-    return enriched
+    return FastJSONResponse(enriched)
 
-@router.post("", dependencies=[Depends(require_admin)], response_model=UserOut)
-def create_user(payload: UserCreate):
+@router.post("", response_model=UserOut)
+def create_user(payload: UserCreate, admin: UserContext = Depends(require_admin)):
     # Phase 1: only create profile row (auth user creation later)
     insert = {
         'id': payload.email,  # TEMP placeholder id (replace with auth user id once real signup)
+        'family_id': admin.family_id,
         'full_name': payload.full_name,
         'role': payload.role,
         'weekly_contribution': payload.weekly_contribution or 0,
@@ -149,8 +152,8 @@ def create_user(payload: UserCreate):
     out['email'] = payload.email
     return out
 
-@router.patch("/{user_id}", dependencies=[Depends(require_admin)], response_model=UserOut)
-def update_user(user_id: str, payload: UserUpdate):
+@router.patch("/{user_id}", response_model=UserOut)
+def update_user(user_id: str, payload: UserUpdate, admin: UserContext = Depends(require_admin)):
     update_fields = {k: v for k, v in payload.dict(exclude_unset=True).items() if v is not None}
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
@@ -160,16 +163,40 @@ def update_user(user_id: str, payload: UserUpdate):
         if isinstance(value, Decimal):
             update_fields[key] = float(value)
     
-    res = supabase_client.supabase.table('users').update(update_fields).eq('id', user_id).execute()
+    res = supabase_client.supabase.table('users').update(update_fields).eq('id', user_id).eq('family_id', admin.family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="User not found")
     return res.data[0]
 
 @router.get("/{user_id}", response_model=UserOut)
-def get_user(user_id: str, user: UserContext = Depends(get_current_user)):
+def get_user(user_id: str, as_of: date | None = Query(default=None, description="Totals as they stood at the end of this day"),
+             user: UserContext = Depends(get_current_user)):
     if user.role != 'admin' and user.id != user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    res = supabase_client.supabase.table('users').select('*').eq('id', user_id).execute()
+    res = supabase_client.supabase.table('users').select('*').eq('id', user_id).eq('family_id', user.family_id).execute()
     if not res.data:
         raise HTTPException(status_code=404, detail="User not found")
-    return res.data[0]
+    row = res.data[0]
+    if as_of:
+        row.update(_ledger_fields(position_as_of(user_id, as_of), row.get('borrow_limit_percent'), as_of))
+    return row
+
+@router.get("/{user_id}/ledger")
+def get_user_ledger(
+    user_id: str,
+    start: date | None = Query(default=None),
+    end: date | None = Query(default=None),
+    limit: int = Query(default=500, ge=1, le=5000),
+    user: UserContext = Depends(get_current_user),
+):
+    """A member's ledger events in order of occurrence, optionally between two dates (inclusive)."""
+    if user.role != 'admin' and user.id != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if user.id != user_id:
+        require_same_family(user, user_id)
+    query = supabase_client.supabase.table('ledger_events').select('*').eq('user_id', user_id)
+    if start:
+        query = query.gte('occurred_at', ledger_cutoff(start - timedelta(days=1)).isoformat())
+    if end:
+        query = query.lt('occurred_at', ledger_cutoff(end).isoformat())
+    return FastJSONResponse(query.order('occurred_at').order('id').limit(limit).execute().data)
@@ -0,0 +1,324 @@
+"""
+Monthly member statements rendered as CSV or HTML.
+
+A statement covers one period, normally a calendar month:
+  * contributions due in the period and their status
+  * loans, payments and interest charged in the period
+  * opening and closing contribution totals and loan balances
+  * the borrowing limit, available credit and deficiency at period end
+Opening and closing figures come from the member ledger (ledger.py), so
+they are what the books said at those times, not today's totals.
+
+One run reads everything for the period with a handful of family-wide
+queries (paged, see batch.py), groups the rows per member and renders the
+statements in a process pool. Rendered statements are cached per family,
+period and format in a :class:`data_cache.VersionedCache`; a write to any
+table a statement reads invalidates that family's statements.
+
+Configuration (environment):
+  STATEMENT_WORKERS   render processes (default: CPU count); 1 renders inline
+
+Command line:
+  python backend/statements.py --month 2026-09 --format html --output statements/
+  python backend/statements.py --month 2026-09 --family <family uuid>
+"""
+
+import argparse
+import atexit
+import csv
+import html
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import repeat
+
+import batch
+from aggregation import format_cents, percent_of_cents, to_cents
+from data_cache import DEFAULT_TTL, VersionedCache, table_versions
+
+FORMATS = {'csv': 'text/csv', 'html': 'text/html'}
+STATEMENT_TABLES = ('profiles', 'users', 'contributions', 'loans', 'loan_payments', 'loan_interest_accruals', 'ledger_events')
+# Rendering is ~0.05 ms per statement; below this many members shipping
+# bundles to other processes costs more than it saves
+MIN_PARALLEL_MEMBERS = 2000
+RENDER_CHUNK = 250
+
+_cache = VersionedCache(table_versions, ttl=DEFAULT_TTL, max_entries=64)
+
+def default_workers() -> int:
+    return max(int(os.getenv('STATEMENT_WORKERS', '0')) or os.cpu_count() or 1, 1)
+
+def month_period(month: str) -> tuple:
+    """'YYYY-MM' to (first day, last day). Raises ValueError for anything else."""
+    first = datetime.strptime(month, '%Y-%m').date()
+    following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first, following - timedelta(days=1)
+
+# Data ----------------------------------------------------------------------
+
+def _rows(client, table: str, columns: str, filters: list) -> list:
+    out = []
+    for page in batch.iter_pages(client, table, columns, filters=filters):
+        out.extend(page)
+    return out
+
+def fetch_period(start: date, end: date, user_ids: list | None = None, family_id: str | None = None) -> list:
+    """
+    One bundle per member with everything its statement needs, read with
+    family-wide queries (every family without ``family_id``; ``user_ids``
+    narrows them for single statements).
+    """
+    # Imported here so render processes never build a database client
+    import supabase_client
+    from ledger import ledger_cutoff, positions_as_of
+
+    client = supabase_client.supabase
+    family_scope = [('eq', 'family_id', family_id)] if family_id else []
+    scope = family_scope + ([('in_', 'user_id', user_ids)] if user_ids else [])
+    id_scope = family_scope + ([('in_', 'id', user_ids)] if user_ids else [])
+    end_cutoff = ledger_cutoff(end)
+
+    profiles = _rows(client, 'profiles', 'id, full_name, weekly_contribution, joined_at', id_scope)
+    percents = {u['id']: u.get('borrow_limit_percent') for u in _rows(client, 'users', 'id, borrow_limit_percent', id_scope)}
+    contributions = _rows(client, 'contributions', 'id, user_id, period_year, period_week, due_date, amount, status, paid_at, late_fee',
+                          scope + [('gte', 'due_date', start.isoformat()), ('lte', 'due_date', end.isoformat())])
+    loans = _rows(client, 'loans', 'id, user_id, amount, status, duration_weeks, weekly_payment, remaining_balance, approved_at',
+                  scope + [('in_', 'status', ['pending', 'approved', 'paid'])])
+    payments = _rows(client, 'loan_payments', 'id, user_id, loan_id, amount, payment_date',
+                     scope + [('gte', 'payment_date', ledger_cutoff(start - timedelta(days=1)).isoformat()),
+                              ('lt', 'payment_date', end_cutoff.isoformat())])
+    interest = _rows(client, 'loan_interest_accruals', 'id, user_id, loan_id, period_key, period_end, amount',
+                     scope + [('gte', 'period_end', start.isoformat()), ('lte', 'period_end', end.isoformat())])
+
+    ids = [p['id'] for p in profiles]
+    opening = positions_as_of(ids, ledger_cutoff(start - timedelta(days=1)))
+    closing = positions_as_of(ids, end_cutoff)
+
+    bundles = {p['id']: {
+        'member': dict(p, borrow_limit_percent=percents.get(p['id'])),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'opening': {'contributed': opening[p['id']].total_contributed, 'loan_balance': opening[p['id']].loan_balance},
+        'closing': {'contributed': closing[p['id']].total_contributed, 'loan_balance': closing[p['id']].loan_balance},
+        'limit_percent': str(closing[p['id']].limit_percent) if closing[p['id']].limit_percent is not None else None,
+        'contributions': [], 'loans': [], 'payments': [], 'interest': [],
+    } for p in profiles}
+    paid_loans = {p['loan_id'] for p in payments}
+    for key, rows in (('contributions', contributions), ('payments', payments), ('interest', interest)):
+        for row in rows:
+            if row.get('user_id') in bundles:
+                bundles[row['user_id']][key].append(row)
+    for loan in loans:
+        bundle = bundles.get(loan.get('user_id'))
+        approved = (loan.get('approved_at') or '')[:10]
+        # Paid loans only matter if they were repaid or disbursed this period
+        if bundle and (loan['status'] != 'paid' or loan['id'] in paid_loans or start.isoformat() <= approved <= end.isoformat()):
+            bundle['loans'].append(loan)
+    return list(bundles.values())
+
+# Statements ------------------------------------------------------------------
+
+def _cents(value) -> int:
+    return to_cents(value) or 0
+
+def build_statement(bundle: dict) -> dict:
+    """Summary figures (integer cents) and detail rows for one member."""
+    member = bundle['member']
+    start, end = date.fromisoformat(bundle['start']), date.fromisoformat(bundle['end'])
+    contributions = sorted(bundle['contributions'], key=lambda c: (c.get('due_date') or '', c.get('period_week') or 0))
+    payments = sorted(bundle['payments'], key=lambda p: p.get('payment_date') or '')
+    interest = sorted(bundle['interest'], key=lambda i: (i.get('period_end') or '', i.get('loan_id') or ''))
+
+    percent = bundle['limit_percent'] or member.get('borrow_limit_percent') or 75
+    closing_contributed = bundle['closing']['contributed']
+    closing_balance = bundle['closing']['loan_balance']
+    borrowing_limit = percent_of_cents(closing_contributed, percent)
+
+    joined = (member.get('joined_at') or '')[:10]
+    try:
+        weeks_active = max(((end - date.fromisoformat(joined)).days + 1) // 7, 1)
+    except ValueError:
+        weeks_active = 1
+    expected = _cents(member.get('weekly_contribution')) * weeks_active
+
+    due = sum(_cents(c.get('amount')) for c in contributions)
+    completed = sum(_cents(c.get('amount')) for c in contributions if c.get('status') == 'completed')
+    return {
+        'member_id': member['id'],
+        'member_name': member.get('full_name') or member['id'],
+        'start': start,
+        'end': end,
+        'summary': [
+            ('Contributions due this period', due),
+            ('Contributions completed this period', completed),
+            ('Late fees this period', sum(_cents(c.get('late_fee')) for c in contributions)),
+            ('Total contributed (opening)', bundle['opening']['contributed']),
+            ('Total contributed (closing)', closing_contributed),
+            ('Loan balance (opening)', bundle['opening']['loan_balance']),
+            ('Loans disbursed this period', sum(_cents(l.get('amount')) for l in bundle['loans']
+                                                if start.isoformat() <= (l.get('approved_at') or '')[:10] <= end.isoformat())),
+            ('Loan payments this period', sum(_cents(p.get('amount')) for p in payments)),
+            ('Interest charged this period', sum(_cents(i.get('amount')) for i in interest)),
+            ('Loan balance (closing)', closing_balance),
+            ('Borrowing limit', borrowing_limit),
+            ('Available credit', max(borrowing_limit - closing_balance, 0)),
+            ('Expected contributions to date', expected),
+            ('Deficiency', max(expected - closing_contributed, 0)),
+        ],
+        'tables': [
+            ('Contributions', ('Week', 'Due date', 'Amount', 'Status', 'Paid at', 'Late fee'),
+             [(f"{c.get('period_year')}-W{int(c.get('period_week') or 0):02d}", c.get('due_date'), format_cents(_cents(c.get('amount'))),
+               c.get('status'), (c.get('paid_at') or '')[:10], format_cents(_cents(c.get('late_fee')))) for c in contributions]),
+            ('Loans', ('Loan', 'Approved', 'Amount', 'Weekly payment', 'Status', 'Balance today'),
+             [(l['id'], (l.get('approved_at') or '')[:10], format_cents(_cents(l.get('amount'))), format_cents(_cents(l.get('weekly_payment'))),
+               l.get('status'), format_cents(_cents(l.get('remaining_balance')))) for l in bundle['loans']]),
+            ('Loan payments', ('Date', 'Loan', 'Amount'),
+             [((p.get('payment_date') or '')[:10], p.get('loan_id'), format_cents(_cents(p.get('amount')))) for p in payments]),
+            ('Interest', ('Period', 'Loan', 'Amount'),
+             [(i.get('period_key'), i.get('loan_id'), format_cents(_cents(i.get('amount')))) for i in interest]),
+        ],
+    }
+
+def render_csv(statement: dict) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Statement', statement['member_name'], statement['member_id']])
+    writer.writerow(['Period', statement['start'].isoformat(), statement['end'].isoformat()])
+    writer.writerow([])
+    writer.writerow(['Summary', 'Amount'])
+    for label, cents in statement['summary']:
+        writer.writerow([label, format_cents(cents)])
+    for title, header, rows in statement['tables']:
+        writer.writerow([])
+        writer.writerow([title])
+        writer.writerow(header)
+        writer.writerows(rows)
+    return out.getvalue()
+
+_HTML_STYLE = ('body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1.5em}'
+               'th,td{border:1px solid #ccc;padding:4px 8px;text-align:left}td.num{text-align:right}')
+
+def render_html(statement: dict) -> str:
+    e = html.escape
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8">',
+        f"<title>Statement {e(statement['member_name'])} {statement['start']:%Y-%m}</title>",
+        f'<style>{_HTML_STYLE}</style></head><body>',
+        f"<h1>{e(statement['member_name'])}</h1>",
+        f"<p>Statement for {statement['start'].isoformat()} to {statement['end'].isoformat()}</p>",
+        '<h2>Summary</h2><table>',
+    ]
+    parts.extend(f'<tr><th>{e(label)}</th><td class="num">{format_cents(cents)}</td></tr>' for label, cents in statement['summary'])
+    parts.append('</table>')
+    for title, header, rows in statement['tables']:
+        parts.append(f'<h2>{e(title)}</h2>')
+        if not rows:
+            parts.append('<p>None</p>')
+            continue
+        parts.append('<table><tr>' + ''.join(f'<th>{e(h)}</th>' for h in header) + '</tr>')
+        parts.extend('<tr>' + ''.join(f'<td>{e(str(v if v is not None else ""))}</td>' for v in row) + '</tr>' for row in rows)
+        parts.append('</table>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+_RENDERERS = {'csv': render_csv, 'html': render_html}
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """One render pool per process, started on first use (starting processes takes about a second)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: the API process runs threads, which fork does not copy safely
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+            atexit.register(_pool.shutdown, wait=False)
+        return _pool
+
+def _render_chunk(fmt: str, bundles: list) -> list:
+    render = _RENDERERS[fmt]
+    return [(b['member']['id'], render(build_statement(b))) for b in bundles]
+
+def render_bundles(bundles: list, fmt: str, workers: int | None = None) -> dict:
+    """member id -> rendered statement, fanned out over a process pool for large runs."""
+    workers = default_workers() if workers is None else workers
+    if workers <= 1 or len(bundles) < MIN_PARALLEL_MEMBERS:
+        return dict(_render_chunk(fmt, bundles))
+    chunks = [bundles[i:i + RENDER_CHUNK] for i in range(0, len(bundles), RENDER_CHUNK)]
+    out = {}
+    for part in _get_pool(workers).map(_render_chunk, repeat(fmt), chunks):
+        out.update(part)
+    return out
+
+# Cached entry points ---------------------------------------------------------
+
+def period_statements(start: date, end: date, fmt: str, family_id: str, workers: int | None = None) -> dict:
+    """Statements for every member of a family, rendered once per period and format until the data changes."""
+    return _cache.get_or_compute(('all', start, end, fmt), STATEMENT_TABLES,
+                                 lambda: render_bundles(fetch_period(start, end, family_id=family_id), fmt, workers),
+                                 family_id=family_id)
+
+def member_statement(user_id: str, start: date, end: date, fmt: str, family_id: str) -> str | None:
+    """One member's statement, from the period run if it is cached, else fetched for that member alone."""
+    def compute():
+        bundles = fetch_period(start, end, [user_id], family_id)
+        return _render_chunk(fmt, bundles)[0][1] if bundles else None
+    statements = _cache.peek(('all', start, end, fmt), STATEMENT_TABLES, family_id=family_id)
+    if statements is not None and user_id in statements:
+        return statements[user_id]
+    return _cache.get_or_compute(('member', user_id, start, end, fmt), STATEMENT_TABLES, compute, family_id=family_id)
+
+def statement_filename(user_id: str, start: date, fmt: str) -> str:
+    return f"statement-{start:%Y-%m}-{user_id}.{fmt}"
+
+def statements_zip(statements: dict, start: date, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for user_id, text in statements.items():
+            archive.writestr(statement_filename(user_id, start, fmt), text)
+    return buf.getvalue()
+
+def generate_statements(ctx, month: str, family_id: str, fmt: str = 'html') -> dict:
+    """Job body (see jobs.py): render (or reuse) the statement of every member of a family for ``month``."""
+    start, end = month_period(month)
+    ctx.set_message('rendering statements')
+    statements = period_statements(start, end, fmt, family_id)
+    return {
+        'month': month,
+        'format': fmt,
+        'members': len(statements),
+        'bytes': sum(len(s) for s in statements.values()),
+        'download_url': f"/statements/archive?month={month}&format={fmt}",
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--month', default=(date.today().replace(day=1) - timedelta(days=1)).strftime('%Y-%m'),
+                        help='YYYY-MM (default: last month)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='html')
+    parser.add_argument('--output', '-o', default='.', help='directory for the statement files')
+    parser.add_argument('--member', action='append', help='only these member ids (repeatable)')
+    parser.add_argument('--family', help='only members of this family (default: every family)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start, end = month_period(args.month)
+    statements = render_bundles(fetch_period(start, end, args.member, args.family), args.format, args.workers)
+    os.makedirs(args.output, exist_ok=True)
+    for user_id, text in statements.items():
+        with open(os.path.join(args.output, statement_filename(user_id, start, args.format)), 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(f"Wrote {len(statements)} statements for {args.month} to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,139 @@
+"""
+Storage client shared by the API, jobs and scripts.
+
+``supabase_client.supabase`` is created on first use, not at import: importing
+this module only reads the .env files, so the app, the scripts and anything
+that imports a router start without loading supabase-py / asyncpg or opening
+connections. The first attribute access (or :func:`get_client`) builds the
+client once, under a lock; later accesses are plain module attribute reads.
+A failed build is raised to the caller and retried on the next access. The
+app builds it during startup warm-up (see lifecycle.py).
+
+Configuration (environment):
+  DATA_BACKEND            'postgrest' (default, supabase-py) or 'postgres' (see pg_backend.py)
+  SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY   PostgREST backend credentials
+  DATABASE_URL            Postgres backend DSN
+  REPLICA_SUPABASE_URL / REPLICA_SUPABASE_KEY / REPLICA_DATABASE_URL   (optional) read replica (see read_routing.py)
+"""
+
+import logging
 import os
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from fastapi import HTTPException
+from data_layer import TracedClient
+import query_log  # registers the slow-query observer
+
+log = logging.getLogger(__name__)
+
+def load_env():
+    """Load backend/.env, then the repository's .env without overriding it."""
+    backend_env = os.path.join(os.path.dirname(__file__), '.env')
+    parent_env = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
+    if os.path.exists(backend_env):
+        load_dotenv(backend_env)
+    if os.path.exists(parent_env):
+        load_dotenv(parent_env, override=False)  # Don't override values from backend .env
+
+# Cheap, and modules that read their settings at import rely on it
+load_env()
+
+# Storage backend: PostgREST through supabase-py (default) or Postgres directly (see pg_backend.py)
+data_backend = os.getenv("DATA_BACKEND", "postgrest").lower()
+
+_lock = threading.Lock()
+
+def replica_configured() -> bool:
+    """Whether reads go through read_routing.RoutedClient, known without building the client."""
+    if data_backend == "postgres":
+        return bool(os.getenv("REPLICA_DATABASE_URL"))
+    return bool(os.getenv("REPLICA_SUPABASE_URL"))
+
+def _create() -> TracedClient:
+    if data_backend == "postgres":
+        from pg_backend import PostgresClient
+        client = PostgresClient.from_env()
+        replica_url = os.getenv("REPLICA_DATABASE_URL")
+        if replica_url:
+            # Reads routed to the replica with read-your-writes (see read_routing.py)
+            from read_routing import RoutedClient
+            replica = PostgresClient(replica_url, min_size=client.min_size, max_size=client.max_size,
+                                     statement_cache_size=client.statement_cache_size,
+                                     command_timeout=client.command_timeout)
+            client = RoutedClient.from_env(client, replica)
+        log.info("Postgres backend initialized", extra={'event': 'storage_client_created', 'backend': data_backend,
+                                                         'read_replica': bool(replica_url)})
+        # Same wrapper, so the slow-query log and cache versions see every query
+        return TracedClient(client)
+
+    # Get Supabase credentials from environment variables
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY. Set them in your environment (.env).")
+
+    # supabase-py (httpx, gotrue, realtime, storage) is the slowest import of the app
+    from supabase import create_client
+    try:
+        client = create_client(supabase_url, supabase_key)
+        replica_url = os.getenv("REPLICA_SUPABASE_URL")
+        if replica_url:
+            # Reads routed to the replica's PostgREST with read-your-writes (see read_routing.py)
+            from read_routing import RoutedClient
+            client = RoutedClient.from_env(client, create_client(replica_url, os.getenv("REPLICA_SUPABASE_KEY") or supabase_key))
+    except Exception:
+        log.exception("Error initializing Supabase client", extra={'event': 'storage_client_failed'})
+        raise
+    log.info("Supabase client initialized", extra={'event': 'storage_client_created', 'backend': data_backend,
+                                                    'read_replica': bool(replica_url)})
+    # Wrapped so every query is timed and attributed (see query_log.py)
+    return TracedClient(client)
+
+def get_client() -> TracedClient:
+    """The shared client, created on first call."""
+    global supabase
+    client = globals().get('supabase')
+    if client is not None:
+        return client
+    with _lock:
+        client = globals().get('supabase')
+        if client is None:
+            client = supabase = _create()
+    return client
+
+def initialized() -> bool:
+    return globals().get('supabase') is not None
+
+def close():
+    """Close the Postgres pools (app shutdown); the next access creates a new client."""
+    if data_backend != "postgres":
+        return  # supabase-py holds no pool worth closing
+    with _lock:
+        client = globals().pop('supabase', None)
+    if client is None:
+        return
+    raw = client.raw
+    for backend in (raw.primary, raw.replica) if hasattr(raw, 'replica') else (raw,):
+        backend.close()
 
-# Load environment variables - try both backend/.env and parent .env
-backend_env = os.path.join(os.path.dirname(__file__), '.env')
-parent_env = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
-
-# Load backend .env first (if it exists), then parent .env
-if os.path.exists(backend_env):
-    load_dotenv(backend_env)
-if os.path.exists(parent_env):
-    load_dotenv(parent_env, override=False)  # Don't override values from backend .env
-
-# Get Supabase credentials from environment variables
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not supabase_url or not supabase_key:
-    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY. Set them in your environment (.env).")
-
-# Initialize Supabase client
-try:
-    # Try without options first for supabase v2.x compatibility
-    supabase: Client = create_client(supabase_url, supabase_key)
-    print("Supabase client initialized successfully")
-except Exception as e:
-    print(f"Error initializing Supabase client: {e}")
-    supabase = None  # Set to None so we can check for it
-    # We don't want to raise an exception here as it would prevent the app from starting
-    # Instead, we'll handle the error when the client is used
+def __getattr__(name: str):
+    # Module attribute hook (PEP 562): ``supabase_client.supabase`` builds the client on first use
+    if name == 'supabase':
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def test_connection():
     """Test the Supabase connection and return the result."""
     try:
         # Simple query to check connectivity - try profiles table which should exist
-        response = supabase.table('profiles').select('id').limit(1).execute()
+        response = get_client().table('profiles').select('id').limit(1).execute()
         return {
             "success": True,
             "message": "Successfully connected to Supabase",
             "data": response.data
         }
     except Exception as e:
-        print(f"Supabase connection test failed: {e}")
+        log.warning("Supabase connection test failed: %s", e, extra={'event': 'connection_test_failed'})
         return {
             "success": False,
             "message": f"Failed to connect to Supabase: {str(e)}",
@@ -60,11 +151,11 @@ def get_user_by_id(user_id: str):
         User data or None if not found
     """
     try:
-        response = supabase.table('profiles').select('*').eq('id', user_id).execute()
+        response = get_client().table('profiles').select('*').eq('id', user_id).execute()
         
         if response.data and len(response.data) > 0:
             return response.data[0]
         return None
     except Exception as e:
-        print(f"Error fetching user: {e}")
+        log.exception("Error fetching user", extra={'event': 'get_user_failed', 'target_user_id': user_id})
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
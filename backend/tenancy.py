@@ -0,0 +1,104 @@
+"""
+Families (tenants) hosted on one deployment.
+
+Every member belongs to one family (``profiles.family_id``, see
+supabase/migrations/009_family_tenancy.sql) and their contributions, loans,
+payments and ledger events carry the same family_id. Admin endpoints read and
+change only their own family; member endpoints are scoped to the member and
+therefore to the family already. Writes name the family explicitly so the
+per-family cache namespaces (data_cache.py) stay isolated.
+
+The caller's family normally comes from the access token (``family_id`` from
+a custom access token hook, else ``app_metadata.family_id``, see auth.py).
+Tokens without one, and mock auth without an X-Family-Id header, fall back
+to the member's profile through :class:`FamilyDirectory`, a small TTL cache
+of member id -> family id. The same directory answers "is this member in
+the admin's family?" for endpoints that take a member id.
+
+Configuration (environment):
+  FAMILY_CACHE_SIZE   member -> family entries kept (default 4096)
+  DATA_CACHE_TTL      seconds an entry is trusted (default 300)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import supabase_client
+from data_cache import DEFAULT_TTL
+
+# Existing rows are assigned to this family by 009_family_tenancy.sql
+DEFAULT_FAMILY_ID = '00000000-0000-0000-0000-000000000001'
+
+class FamilyDirectory:
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # user_id -> (family_id, monotonic time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def family_of(self, user_id: str) -> str | None:
+        """The member's family, or None if there is no such member."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        res = supabase_client.supabase.table('profiles').select('family_id').eq('id', user_id).execute()
+        family_id = res.data[0].get('family_id') if res.data else None
+        if family_id is not None:
+            self.remember(user_id, family_id)
+        return family_id
+
+    def families_of(self, user_ids: list) -> dict:
+        """user_id -> family_id for the known members among ``user_ids``; one query for the uncached ones."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and now - entry[1] < self.ttl:
+                    found[user_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+        if missing:
+            rows = supabase_client.supabase.table('profiles').select('id, family_id').in_('id', missing).execute().data or []
+            for row in rows:
+                if row.get('family_id') is not None:
+                    found[row['id']] = row['family_id']
+                    self.remember(row['id'], row['family_id'])
+        return found
+
+    def remember(self, user_id: str, family_id: str):
+        with self._lock:
+            self._entries[user_id] = (family_id, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def info(self) -> dict:
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+directory = FamilyDirectory(max_entries=int(os.getenv('FAMILY_CACHE_SIZE', '4096')))
+
+def in_family(user_id: str, family_id: str) -> bool:
+    return directory.family_of(user_id) == family_id
+
+def family_members(family_id: str) -> list:
+    """Ids of every member of a family."""
+    rows = supabase_client.supabase.table('profiles').select('id').eq('family_id', family_id).execute().data or []
+    for row in rows:
+        directory.remember(row['id'], family_id)
+    return [row['id'] for row in rows]
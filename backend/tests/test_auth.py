@@ -0,0 +1,78 @@
+"""verify_token: what a Supabase access token must carry to be accepted (see auth.py)."""
+import base64
+import json
+import time
+
+import pytest
+from jose import jwt
+
+import auth
+
+SECRET = 'test-secret'
+USER_ID = '11111111-1111-4111-8111-111111111111'
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b'=').decode()
+
+def token(**claims) -> str:
+    payload = {'sub': USER_ID, 'aud': 'authenticated', 'exp': int(time.time()) + 3600, **claims}
+    return jwt.encode({k: v for k, v in payload.items() if v is not None}, SECRET, algorithm='HS256')
+
+@pytest.fixture(autouse=True)
+def hs256(monkeypatch):
+    monkeypatch.setenv('SUPABASE_JWT_SECRET', SECRET)
+    monkeypatch.delenv('JWT_AUDIENCE', raising=False)
+    auth.token_cache.clear()
+    yield
+    auth.token_cache.clear()
+
+def test_valid_token():
+    claims = auth.verify_token(token(family_id='f1'))
+    assert claims['sub'] == USER_ID
+    assert auth.family_from_claims(claims) == 'f1'
+
+def test_expired_token():
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(token(exp=int(time.time()) - 60))
+
+def test_token_without_exp():
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(token(exp=None))
+
+def test_token_without_sub():
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(token(sub=None))
+
+def test_wrong_audience():
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(token(aud='anon'))
+
+def test_wrong_secret():
+    forged = jwt.encode({'sub': USER_ID, 'aud': 'authenticated', 'exp': int(time.time()) + 3600}, 'other', algorithm='HS256')
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(forged)
+
+def test_alg_none():
+    unsigned = f"{_b64({'alg': 'none', 'typ': 'JWT'})}.{_b64({'sub': USER_ID, 'aud': 'authenticated', 'exp': int(time.time()) + 3600})}."
+    with pytest.raises(auth.AuthError):
+        auth.verify_token(unsigned)
+
+def test_unknown_kid(monkeypatch):
+    monkeypatch.setattr(auth.jwks_cache, 'get', lambda kid: None)
+    header = _b64({'alg': 'RS256', 'typ': 'JWT', 'kid': 'rotated-away'})
+    body = _b64({'sub': USER_ID, 'aud': 'authenticated', 'exp': int(time.time()) + 3600})
+    with pytest.raises(auth.AuthError, match='Unknown signing key'):
+        auth.verify_token(f"{header}.{body}.c2ln")
+
+def test_rejected_token_is_not_cached():
+    expired = token(exp=int(time.time()) - 60)
+    for _ in range(2):
+        with pytest.raises(auth.AuthError):
+            auth.verify_token(expired)
+    assert auth.token_cache.info()['entries'] == 0
+
+def test_operator_and_role_claims():
+    assert auth.operator_from_claims({'app_metadata': {'operator': True}})
+    assert not auth.operator_from_claims({'app_metadata': {'operator': 'yes'}})
+    assert not auth.operator_from_claims({})
+    assert auth.role_from_claims({'user_role': 'superuser'}) == 'member'
@@ -0,0 +1,61 @@
+"""Contribution calendar: per-family versions, writes applied in any order (see contribution_calendar.py)."""
+import pytest
+
+from contribution_calendar import LATE, ContributionCalendar, week_index
+from data_cache import table_versions
+
+FAMILY, OTHER = 'family-a', 'family-b'
+MEMBER = 'member-1'
+
+def _row(week, status='completed'):
+    return {'user_id': MEMBER, 'family_id': FAMILY, 'period_year': 2026, 'period_week': week,
+            'status': status, 'amount': 25}
+
+@pytest.fixture
+def calendar():
+    cal = ContributionCalendar()
+    cal.loads = []
+
+    def load(family_id, user_ids):
+        cal.loads.append(family_id)
+        rows = {}
+        cal._set(rows, _row(1))
+        return rows
+
+    cal._load = load
+    return cal
+
+def _write(cal, row, family_id=FAMILY):
+    """One router write: the data layer bumps the family's version, then the calendar applies the rows."""
+    table_versions.bump('contributions', family_id=family_id)
+    cal.apply([row], family_id)
+
+def test_applied_write_keeps_the_family(calendar):
+    calendar.member(MEMBER, FAMILY)
+    _write(calendar, _row(2, 'late'))
+    member = calendar.member(MEMBER, FAMILY)
+    assert member.get(week_index(2026, 2))[0] == LATE
+    assert calendar.loads == [FAMILY]
+
+def test_interleaved_writes_are_kept(calendar):
+    calendar.member(MEMBER, FAMILY)
+    table_versions.bump('contributions', family_id=FAMILY)
+    table_versions.bump('contributions', family_id=FAMILY)
+    calendar.apply([_row(3)], FAMILY)
+    calendar.apply([_row(2)], FAMILY)
+    member = calendar.member(MEMBER, FAMILY)
+    assert member.end == week_index(2026, 3) + 1
+    assert calendar.loads == [FAMILY]
+
+def test_another_familys_write_is_ignored(calendar):
+    calendar.member(MEMBER, FAMILY)
+    table_versions.bump('contributions', family_id=OTHER)
+    calendar.member(MEMBER, FAMILY)
+    assert calendar.loads == [FAMILY]
+
+@pytest.mark.parametrize('family_id', [FAMILY, None])
+def test_missed_write_reloads_the_family(calendar, family_id):
+    calendar.member(MEMBER, FAMILY)
+    table_versions.bump('contributions', family_id=family_id)
+    calendar.member(MEMBER, FAMILY)
+    assert calendar.loads == [FAMILY, FAMILY]
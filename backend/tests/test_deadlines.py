@@ -0,0 +1,68 @@
+"""Request deadlines: reads are cut short, a request that has written runs to the end (see deadlines.py)."""
+import pytest
+
+import data_layer
+import deadlines
+
+class _Query:
+    """Just enough of a query builder for TracedQuery."""
+
+    def __init__(self, log, table):
+        self.log, self.table = log, table
+
+    def select(self, *columns):
+        return self
+
+    def update(self, values):
+        self.op = 'update'
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        self.log.append((self.table, getattr(self, 'op', 'select')))
+        return type('Response', (), {'data': [{}]})()
+
+class _Client:
+    def __init__(self):
+        self.log = []
+
+    def table(self, name):
+        return _Query(self.log, name)
+
+    def rpc(self, name, params):
+        return _Query(self.log, name)
+
+@pytest.fixture
+def expired():
+    deadline = deadlines.Deadline(0)
+    token = deadlines._current.set(deadline)
+    yield deadline
+    deadlines._current.reset(token)
+
+def test_reads_refused_after_deadline(expired):
+    client = data_layer.TracedClient(_Client())
+    with pytest.raises(deadlines.DeadlineExceeded):
+        client.table('loans').select('*').execute()
+
+def test_first_write_refused_after_deadline(expired):
+    client = data_layer.TracedClient(_Client())
+    with pytest.raises(deadlines.DeadlineExceeded):
+        client.table('loans').update({}).eq('id', 1).execute()
+    assert not expired.committed
+
+def test_writes_after_the_first_run_to_the_end():
+    inner = _Client()
+    client = data_layer.TracedClient(inner)
+    deadline = deadlines.Deadline(30)
+    token = deadlines._current.set(deadline)
+    try:
+        client.table('loan_payments').update({}).execute()
+        deadline.cancel('client disconnected')
+        client.table('loans').update({}).eq('id', 1).execute()
+        client.table('loans').select('*').execute()
+        client.rpc('apply_interest_accruals', {}).execute()
+    finally:
+        deadlines._current.reset(token)
+    assert [op for _, op in inner.log] == ['update', 'update', 'select', 'select']
@@ -0,0 +1,20 @@
+"""Borrowing limits: every path rounds a limit to the cent the same way (see aggregation.percent_of_cents)."""
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from aggregation import FundAggregator, percent_of_cents
+from ledger import MemberPosition
+
+USER_ID = '11111111-1111-4111-8111-111111111111'
+
+def test_half_cent_rounds_to_even():
+    # 10.06 x 75% = 7.545
+    assert percent_of_cents(1006, Decimal('75.0')) == 754
+    assert percent_of_cents(1018, 75) == 764
+
+def test_ledger_matches_aggregation():
+    agg = FundAggregator([USER_ID])
+    agg.add_contributions([{'user_id': USER_ID, 'amount': '10.06'}])
+    position = MemberPosition(USER_ID, datetime.now(timezone.utc))
+    position.apply({'contributed_delta': '10.06', 'limit_percent': '75.0'})
+    assert position.borrowing_limit() == agg.results({USER_ID: 75})[0].borrowing_limit == 754
@@ -0,0 +1,38 @@
+"""Replica routing: WAL position tracking survives transient failures (see read_routing.py)."""
+import pytest
+from postgrest.exceptions import APIError
+
+import read_routing
+
+class _Rpc:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def execute(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return type('Response', (), {'data': self.outcome})()
+
+class _Client:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def rpc(self, name, params):
+        return _Rpc(self.outcomes.pop(0))
+
+def _router(*outcomes):
+    return read_routing.RoutedClient(_Client(*outcomes), _Client(), pin_seconds=10, lsn_poll_ms=0)
+
+@pytest.mark.parametrize('code', ['42883', 'PGRST202'])
+def test_missing_function_stops_tracking(code):
+    router = _router(APIError({'message': 'function replication_lsn() does not exist', 'code': code}))
+    assert router._lsn(router.primary) is None
+    assert not router.track_lsn
+
+@pytest.mark.parametrize('error', [ConnectionError('reset'), APIError({'message': 'canceling statement', 'code': '57014'})])
+def test_transient_failure_is_retried(error):
+    router = _router(error, '0/16B3748')
+    assert router._lsn(router.primary) is None
+    assert router.track_lsn
+    assert router._lsn(router.primary) == read_routing.parse_lsn('0/16B3748')
+    assert router.stats['lsn_errors'] == 1
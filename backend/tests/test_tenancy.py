@@ -0,0 +1,79 @@
+"""Family scoping: the caller's family, member checks and background job visibility (see tenancy.py)."""
+import time
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+import auth
+import dependencies
+import tenancy
+from jobs import job_runner
+from routers import admin
+
+SECRET = 'test-secret'
+FAMILY_1 = '00000000-0000-0000-0000-0000000000f1'
+FAMILY_2 = '00000000-0000-0000-0000-0000000000f2'
+ADMIN_1 = '11111111-1111-4111-8111-111111111111'
+MEMBER_1 = '22222222-2222-4222-8222-222222222222'
+ADMIN_2 = '33333333-3333-4333-8333-333333333333'
+
+@pytest.fixture(autouse=True)
+def families(monkeypatch):
+    monkeypatch.setenv('SUPABASE_JWT_SECRET', SECRET)
+    monkeypatch.setattr(dependencies, 'MOCK_MODE', False)
+    auth.token_cache.clear()
+    for user_id, family_id in ((ADMIN_1, FAMILY_1), (MEMBER_1, FAMILY_1), (ADMIN_2, FAMILY_2)):
+        tenancy.directory.remember(user_id, family_id)
+    yield
+    for user_id in (ADMIN_1, MEMBER_1, ADMIN_2):
+        tenancy.directory.forget(user_id)
+
+def bearer(user_id: str, **claims) -> str:
+    payload = {'sub': user_id, 'aud': 'authenticated', 'exp': int(time.time()) + 3600, 'user_role': 'admin', **claims}
+    return 'Bearer ' + jwt.encode(payload, SECRET, algorithm='HS256')
+
+def current_user(authorization: str) -> dependencies.UserContext:
+    return dependencies.get_current_user(authorization=authorization, x_user_id=None, x_user_role=None,
+                                         x_family_id=None, x_operator=None)
+
+def test_family_from_token():
+    user = current_user(bearer(ADMIN_2, family_id=FAMILY_2))
+    assert user.family_id == FAMILY_2
+    assert not user.operator
+
+def test_family_from_profile_when_token_has_none():
+    assert current_user(bearer(MEMBER_1)).family_id == FAMILY_1
+
+def test_operator_only_from_claims():
+    assert current_user(bearer(ADMIN_1, app_metadata={'operator': True})).operator
+    with pytest.raises(HTTPException) as exc:
+        dependencies.require_operator(current_user(bearer(ADMIN_1)))
+    assert exc.value.status_code == 403
+
+def test_member_of_another_family_is_not_disclosed():
+    admin_2 = current_user(bearer(ADMIN_2, family_id=FAMILY_2))
+    with pytest.raises(HTTPException) as exc:
+        dependencies.require_same_family(admin_2, MEMBER_1)
+    assert exc.value.status_code == 404
+    dependencies.require_same_family(current_user(bearer(ADMIN_1)), MEMBER_1)
+
+def test_in_family():
+    assert tenancy.in_family(MEMBER_1, FAMILY_1)
+    assert not tenancy.in_family(MEMBER_1, FAMILY_2)
+
+def test_jobs_are_visible_to_their_family_only():
+    job, _ = job_runner.submit('test-family-job', lambda ctx, **kwargs: None, key=None,
+                               params={'family_id': FAMILY_1})
+    deployment_job, _ = job_runner.submit('test-deployment-job', lambda ctx: None, key=None)
+    admin_1 = current_user(bearer(ADMIN_1))
+    admin_2 = current_user(bearer(ADMIN_2, family_id=FAMILY_2))
+    operator = current_user(bearer(ADMIN_1, app_metadata={'operator': True}))
+
+    assert admin._visible_job(job.id, admin_1) is job
+    for user, job_id in ((admin_2, job.id), (admin_1, deployment_job.id)):
+        with pytest.raises(HTTPException) as exc:
+            admin._visible_job(job_id, user)
+        assert exc.value.status_code == 404
+    assert admin._visible_job(deployment_job.id, operator) is deployment_job
+    assert job not in job_runner.list(families=admin._job_families(admin_2))
@@ -0,0 +1,169 @@
+"""
+Coalescing write-behind queue for per-member profile totals.
+
+Contribution and loan events used to recompute the member's stored totals
+inline, three round trips on every write. Instead the user id is enqueued
+here; a background thread waits ``window_ms`` after a member's first pending
+event, then recomputes every due member in one batch (see
+``db_utils.recalculate_users_totals``). Ten events for the same member inside
+the window cost a single recompute.
+
+Reads that show stored totals call :meth:`TotalsQueue.flush_user` first. It
+recomputes that member inline if an update is still pending, or waits for an
+in-flight batch that includes them, so a member always sees their own writes.
+
+Limits:
+  * The queue lives in one worker process. Read-your-writes holds only when
+    the read reaches the worker that queued the update; another worker shows
+    the stored totals until the batch lands (at most ``window_ms`` plus the
+    recompute). Figures that gate money (loan requests, /loans/my-capacity)
+    are recomputed live from contributions and loans, not read from here.
+  * Pending updates are in memory. They are drained on a clean shutdown but
+    lost if the process crashes. The stored totals are then stale until the
+    member's next event or POST /admin/recalculate-all-totals-v2.
+
+Configuration (environment):
+  TOTALS_COALESCE_MS   coalescing window in milliseconds (0 = recompute inline, the old behaviour)
+  TOTALS_BATCH_SIZE    most members recomputed per batch
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+class TotalsQueue:
+    def __init__(self, flush_fn, window_ms: float = 250.0, batch_size: int = 100):
+        """``flush_fn(user_ids)`` recomputes and stores totals for a list of members."""
+        self.flush_fn = flush_fn
+        self.window = window_ms / 1000.0
+        self.batch_size = batch_size
+        self._pending = {}      # user_id -> monotonic time of first pending event
+        self._attempts = {}     # user_id -> failed flush count
+        self._inflight = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.stats = {'enqueued': 0, 'coalesced': 0, 'batches': 0, 'flushed': 0, 'sync_flushes': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls, flush_fn) -> 'TotalsQueue':
+        queue = cls(
+            flush_fn,
+            window_ms=float(os.getenv('TOTALS_COALESCE_MS', '250')),
+            batch_size=int(os.getenv('TOTALS_BATCH_SIZE', '100')),
+        )
+        atexit.register(queue.stop)
+        return queue
+
+    def enqueue(self, user_id: str):
+        """Schedule a totals recompute for ``user_id``."""
+        if not user_id:
+            return
+        if self.window <= 0:
+            self.flush_fn([user_id])
+            return
+        with self._cond:
+            self.stats['enqueued'] += 1
+            if user_id in self._pending:
+                self.stats['coalesced'] += 1
+            else:
+                self._pending[user_id] = time.monotonic()
+            self._ensure_worker()
+            self._cond.notify()
+
+    def flush_user(self, user_id: str):
+        """Make sure ``user_id`` has no pending or in-flight recompute before a read."""
+        with self._cond:
+            while user_id in self._inflight:
+                self._cond.wait()
+            if user_id not in self._pending:
+                return
+            del self._pending[user_id]
+            self._inflight.add(user_id)
+            self.stats['sync_flushes'] += 1
+        self._flush([user_id])
+
+    def drain(self):
+        """Flush everything pending now (used at shutdown)."""
+        with self._cond:
+            user_ids = list(self._pending)
+            self._pending.clear()
+            self._inflight.update(user_ids)
+        for start in range(0, len(user_ids), self.batch_size):
+            self._flush(user_ids[start:start + self.batch_size])
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.drain()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='totals-queue', daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> list:
+        """
+        Pop up to batch_size members whose window has elapsed, oldest first, or
+        the oldest batch_size members if that many are waiting (caller holds the lock).
+        ``_pending`` is insertion-ordered, so its first entries are the oldest.
+        """
+        now = time.monotonic()
+        full = len(self._pending) >= self.batch_size
+        batch = []
+        for uid, since in self._pending.items():
+            if len(batch) >= self.batch_size or (not full and now - since < self.window):
+                break
+            batch.append(uid)
+        for uid in batch:
+            del self._pending[uid]
+        self._inflight.update(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    delay = self.window - (time.monotonic() - next(iter(self._pending.values())))
+                    if delay <= 0 or len(self._pending) >= self.batch_size:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+                batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, user_ids: list):
+        try:
+            self.flush_fn(user_ids)
+        except Exception as e:
+            log.exception("Flushing totals failed", extra={'event': 'totals_flush_failed', 'users': len(user_ids)})
+            with self._cond:
+                self.stats['errors'] += 1
+                for uid in user_ids:
+                    self._attempts[uid] = self._attempts.get(uid, 0) + 1
+                    if self._attempts[uid] < MAX_ATTEMPTS:
+                        self._pending.setdefault(uid, time.monotonic())
+                    else:
+                        del self._attempts[uid]
+        else:
+            with self._cond:
+                self.stats['batches'] += 1
+                self.stats['flushed'] += len(user_ids)
+                for uid in user_ids:
+                    self._attempts.pop(uid, None)
+        finally:
+            with self._cond:
+                self._inflight.difference_update(user_ids)
+                self._cond.notify_all()
@@ -0,0 +1,48 @@
+-- Composite and partial indexes for the hot query shapes in backend/routers and db_utils.py
+-- Safe re-runnable guards using IF NOT EXISTS
+--
+-- Query shapes covered:
+--   contributions: WHERE user_id = ? AND status = ?          (borrowing limit, recalculate_user_totals)
+--                  WHERE status = 'completed'                (list_users, recompute scripts)
+--   loans:         WHERE user_id = ? AND status = ?          (current loan balance)
+--                  WHERE status = 'approved'                 (list_users, recompute scripts)
+--   loan_payments: WHERE loan_id = ?                         (list_payments)
+--
+-- The INCLUDE columns are the ones those queries select, so the planner can
+-- answer them with index-only scans instead of visiting the heap. The partial
+-- indexes also carry status because the fund-wide queries select it.
+
+-- Contributions: member totals by status
+CREATE INDEX IF NOT EXISTS idx_contributions_user_status
+	ON contributions(user_id, status) INCLUDE (amount);
+
+-- Contributions: fund-wide scan of completed rows grouped by member
+CREATE INDEX IF NOT EXISTS idx_contributions_completed_user
+	ON contributions(user_id) INCLUDE (amount, status)
+	WHERE status = 'completed';
+
+-- Loans: member balance by status
+CREATE INDEX IF NOT EXISTS idx_loans_user_status
+	ON loans(user_id, status) INCLUDE (remaining_balance);
+
+-- Loans: fund-wide scan of open (approved) loans
+CREATE INDEX IF NOT EXISTS idx_loans_approved_user
+	ON loans(user_id) INCLUDE (remaining_balance, status)
+	WHERE status = 'approved';
+
+-- Loan payments: per-loan history in payment order
+CREATE INDEX IF NOT EXISTS idx_loan_payments_loan_date
+	ON loan_payments(loan_id, payment_date);
+
+-- Superseded single-column indexes (leading column of a composite above, or of
+-- UNIQUE(user_id, period_year, period_week) for contributions)
+DROP INDEX IF EXISTS idx_contributions_user;
+DROP INDEX IF EXISTS idx_loans_user;
+DROP INDEX IF EXISTS idx_loan_payments_loan;
+
+ANALYZE contributions;
+ANALYZE loans;
+ANALYZE loan_payments;
+
+-- Verification: backend/check_query_plans.py seeds a synthetic dataset and
+-- asserts through EXPLAIN that none of the shapes above fall back to a seq scan.
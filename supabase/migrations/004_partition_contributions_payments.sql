@@ -0,0 +1,184 @@
+-- Time partitioning for contributions / loan_payments and archival of closed loans
+--
+--   contributions  RANGE (period_year)   one partition per year
+--   loan_payments  RANGE (payment_date)  one partition per calendar year
+--
+-- Partitioned tables need the partition key in every unique constraint, so the
+-- primary keys become (id, period_year) and (id, payment_date). The business
+-- rule UNIQUE(user_id, period_year, period_week) already contains the key and
+-- is kept as-is. Queries that filter on period_year / payment_date only touch
+-- the matching partitions; everything else still works unchanged.
+--
+-- The conversion copies existing rows and is skipped if the tables are already
+-- partitioned, so the file is safe to re-run. Column drift from the
+-- supabase_fix_*.sql scripts is preserved (tables are recreated with LIKE).
+-- Re-apply 010_rls_policies.sql afterwards if it was applied before this file.
+
+-- Partition helpers ---------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION ensure_contribution_partition(p_year int) RETURNS void AS $$
+BEGIN
+	EXECUTE format(
+		'CREATE TABLE IF NOT EXISTS %I PARTITION OF contributions FOR VALUES FROM (%s) TO (%s)',
+		'contributions_y' || p_year, p_year, p_year + 1);
+END; $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_loan_payment_partition(p_year int) RETURNS void AS $$
+BEGIN
+	EXECUTE format(
+		'CREATE TABLE IF NOT EXISTS %I PARTITION OF loan_payments FOR VALUES FROM (%L) TO (%L)',
+		'loan_payments_y' || p_year, p_year || '-01-01', (p_year + 1) || '-01-01');
+END; $$ LANGUAGE plpgsql;
+
+-- Create partitions for the current year and p_years_ahead following years.
+-- Run periodically (e.g. POST /admin/ensure-partitions or pg_cron) so new rows
+-- never land in the default partitions.
+CREATE OR REPLACE FUNCTION ensure_time_partitions(p_years_ahead int DEFAULT 1) RETURNS void AS $$
+DECLARE
+	y int;
+BEGIN
+	FOR y IN extract(year FROM now())::int .. extract(year FROM now())::int + p_years_ahead LOOP
+		PERFORM ensure_contribution_partition(y);
+		PERFORM ensure_loan_payment_partition(y);
+	END LOOP;
+END; $$ LANGUAGE plpgsql;
+
+-- Contributions -------------------------------------------------------------
+
+DO $$
+DECLARE
+	y int;
+	first_year int;
+	last_year int;
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('contributions')) THEN
+		RETURN;
+	END IF;
+
+	ALTER TABLE contributions RENAME TO contributions_unpartitioned;
+
+	CREATE TABLE contributions (
+		LIKE contributions_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+		CONSTRAINT contributions_part_pkey PRIMARY KEY (id, period_year),
+		CONSTRAINT contributions_part_user_period_key UNIQUE (user_id, period_year, period_week)
+	) PARTITION BY RANGE (period_year);
+	ALTER TABLE contributions ADD CONSTRAINT contributions_part_user_fkey
+		FOREIGN KEY (user_id) REFERENCES profiles(id) ON DELETE CASCADE;
+
+	SELECT COALESCE(min(period_year), extract(year FROM now())::int),
+	       GREATEST(COALESCE(max(period_year), 0), extract(year FROM now())::int + 1)
+	INTO first_year, last_year
+	FROM contributions_unpartitioned;
+	FOR y IN first_year .. last_year LOOP
+		PERFORM ensure_contribution_partition(y);
+	END LOOP;
+	CREATE TABLE IF NOT EXISTS contributions_default PARTITION OF contributions DEFAULT;
+
+	INSERT INTO contributions SELECT * FROM contributions_unpartitioned;
+	DROP TABLE contributions_unpartitioned;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_contributions_period ON contributions(period_year, period_week);
+CREATE INDEX IF NOT EXISTS idx_contributions_status ON contributions(status);
+CREATE INDEX IF NOT EXISTS idx_contributions_user_status
+	ON contributions(user_id, status) INCLUDE (amount);
+CREATE INDEX IF NOT EXISTS idx_contributions_completed_user
+	ON contributions(user_id) INCLUDE (amount, status)
+	WHERE status = 'completed';
+
+-- Triggers are dropped with the old table; recreate on the partitioned parent
+DROP TRIGGER IF EXISTS after_contribution_complete ON contributions;
+CREATE TRIGGER after_contribution_complete
+AFTER UPDATE OF status ON contributions
+FOR EACH ROW WHEN (NEW.status = 'completed')
+EXECUTE FUNCTION trg_update_profile_totals();
+
+-- Loan payments -------------------------------------------------------------
+
+DO $$
+DECLARE
+	y int;
+	first_year int;
+	last_year int;
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('loan_payments')) THEN
+		RETURN;
+	END IF;
+
+	ALTER TABLE loan_payments RENAME TO loan_payments_unpartitioned;
+	UPDATE loan_payments_unpartitioned SET payment_date = COALESCE(created_at, now()) WHERE payment_date IS NULL;
+
+	CREATE TABLE loan_payments (
+		LIKE loan_payments_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+		CONSTRAINT loan_payments_part_pkey PRIMARY KEY (id, payment_date)
+	) PARTITION BY RANGE (payment_date);
+	ALTER TABLE loan_payments ALTER COLUMN payment_date SET NOT NULL;
+	ALTER TABLE loan_payments ADD CONSTRAINT loan_payments_part_loan_fkey
+		FOREIGN KEY (loan_id) REFERENCES loans(id) ON DELETE CASCADE;
+	ALTER TABLE loan_payments ADD CONSTRAINT loan_payments_part_user_fkey
+		FOREIGN KEY (user_id) REFERENCES profiles(id) ON DELETE CASCADE;
+
+	SELECT COALESCE(extract(year FROM min(payment_date))::int, extract(year FROM now())::int),
+	       GREATEST(COALESCE(extract(year FROM max(payment_date))::int, 0), extract(year FROM now())::int + 1)
+	INTO first_year, last_year
+	FROM loan_payments_unpartitioned;
+	FOR y IN first_year .. last_year LOOP
+		PERFORM ensure_loan_payment_partition(y);
+	END LOOP;
+	CREATE TABLE IF NOT EXISTS loan_payments_default PARTITION OF loan_payments DEFAULT;
+
+	INSERT INTO loan_payments SELECT * FROM loan_payments_unpartitioned;
+	DROP TABLE loan_payments_unpartitioned;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_loan_payments_loan_date ON loan_payments(loan_id, payment_date);
+
+-- Closed-loan archive -------------------------------------------------------
+-- Paid and rejected loans (and their payments) move out of the hot tables so
+-- `loans` only holds pending/open loans plus recently closed ones.
+
+CREATE TABLE IF NOT EXISTS loans_archive (
+	LIKE loans INCLUDING DEFAULTS,
+	archived_at timestamptz NOT NULL DEFAULT now(),
+	PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_loans_archive_user ON loans_archive(user_id);
+
+CREATE TABLE IF NOT EXISTS loan_payments_archive (
+	LIKE loan_payments INCLUDING DEFAULTS,
+	archived_at timestamptz NOT NULL DEFAULT now(),
+	PRIMARY KEY (id, payment_date)
+);
+CREATE INDEX IF NOT EXISTS idx_loan_payments_archive_loan ON loan_payments_archive(loan_id);
+
+-- Move loans closed more than p_older_than_days ago into the archive tables.
+-- A loan counts as closed from its last payment (paid) or rejected_at (rejected).
+-- Returns the number of loans archived; safe to run repeatedly.
+CREATE OR REPLACE FUNCTION archive_closed_loans(p_older_than_days int DEFAULT 365) RETURNS int AS $$
+DECLARE
+	moved int;
+BEGIN
+	WITH closed AS (
+		SELECT l.id FROM loans l
+		WHERE l.status IN ('paid', 'rejected')
+		AND COALESCE(
+			(SELECT max(lp.payment_date) FROM loan_payments lp WHERE lp.loan_id = l.id),
+			l.rejected_at, l.approved_at, l.created_at
+		) < now() - make_interval(days => p_older_than_days)
+		FOR UPDATE OF l
+	), archived_payments AS (
+		INSERT INTO loan_payments_archive
+		SELECT lp.*, now() FROM loan_payments lp WHERE lp.loan_id IN (SELECT id FROM closed)
+	), archived_loans AS (
+		INSERT INTO loans_archive
+		SELECT l.*, now() FROM loans l WHERE l.id IN (SELECT id FROM closed)
+		RETURNING id
+	)
+	-- loan_payments rows go with the loan through ON DELETE CASCADE
+	DELETE FROM loans WHERE id IN (SELECT id FROM archived_loans);
+	GET DIAGNOSTICS moved = ROW_COUNT;
+	RETURN moved;
+END; $$ LANGUAGE plpgsql;
+
+ANALYZE contributions;
+ANALYZE loan_payments;
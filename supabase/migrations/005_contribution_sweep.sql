@@ -0,0 +1,69 @@
+-- Overdue contribution sweep with late fees
+--
+-- sweep_overdue_contributions() moves every pending contribution whose
+-- due_date is more than p_grace_days in the past to 'late', and every pending
+-- or late one more than p_missed_after_days overdue to 'missed', in a single
+-- set-based UPDATE. A late fee of GREATEST(p_late_fee_flat, amount *
+-- p_late_fee_percent / 100) is assessed the first time a contribution becomes
+-- overdue. It returns one row per changed contribution so the caller can
+-- refresh each affected member's totals once.
+--
+-- Run from POST /admin/sweep-contributions, or schedule it directly, e.g.
+--   SELECT cron.schedule('sweep-contributions', '15 0 * * *',
+--                        $$SELECT count(*) FROM sweep_overdue_contributions()$$);
+-- (pg_cron runs skip the per-member totals refresh; POST /admin/recalculate-all-totals-v2
+-- or the recompute script covers that.)
+
+ALTER TABLE contributions ADD COLUMN IF NOT EXISTS late_fee numeric(10,2) NOT NULL DEFAULT 0;
+ALTER TABLE contributions ADD COLUMN IF NOT EXISTS status_changed_at timestamptz;
+
+-- Sweep candidates: open contributions by due date
+CREATE INDEX IF NOT EXISTS idx_contributions_open_due
+	ON contributions(due_date) INCLUDE (status)
+	WHERE status IN ('pending', 'late');
+
+CREATE OR REPLACE FUNCTION sweep_overdue_contributions(
+	p_as_of date DEFAULT current_date,
+	p_grace_days int DEFAULT 3,
+	p_missed_after_days int DEFAULT 28,
+	p_late_fee_flat numeric DEFAULT 0,
+	p_late_fee_percent numeric DEFAULT 0,
+	p_dry_run boolean DEFAULT false
+) RETURNS TABLE (
+	id uuid,
+	user_id uuid,
+	period_year int,
+	period_week int,
+	due_date date,
+	old_status contribution_status,
+	new_status contribution_status,
+	late_fee numeric
+) AS $$
+#variable_conflict use_column
+BEGIN
+	IF p_dry_run THEN
+		RETURN QUERY
+		SELECT c.id, c.user_id, c.period_year, c.period_week, c.due_date, c.status,
+		       CASE WHEN c.due_date < p_as_of - p_missed_after_days THEN 'missed' ELSE 'late' END::contribution_status,
+		       CASE WHEN c.late_fee = 0 THEN round(GREATEST(p_late_fee_flat, c.amount * p_late_fee_percent / 100), 2) ELSE c.late_fee END
+		FROM contributions c
+		WHERE (c.status = 'pending' AND c.due_date < p_as_of - p_grace_days)
+		   OR (c.status = 'late' AND c.due_date < p_as_of - p_missed_after_days);
+		RETURN;
+	END IF;
+
+	RETURN QUERY
+	WITH changed AS (
+		UPDATE contributions c SET
+			status = CASE WHEN c.due_date < p_as_of - p_missed_after_days THEN 'missed' ELSE 'late' END::contribution_status,
+			late_fee = CASE WHEN c.late_fee = 0 THEN round(GREATEST(p_late_fee_flat, c.amount * p_late_fee_percent / 100), 2) ELSE c.late_fee END,
+			status_changed_at = now(),
+			updated_at = now()
+		FROM contributions old
+		WHERE old.id = c.id AND old.period_year = c.period_year
+		AND ((c.status = 'pending' AND c.due_date < p_as_of - p_grace_days)
+		  OR (c.status = 'late' AND c.due_date < p_as_of - p_missed_after_days))
+		RETURNING c.id, c.user_id, c.period_year, c.period_week, c.due_date, old.status, c.status, c.late_fee
+	)
+	SELECT * FROM changed;
+END; $$ LANGUAGE plpgsql;
@@ -0,0 +1,130 @@
+-- Optional loan interest with an idempotent accrual ledger
+--
+--   loans.interest_rate            annual rate in percent (0 = interest-free, the default)
+--   loans.interest_compounding     how the rate compounds inside an accrual period:
+--                                  'none' (pro rata), 'daily' or 'weekly'
+--   loans.interest_accrued_through last day interest has been charged for
+--
+-- The accrual batch (backend/interest.py) computes one ledger entry per open
+-- loan and accrual period and hands them to apply_interest_accruals(). In one
+-- transaction that function:
+--   * inserts the entries, skipping (loan_id, period_key) pairs already in the ledger
+--   * skips loans whose balance moved since the batch read it (base_balance)
+--   * adds the inserted amounts to loans.remaining_balance
+-- Re-running a crashed or repeated batch therefore never charges a period twice.
+
+ALTER TABLE loans ADD COLUMN IF NOT EXISTS interest_rate numeric(6,3) NOT NULL DEFAULT 0;
+ALTER TABLE loans ADD COLUMN IF NOT EXISTS interest_compounding text NOT NULL DEFAULT 'none';
+ALTER TABLE loans ADD COLUMN IF NOT EXISTS interest_accrued_through date;
+DO $$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'loans_interest_compounding_check') THEN
+		ALTER TABLE loans ADD CONSTRAINT loans_interest_compounding_check
+			CHECK (interest_compounding IN ('none', 'daily', 'weekly'));
+	END IF;
+END $$;
+
+-- Keep the archive in step with loans (see 004)
+ALTER TABLE loans_archive ADD COLUMN IF NOT EXISTS interest_rate numeric(6,3) NOT NULL DEFAULT 0;
+ALTER TABLE loans_archive ADD COLUMN IF NOT EXISTS interest_compounding text NOT NULL DEFAULT 'none';
+ALTER TABLE loans_archive ADD COLUMN IF NOT EXISTS interest_accrued_through date;
+
+-- Open interest-bearing loans, read by every accrual batch
+CREATE INDEX IF NOT EXISTS idx_loans_interest_open
+	ON loans(id) INCLUDE (remaining_balance, interest_rate, interest_compounding, interest_accrued_through)
+	WHERE status = 'approved' AND interest_rate > 0;
+
+-- No foreign key to loans: ledger rows outlive loans moved to loans_archive
+CREATE TABLE IF NOT EXISTS loan_interest_accruals (
+	id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+	loan_id uuid NOT NULL,
+	user_id uuid NOT NULL,
+	period_key text NOT NULL,
+	period_start date NOT NULL,
+	period_end date NOT NULL,
+	rate numeric(6,3) NOT NULL,
+	compounding text NOT NULL,
+	balance_before numeric(12,2) NOT NULL,
+	amount numeric(12,2) NOT NULL,
+	balance_after numeric(12,2) NOT NULL,
+	created_at timestamptz NOT NULL DEFAULT now(),
+	CONSTRAINT loan_interest_accruals_period_key UNIQUE (loan_id, period_key)
+);
+CREATE INDEX IF NOT EXISTS idx_loan_interest_accruals_user ON loan_interest_accruals(user_id);
+
+CREATE OR REPLACE FUNCTION apply_interest_accruals(p_entries jsonb) RETURNS TABLE (
+	loan_id uuid,
+	period_key text,
+	amount numeric,
+	applied boolean,
+	reason text
+) AS $$
+#variable_conflict use_column
+BEGIN
+	RETURN QUERY
+	WITH e AS (
+		SELECT * FROM jsonb_to_recordset(p_entries) AS x(
+			loan_id uuid, user_id uuid, period_key text, period_start date, period_end date,
+			rate numeric, compounding text, base_balance numeric, balance_before numeric,
+			amount numeric, balance_after numeric)
+	), locked AS (
+		SELECT l.id, l.remaining_balance FROM loans l
+		WHERE l.id IN (SELECT DISTINCT e.loan_id FROM e) AND l.status = 'approved'
+		FOR UPDATE OF l
+	), ins AS (
+		INSERT INTO loan_interest_accruals (loan_id, user_id, period_key, period_start, period_end, rate,
+			compounding, balance_before, amount, balance_after)
+		SELECT e.loan_id, e.user_id, e.period_key, e.period_start, e.period_end, e.rate,
+			e.compounding, e.balance_before, e.amount, e.balance_after
+		FROM e JOIN locked k ON k.id = e.loan_id AND k.remaining_balance = e.base_balance
+		ON CONFLICT (loan_id, period_key) DO NOTHING
+		RETURNING loan_id, period_key, amount, period_end
+	), upd AS (
+		UPDATE loans l SET
+			remaining_balance = l.remaining_balance + s.total,
+			interest_accrued_through = GREATEST(COALESCE(l.interest_accrued_through, s.through), s.through),
+			updated_at = now()
+		FROM (SELECT ins.loan_id, sum(ins.amount) AS total, max(ins.period_end) AS through FROM ins GROUP BY ins.loan_id) s
+		WHERE l.id = s.loan_id
+		RETURNING l.id
+	)
+	SELECT e.loan_id, e.period_key, e.amount, ins.loan_id IS NOT NULL,
+		CASE
+			WHEN ins.loan_id IS NOT NULL THEN 'applied'
+			WHEN k.id IS NULL THEN 'loan not open'
+			WHEN k.remaining_balance <> e.base_balance THEN 'balance changed'
+			ELSE 'already accrued'
+		END
+	FROM e
+	LEFT JOIN ins ON ins.loan_id = e.loan_id AND ins.period_key = e.period_key
+	LEFT JOIN locked k ON k.id = e.loan_id;
+END; $$ LANGUAGE plpgsql;
+
+-- Archive by column name so later ALTERs on loans / loan_payments cannot misalign it
+CREATE OR REPLACE FUNCTION archive_closed_loans(p_older_than_days int DEFAULT 365) RETURNS int AS $$
+DECLARE
+	moved int;
+BEGIN
+	WITH closed AS (
+		SELECT l.id FROM loans l
+		WHERE l.status IN ('paid', 'rejected')
+		AND COALESCE(
+			(SELECT max(lp.payment_date) FROM loan_payments lp WHERE lp.loan_id = l.id),
+			l.rejected_at, l.approved_at, l.created_at
+		) < now() - make_interval(days => p_older_than_days)
+		FOR UPDATE OF l
+	), archived_payments AS (
+		INSERT INTO loan_payments_archive
+		SELECT (jsonb_populate_record(NULL::loan_payments_archive, to_jsonb(lp) || jsonb_build_object('archived_at', now()))).*
+		FROM loan_payments lp WHERE lp.loan_id IN (SELECT id FROM closed)
+	), archived_loans AS (
+		INSERT INTO loans_archive
+		SELECT (jsonb_populate_record(NULL::loans_archive, to_jsonb(l) || jsonb_build_object('archived_at', now()))).*
+		FROM loans l WHERE l.id IN (SELECT id FROM closed)
+		RETURNING id
+	)
+	-- loan_payments rows go with the loan through ON DELETE CASCADE
+	DELETE FROM loans WHERE id IN (SELECT id FROM archived_loans);
+	GET DIAGNOSTICS moved = ROW_COUNT;
+	RETURN moved;
+END; $$ LANGUAGE plpgsql;
@@ -0,0 +1,223 @@
+-- Append-only member ledger with periodic snapshots
+--
+-- ledger_events records every change to a member's financial position:
+--   contribution_completed   +contributed   contribution became completed (or inserted completed)
+--   contribution_reversed    -contributed   completed contribution reopened or deleted
+--   loan_approved            +loan balance  loan approved
+--   loan_payment             -loan balance  payment recorded (capped at the balance then owed)
+--   interest_accrued         +loan balance  interest charged (006_loan_interest.sql)
+--   limit_changed            borrow_limit_percent set to limit_percent
+--   adjustment               manual correction, either delta (POST /admin/ledger/adjustments)
+-- Events are captured by triggers on the source tables, so RPCs and direct
+-- SQL writes are recorded too. Rows are never updated or deleted.
+--
+-- member_snapshots holds each member's totals over all events with
+-- occurred_at < as_of, written by snapshot_member_ledgers(). A point-in-time
+-- position (backend/ledger.py) is the latest snapshot before the requested
+-- time plus a replay of the events after it. Backdated events recorded after
+-- the snapshot was taken (id > last_event_id) are replayed as well.
+--
+-- Snapshot weekly, e.g.
+--   SELECT cron.schedule('ledger-snapshots', '30 0 * * 1',
+--                        $$SELECT snapshot_member_ledgers(date_trunc('day', now()))$$);
+-- or from POST /admin/ledger/snapshots.
+
+CREATE TABLE IF NOT EXISTS ledger_events (
+	id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+	user_id uuid NOT NULL,
+	event_type text NOT NULL CHECK (event_type IN ('contribution_completed', 'contribution_reversed', 'loan_approved',
+		'loan_payment', 'interest_accrued', 'limit_changed', 'adjustment')),
+	occurred_at timestamptz NOT NULL,
+	contributed_delta numeric(12,2) NOT NULL DEFAULT 0,
+	loan_delta numeric(12,2) NOT NULL DEFAULT 0,
+	limit_percent numeric(5,2),
+	source_table text,
+	source_id text,
+	note text,
+	recorded_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_events_user_time ON ledger_events(user_id, occurred_at, id);
+
+CREATE OR REPLACE FUNCTION ledger_events_append_only() RETURNS trigger AS $$
+BEGIN
+	RAISE EXCEPTION 'ledger_events is append-only';
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_events_no_change ON ledger_events;
+CREATE TRIGGER ledger_events_no_change
+BEFORE UPDATE OR DELETE ON ledger_events
+FOR EACH ROW EXECUTE FUNCTION ledger_events_append_only();
+
+CREATE TABLE IF NOT EXISTS member_snapshots (
+	user_id uuid NOT NULL,
+	as_of timestamptz NOT NULL,
+	last_event_id bigint NOT NULL,
+	total_contributed numeric(12,2) NOT NULL,
+	loan_balance numeric(12,2) NOT NULL,
+	limit_percent numeric(5,2),
+	event_count int NOT NULL,
+	created_at timestamptz NOT NULL DEFAULT now(),
+	PRIMARY KEY (user_id, as_of)
+);
+
+-- Capture -------------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION ledger_capture_contribution() RETURNS trigger AS $$
+DECLARE
+	was_done boolean := TG_OP <> 'INSERT' AND OLD.status = 'completed';
+	is_done boolean := TG_OP <> 'DELETE' AND NEW.status = 'completed';
+BEGIN
+	IF is_done AND NOT was_done THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, contributed_delta, source_table, source_id)
+		VALUES (NEW.user_id, 'contribution_completed', COALESCE(NEW.paid_at, now()), NEW.amount, 'contributions', NEW.id::text);
+	ELSIF was_done AND NOT is_done THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, contributed_delta, source_table, source_id)
+		VALUES (OLD.user_id, 'contribution_reversed', now(), -OLD.amount, 'contributions', OLD.id::text);
+	ELSIF was_done AND is_done AND NEW.amount <> OLD.amount THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, contributed_delta, source_table, source_id, note)
+		VALUES (NEW.user_id, 'adjustment', now(), NEW.amount - OLD.amount, 'contributions', NEW.id::text, 'amount changed');
+	END IF;
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_contributions ON contributions;
+CREATE TRIGGER ledger_contributions
+AFTER INSERT OR UPDATE OF status, amount OR DELETE ON contributions
+FOR EACH ROW EXECUTE FUNCTION ledger_capture_contribution();
+
+CREATE OR REPLACE FUNCTION ledger_capture_loan() RETURNS trigger AS $$
+BEGIN
+	IF NEW.status = 'approved' AND (TG_OP = 'INSERT' OR OLD.status <> 'approved') THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id)
+		VALUES (NEW.user_id, 'loan_approved', COALESCE(NEW.approved_at, now()), NEW.amount, 'loans', NEW.id::text);
+	END IF;
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_loans ON loans;
+CREATE TRIGGER ledger_loans
+AFTER INSERT OR UPDATE OF status ON loans
+FOR EACH ROW EXECUTE FUNCTION ledger_capture_loan();
+
+-- The payment row is inserted before the loan balance is reduced, so the
+-- balance read here is the one the payment applies to
+CREATE OR REPLACE FUNCTION ledger_capture_loan_payment() RETURNS trigger AS $$
+DECLARE
+	owed numeric;
+BEGIN
+	SELECT remaining_balance INTO owed FROM loans WHERE id = NEW.loan_id;
+	INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id)
+	VALUES (NEW.user_id, 'loan_payment', COALESCE(NEW.payment_date, now()),
+		-LEAST(NEW.amount, COALESCE(owed, NEW.amount)), 'loan_payments', NEW.id::text);
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_loan_payments ON loan_payments;
+CREATE TRIGGER ledger_loan_payments
+AFTER INSERT ON loan_payments
+FOR EACH ROW EXECUTE FUNCTION ledger_capture_loan_payment();
+
+CREATE OR REPLACE FUNCTION ledger_capture_interest() RETURNS trigger AS $$
+BEGIN
+	IF NEW.amount <> 0 THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id, note)
+		VALUES (NEW.user_id, 'interest_accrued', (NEW.period_end + 1)::timestamptz - interval '1 microsecond',
+			NEW.amount, 'loan_interest_accruals', NEW.id::text, NEW.period_key);
+	END IF;
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_interest ON loan_interest_accruals;
+CREATE TRIGGER ledger_interest
+AFTER INSERT ON loan_interest_accruals
+FOR EACH ROW EXECUTE FUNCTION ledger_capture_interest();
+
+CREATE OR REPLACE FUNCTION ledger_capture_limit() RETURNS trigger AS $$
+BEGIN
+	IF NEW.borrow_limit_percent IS DISTINCT FROM OLD.borrow_limit_percent THEN
+		INSERT INTO ledger_events (user_id, event_type, occurred_at, limit_percent, source_table, source_id)
+		VALUES (NEW.id, 'limit_changed', now(), NEW.borrow_limit_percent, TG_TABLE_NAME, NEW.id::text);
+	END IF;
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+-- borrow_limit_percent lives on the users table (002_remove_borrowing_limit.sql)
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class c JOIN pg_attribute a ON a.attrelid = c.oid
+	           WHERE c.oid = to_regclass('users') AND c.relkind = 'r' AND a.attname = 'borrow_limit_percent') THEN
+		EXECUTE 'DROP TRIGGER IF EXISTS ledger_users_limit ON users';
+		EXECUTE 'CREATE TRIGGER ledger_users_limit AFTER UPDATE OF borrow_limit_percent ON users
+		         FOR EACH ROW EXECUTE FUNCTION ledger_capture_limit()';
+	END IF;
+END $$;
+
+-- Snapshots -----------------------------------------------------------------
+
+CREATE OR REPLACE FUNCTION snapshot_member_ledgers(p_as_of timestamptz DEFAULT date_trunc('day', now())) RETURNS int AS $$
+DECLARE
+	written int;
+BEGIN
+	INSERT INTO member_snapshots (user_id, as_of, last_event_id, total_contributed, loan_balance, limit_percent, event_count)
+	SELECT e.user_id, p_as_of, max(e.id), sum(e.contributed_delta), sum(e.loan_delta),
+		(array_agg(e.limit_percent ORDER BY e.occurred_at DESC, e.id DESC) FILTER (WHERE e.limit_percent IS NOT NULL))[1],
+		count(*)
+	FROM ledger_events e
+	WHERE e.occurred_at < p_as_of
+	GROUP BY e.user_id
+	ON CONFLICT (user_id, as_of) DO UPDATE SET
+		last_event_id = EXCLUDED.last_event_id,
+		total_contributed = EXCLUDED.total_contributed,
+		loan_balance = EXCLUDED.loan_balance,
+		limit_percent = EXCLUDED.limit_percent,
+		event_count = EXCLUDED.event_count,
+		created_at = now();
+	GET DIAGNOSTICS written = ROW_COUNT;
+	RETURN written;
+END; $$ LANGUAGE plpgsql;
+
+-- Backfill ------------------------------------------------------------------
+-- Runs once, on an empty ledger, from the rows that exist today (archived
+-- loans included). Payments are not capped here: the balance each one
+-- applied to is no longer known.
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM ledger_events) THEN
+		RETURN;
+	END IF;
+
+	INSERT INTO ledger_events (user_id, event_type, occurred_at, contributed_delta, source_table, source_id)
+	SELECT user_id, 'contribution_completed', COALESCE(paid_at, updated_at, created_at), amount, 'contributions', id::text
+	FROM contributions WHERE status = 'completed';
+
+	INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id)
+	SELECT user_id, 'loan_approved', COALESCE(approved_at, created_at), amount, 'loans', id::text
+	FROM loans WHERE status IN ('approved', 'paid')
+	UNION ALL
+	SELECT user_id, 'loan_approved', COALESCE(approved_at, created_at), amount, 'loans_archive', id::text
+	FROM loans_archive WHERE status = 'paid';
+
+	INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id)
+	SELECT user_id, 'loan_payment', COALESCE(payment_date, created_at), -amount, 'loan_payments', id::text
+	FROM loan_payments
+	UNION ALL
+	SELECT user_id, 'loan_payment', COALESCE(payment_date, created_at), -amount, 'loan_payments_archive', id::text
+	FROM loan_payments_archive;
+
+	INSERT INTO ledger_events (user_id, event_type, occurred_at, loan_delta, source_table, source_id, note)
+	SELECT user_id, 'interest_accrued', (period_end + 1)::timestamptz - interval '1 microsecond', amount,
+		'loan_interest_accruals', id::text, period_key
+	FROM loan_interest_accruals WHERE amount <> 0;
+
+	IF EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass('users') AND attname = 'borrow_limit_percent') THEN
+		EXECUTE $sql$
+			INSERT INTO ledger_events (user_id, event_type, occurred_at, limit_percent, source_table, source_id)
+			SELECT u.id, 'limit_changed', COALESCE(p.joined_at, now()), u.borrow_limit_percent, 'users', u.id::text
+			FROM users u LEFT JOIN profiles p ON p.id = u.id
+			WHERE u.borrow_limit_percent IS NOT NULL
+		$sql$;
+	END IF;
+END $$;
+
+SELECT snapshot_member_ledgers();
@@ -0,0 +1,10 @@
+-- WAL position for read-your-writes routing (backend/read_routing.py)
+--
+-- On the primary this is the current write position; on a streaming replica
+-- it is the last position replayed. After a member writes, the API records
+-- the primary's position and keeps that member's reads on the primary until
+-- the replica reports a position at or past it.
+
+CREATE OR REPLACE FUNCTION replication_lsn() RETURNS text AS $$
+	SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text;
+$$ LANGUAGE sql;
@@ -0,0 +1,133 @@
+-- Multi-family tenancy: every member and every row they own belongs to a family
+--
+--   families                  one row per family fund hosted on the deployment
+--   profiles.family_id        the member's family (NOT NULL; new profiles must name it)
+--   <table>.family_id         copied from the owning member on insert when not given:
+--                             contributions, loans, loan_payments, ledger_events,
+--                             loan_interest_accruals (and users, where that table exists)
+--
+-- contributions, loans and loan_payments reference profiles(id, family_id), so
+-- a row can never belong to a different family than its member. Moving a
+-- member (UPDATE profiles SET family_id) carries those rows along; ledger
+-- events stay with the family they were recorded in.
+--
+-- Existing rows are assigned to the default family below. Indexes lead with
+-- family_id so per-family admin queries read only that family's entries.
+-- The row level security policies that use these columns follow in 010_rls_policies.sql.
+
+CREATE TABLE IF NOT EXISTS families (
+	id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+	name text NOT NULL,
+	created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Same id as backend/tenancy.py DEFAULT_FAMILY_ID
+INSERT INTO families (id, name) VALUES ('00000000-0000-0000-0000-000000000001', 'Family fund')
+ON CONFLICT (id) DO NOTHING;
+
+-- Members -------------------------------------------------------------------
+
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS family_id uuid REFERENCES families(id);
+UPDATE profiles SET family_id = '00000000-0000-0000-0000-000000000001' WHERE family_id IS NULL;
+ALTER TABLE profiles ALTER COLUMN family_id SET NOT NULL;
+DO $$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'profiles_id_family_key') THEN
+		ALTER TABLE profiles ADD CONSTRAINT profiles_id_family_key UNIQUE (id, family_id);
+	END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_profiles_family ON profiles(family_id, id) INCLUDE (role, weekly_contribution);
+
+-- Fill family_id from the member named by column TG_ARGV[0]
+CREATE OR REPLACE FUNCTION set_family_id() RETURNS trigger AS $$
+BEGIN
+	IF NEW.family_id IS NULL THEN
+		SELECT p.family_id INTO NEW.family_id FROM profiles p WHERE p.id = (to_jsonb(NEW) ->> TG_ARGV[0])::uuid;
+	END IF;
+	RETURN NEW;
+END; $$ LANGUAGE plpgsql;
+
+-- Member-owned tables -------------------------------------------------------
+
+DO $$
+DECLARE
+	t text;
+BEGIN
+	FOREACH t IN ARRAY ARRAY['contributions', 'loans', 'loan_payments', 'ledger_events', 'loan_interest_accruals'] LOOP
+		EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS family_id uuid', t);
+		EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_family', t);
+		EXECUTE format('CREATE TRIGGER %I BEFORE INSERT ON %I FOR EACH ROW EXECUTE FUNCTION set_family_id(%L)',
+			t || '_family', t, 'user_id');
+	END LOOP;
+END $$;
+
+UPDATE contributions c SET family_id = p.family_id FROM profiles p WHERE p.id = c.user_id AND c.family_id IS NULL;
+UPDATE loans l SET family_id = p.family_id FROM profiles p WHERE p.id = l.user_id AND l.family_id IS NULL;
+UPDATE loan_payments lp SET family_id = p.family_id FROM profiles p WHERE p.id = lp.user_id AND lp.family_id IS NULL;
+UPDATE loan_interest_accruals a SET family_id = p.family_id FROM profiles p WHERE p.id = a.user_id AND a.family_id IS NULL;
+
+-- The ledger is append-only (007); the backfill is the one sanctioned update
+ALTER TABLE ledger_events DISABLE TRIGGER ledger_events_no_change;
+UPDATE ledger_events e SET family_id = p.family_id FROM profiles p WHERE p.id = e.user_id AND e.family_id IS NULL;
+ALTER TABLE ledger_events ENABLE TRIGGER ledger_events_no_change;
+
+ALTER TABLE contributions ALTER COLUMN family_id SET NOT NULL;
+ALTER TABLE loans ALTER COLUMN family_id SET NOT NULL;
+ALTER TABLE loan_payments ALTER COLUMN family_id SET NOT NULL;
+
+DO $$
+DECLARE
+	t text;
+BEGIN
+	FOREACH t IN ARRAY ARRAY['contributions', 'loans', 'loan_payments'] LOOP
+		IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = t || '_member_family_fkey') THEN
+			EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I FOREIGN KEY (user_id, family_id)
+				REFERENCES profiles(id, family_id) ON UPDATE CASCADE ON DELETE CASCADE', t, t || '_member_family_fkey');
+		END IF;
+	END LOOP;
+END $$;
+
+-- Keep the archive in step with loans (see 004, 006)
+ALTER TABLE loans_archive ADD COLUMN IF NOT EXISTS family_id uuid;
+ALTER TABLE loan_payments_archive ADD COLUMN IF NOT EXISTS family_id uuid;
+UPDATE loans_archive l SET family_id = p.family_id FROM profiles p WHERE p.id = l.user_id AND l.family_id IS NULL;
+UPDATE loan_payments_archive lp SET family_id = p.family_id FROM profiles p WHERE p.id = lp.user_id AND lp.family_id IS NULL;
+
+-- borrow_limit_percent lives on the users table (002_remove_borrowing_limit.sql)
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('users') AND relkind = 'r') THEN
+		EXECUTE 'ALTER TABLE users ADD COLUMN IF NOT EXISTS family_id uuid REFERENCES families(id)';
+		EXECUTE 'UPDATE users u SET family_id = COALESCE((SELECT p.family_id FROM profiles p WHERE p.id = u.id),
+		         ''00000000-0000-0000-0000-000000000001'') WHERE u.family_id IS NULL';
+		EXECUTE 'DROP TRIGGER IF EXISTS users_family ON users';
+		EXECUTE 'CREATE TRIGGER users_family BEFORE INSERT ON users FOR EACH ROW EXECUTE FUNCTION set_family_id(''id'')';
+		EXECUTE 'CREATE INDEX IF NOT EXISTS idx_users_family ON users(family_id, id)';
+	END IF;
+END $$;
+
+-- Tenant-scoped indexes -----------------------------------------------------
+-- Shapes (backend/routers, forecast.py, statements.py):
+--   contributions: WHERE family_id = ? AND status = ?           (list_users, opening cash)
+--                  WHERE family_id = ? AND period_year = ?      (GET /contributions?period_year=)
+--   loans:         WHERE family_id = ? AND status [IN] ?        (list_users, loan book, opening cash)
+--   loan_payments: WHERE family_id = ?                          (opening cash)
+--   ledger_events: WHERE family_id = ? AND occurred_at < ?      (statements)
+-- The fund-wide indexes of 003 stay for the maintenance jobs that still scan
+-- every family (sweep, interest accrual, snapshots).
+
+CREATE INDEX IF NOT EXISTS idx_contributions_family_status
+	ON contributions(family_id, status) INCLUDE (user_id, amount);
+CREATE INDEX IF NOT EXISTS idx_contributions_family_period
+	ON contributions(family_id, period_year, period_week);
+CREATE INDEX IF NOT EXISTS idx_loans_family_status
+	ON loans(family_id, status) INCLUDE (user_id, amount, remaining_balance);
+CREATE INDEX IF NOT EXISTS idx_loan_payments_family
+	ON loan_payments(family_id, payment_date) INCLUDE (user_id, amount);
+CREATE INDEX IF NOT EXISTS idx_ledger_events_family_time
+	ON ledger_events(family_id, occurred_at);
+
+ANALYZE profiles;
+ANALYZE contributions;
+ANALYZE loans;
+ANALYZE loan_payments;
@@ -0,0 +1,74 @@
+-- Row level security: members read their own rows, admins manage their family's
+--
+-- Needs the family_id columns from 009_family_tenancy.sql and the tables of
+-- 006 / 007, so it runs after them. If 004_partition_contributions_payments.sql
+-- is applied later by hand, re-apply this file (the conversion recreates
+-- contributions / loan_payments without their policies).
+--
+-- The backend connects with the service role, which bypasses RLS, and scopes
+-- its own queries by the caller's family. These policies guard direct client
+-- access (supabase-js with the anon key and a member's session).
+--
+-- The helper functions are SECURITY DEFINER so reading the caller's profile
+-- does not itself go through the profiles policies. Policies call them as
+-- (SELECT fn()) so they are evaluated once per statement rather than per row;
+-- with the family_id indexes of 009 a policy costs one index condition.
+
+CREATE OR REPLACE FUNCTION auth_family_id() RETURNS uuid AS $$
+	SELECT family_id FROM profiles WHERE id = auth.uid();
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION auth_is_family_admin() RETURNS boolean AS $$
+	SELECT EXISTS (SELECT 1 FROM profiles WHERE id = auth.uid() AND role = 'admin');
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- Families: members see their own family
+ALTER TABLE families ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS family_members_read ON families;
+CREATE POLICY family_members_read ON families FOR SELECT
+	USING (id = (SELECT auth_family_id()));
+
+-- Profiles: a member sees their own profile, an admin every profile in the family
+ALTER TABLE profiles ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own profile" ON profiles;
+DROP POLICY IF EXISTS "Users can update own profile" ON profiles;
+DROP POLICY IF EXISTS member_read_own ON profiles;
+CREATE POLICY member_read_own ON profiles FOR SELECT
+	USING (id = auth.uid());
+DROP POLICY IF EXISTS admin_manage_family ON profiles;
+CREATE POLICY admin_manage_family ON profiles FOR ALL
+	USING (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()))
+	WITH CHECK (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()));
+
+-- Member-owned tables: members read their own rows, admins manage the family's
+DO $$
+DECLARE
+	t text;
+BEGIN
+	FOREACH t IN ARRAY ARRAY['contributions', 'loans', 'loan_payments', 'ledger_events', 'loan_interest_accruals',
+	                         'loans_archive', 'loan_payments_archive'] LOOP
+		EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', t);
+		EXECUTE format('DROP POLICY IF EXISTS %I ON %I', 'Users can view own ' || replace(t, '_', ' '), t);
+		EXECUTE format('DROP POLICY IF EXISTS member_read_own ON %I', t);
+		EXECUTE format('CREATE POLICY member_read_own ON %I FOR SELECT
+			USING (family_id = (SELECT auth_family_id()) AND user_id = auth.uid())', t);
+		EXECUTE format('DROP POLICY IF EXISTS admin_manage_family ON %I', t);
+		EXECUTE format('CREATE POLICY admin_manage_family ON %I FOR ALL
+			USING (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()))
+			WITH CHECK (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()))', t);
+	END LOOP;
+END $$;
+
+-- The users table (002_remove_borrowing_limit.sql) exists on some deployments only
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('users') AND relkind = 'r') THEN
+		EXECUTE 'ALTER TABLE users ENABLE ROW LEVEL SECURITY';
+		EXECUTE 'DROP POLICY IF EXISTS member_read_own ON users';
+		EXECUTE 'CREATE POLICY member_read_own ON users FOR SELECT USING (id = auth.uid())';
+		EXECUTE 'DROP POLICY IF EXISTS admin_manage_family ON users';
+		EXECUTE 'CREATE POLICY admin_manage_family ON users FOR ALL
+			USING (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()))
+			WITH CHECK (family_id = (SELECT auth_family_id()) AND (SELECT auth_is_family_admin()))';
+	END IF;
+END $$;
@@ -0,0 +1,25 @@
+-- Per-member totals summed in the database (backend/routers/users.py list_users)
+--
+-- list_users used to fetch every completed contribution and approved loan of
+-- the family and fold them per member in Python. member_totals() does the
+-- GROUP BY here instead and returns one row per member: completed
+-- contributions and approved loan balances, exact numeric sums. Each member's
+-- sums are read from the partial indexes of 003_hot_path_indexes.sql
+-- (idx_contributions_completed_user, idx_loans_approved_user) with index-only
+-- scans, so the cost follows the family's rows, not the fund's.
+--
+-- The API falls back to fetching the rows when this function is missing.
+
+CREATE OR REPLACE FUNCTION member_totals(p_family_id uuid) RETURNS TABLE (
+	user_id uuid,
+	total_contributed numeric,
+	loan_balance numeric
+) AS $$
+	SELECT p.id,
+	       COALESCE((SELECT sum(c.amount) FROM contributions c
+	                 WHERE c.user_id = p.id AND c.status = 'completed'), 0),
+	       COALESCE((SELECT sum(l.remaining_balance) FROM loans l
+	                 WHERE l.user_id = p.id AND l.status = 'approved'), 0)
+	FROM profiles p
+	WHERE p.family_id = p_family_id;
+$$ LANGUAGE sql STABLE;